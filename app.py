@@ -2,18 +2,26 @@
 import os
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
 
-from fastapi import FastAPI, BackgroundTasks, File, UploadFile
+from fastapi import FastAPI, File, UploadFile, HTTPException, Request
+from fastapi.responses import FileResponse, StreamingResponse, Response, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from semantic_search import search_frames
-from intent_search import intent_search
-from process_video import process_video_logic
-from process_clips import process_clips_logic
+from intent_search import intent_search, clean_query
+from query_cache import prefetch_query_embedding
+import job_queue
+import inference_pool
+from inference_pool import run_inference, InferenceOverloaded, InferenceTimeout
+from source_dedup import stage_upload
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
+import threading
+import time
+import uuid
 
 # RAG imports
 try:
-    from rag_search import rag_search
+    from rag_search import rag_search_async, rag_search_stream
     from vector_store import load_captions_to_vector_db, ensure_vector_db_loaded, search_vector_db
     from rag_generator import generate_suggestions_from_vector_db
     RAG_AVAILABLE = True
@@ -86,79 +94,119 @@ def startup():
             load_transcriptions_to_vector_db(append_only=True)
         except Exception as e:
             print(f"⚠️ Could not load audio transcriptions: {e}")
+    # Ingest runs in worker processes; interrupted jobs resume from their last completed stage
+    job_queue.start_workers()
+    threading.Thread(target=_index_loop, daemon=True, name="job-indexer").start()
+
+
+@app.on_event("shutdown")
+def shutdown():
+    job_queue.stop_workers()
+    inference_pool.shutdown()
+
+
+# Backpressure: search bursts are rejected instead of queueing without bound
+@app.exception_handler(InferenceOverloaded)
+async def inference_overloaded_handler(request: Request, exc: InferenceOverloaded):
+    return JSONResponse(status_code=429, content={"detail": f"Search queue is full: {exc}"},
+                        headers={"Retry-After": "1"})
+
+@app.exception_handler(InferenceTimeout)
+async def inference_timeout_handler(request: Request, exc: InferenceTimeout):
+    return JSONResponse(status_code=503, content={"detail": f"Search timed out: {exc}"},
+                        headers={"Retry-After": "5"})
 
 
 from semantic_search import search_frames, load_data
 
-# ... imports ...
+def reload_search_indexes():
+    """Index stage of ingest jobs: pick up new captions and transcriptions for search."""
+    print("🔄 processing complete. Reloading search index...")
+    load_data()  # Reload embeddings (old method)
+    if RAG_AVAILABLE:
+        try:
+            # ALWAYS use append_only=True to preserve historical data
+            load_captions_to_vector_db(append_only=True)
+            # Also load audio transcriptions
+            from vector_store import load_transcriptions_to_vector_db
+            load_transcriptions_to_vector_db(append_only=True)
+        except Exception as e:
+            # As before the job queue: the vector DB is best-effort, the ingest still completes
+            print(f"⚠️ Vector DB load failed: {e}")
 
-# Global status
-processing_status = {"state": "idle", "message": ""}
+def _index_loop():
+    """Runs in the API process: restart crashed workers and index finished jobs."""
+    while True:
+        try:
+            job_queue.check_workers()
+            job_queue.run_pending_index(reload_search_indexes)
+        except Exception as e:
+            print(f"⚠️ Job indexer error: {e}")
+        time.sleep(job_queue.JOB_POLL_SECONDS)
 
-def update_status(msg, append_vector_db=True):
-    """
-    Update processing status. 
-    append_vector_db: Always True now to preserve historical data across all videos.
-    """
-    global processing_status
-    if msg == "COMPLETED":
-        print("🔄 processing complete. Reloading search index...")
-        load_data()  # Reload embeddings (old method)
-        if RAG_AVAILABLE:
-            try:
-                # ALWAYS use append_only=True to preserve historical data
-                load_captions_to_vector_db(append_only=True)
-                # Also load audio transcriptions
-                from vector_store import load_transcriptions_to_vector_db
-                load_transcriptions_to_vector_db(append_only=True)
-            except Exception as e:
-                print(f"⚠️ Vector DB load failed: {e}")
-        processing_status = {"state": "completed", "message": "Done! Search now."}
-    elif msg.startswith("ERROR"):
-        processing_status = {"state": "error", "message": msg}
-    else:
-        processing_status = {"state": "processing", "message": msg}
+# Job states -> states the frontend polls for on /process-status
+_STATUS_STATES = {
+    "queued": "starting",
+    "running": "processing",
+    "indexing": "processing",
+    "completed": "completed",
+    "error": "error",
+}
 
 @app.post("/process-video")
-def process_video_endpoint(req: VideoRequest, background_tasks: BackgroundTasks):
+def process_video_endpoint(req: VideoRequest):
     """Process YouTube video. Incremental: preserves existing frames and captions."""
-    global processing_status
-    processing_status = {"state": "starting", "message": "Starting job..."}
-    # Use update_status which now always uses append_only=True for vector DB
-    background_tasks.add_task(process_video_logic, req.url, update_status)
-    return {"status": "started"}
+    job_id = job_queue.create_job("video", {"youtube_url": req.url}, "Starting job...")
+    return {"status": "started", "job_id": job_id}
 
 
 @app.post("/process-clips")
 async def process_clips_endpoint(
-    background_tasks: BackgroundTasks,
     files: list[UploadFile] = File(...)
 ):
     """Process multiple uploaded video clips. Accepts mp4, mov, webm, etc."""
-    global processing_status
     if not files:
         return {"error": "No files uploaded"}
-    # Validate and read file contents (must do before bg task - request body closes)
+    # Validate and stage files on disk (must do before queuing - request body closes)
     allowed = {".mp4", ".mov", ".webm", ".avi", ".mkv"}
-    file_data = []  # [(filename, bytes), ...]
+    file_data = []  # [(filename, staged_path, sha256), ...]
+    os.makedirs("source_clips", exist_ok=True)
     for f in files:
         ext = os.path.splitext(f.filename or "")[1].lower()
         if ext in allowed:
-            content = await f.read()
-            file_data.append((f.filename or "video.mp4", content))
+            # .part is hidden from /source-clips-list; the job moves it to clip_NNN<ext>
+            staged_path = os.path.join("source_clips", f"upload_{uuid.uuid4().hex}{ext}.part")
+            # Copied in 1 MB pieces (hashed on the way) on a worker thread, never read whole into memory
+            sha256, size = await run_in_threadpool(stage_upload, f.file, staged_path)
+            await f.close()
+            print(f"📥 Staged {f.filename} ({size / 1024 / 1024:.1f} MB)")
+            file_data.append((f.filename or "video.mp4", staged_path, sha256))
         else:
             print(f"Skipping {f.filename}: unsupported format")
     if not file_data:
         return {"error": "No valid video files (supported: mp4, mov, webm, avi, mkv)"}
-    processing_status = {"state": "starting", "message": f"Processing {len(file_data)} clip(s)..."}
-    def update_status_clips(msg):
-        update_status(msg, append_vector_db=(msg == "COMPLETED"))
-    background_tasks.add_task(process_clips_logic, file_data, update_status_clips)
-    return {"status": "started", "file_count": len(file_data)}
+    job_id = job_queue.create_job("clips", {"file_data": file_data}, f"Processing {len(file_data)} clip(s)...")
+    return {"status": "started", "file_count": len(file_data), "job_id": job_id}
 
 @app.get("/process-status")
-def get_status():
-    return processing_status
+def get_status(job_id: str | None = None):
+    """Status of a job (default: most recent job) in the {state, message} shape the UI polls."""
+    job = job_queue.get_job(job_id) if job_id else job_queue.latest_job()
+    if not job:
+        return {"state": "idle", "message": ""}
+    return {"state": _STATUS_STATES.get(job["state"], job["state"]), "message": job["message"], "job_id": job["id"]}
+
+@app.get("/jobs")
+def list_jobs_endpoint(limit: int = 50, state: str | None = None):
+    """Recent ingest jobs with per-stage progress."""
+    return {"jobs": job_queue.list_jobs(limit=limit, state=state)}
+
+@app.get("/jobs/{job_id}")
+def get_job_endpoint(job_id: str):
+    job = job_queue.get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
 
 @app.get("/source-clips-list")
 def list_source_clips():
@@ -188,32 +236,22 @@ def get_video_history():
     except Exception as e:
         return {"videos": [], "total": 0, "error": str(e)}
 
+@app.get("/cache-stats")
+def get_cache_stats():
+    """Counters for the query-embedding cache, LLM response cache, clip render service and inference executor."""
+    from query_cache import cache_stats
+    from clip_service import clip_stats
+    from query_batcher import batcher_stats
+    import llm_cache
+    return {"query_embeddings": cache_stats(), "query_batches": batcher_stats(), "clips": clip_stats(),
+            "inference": inference_pool.inference_stats(), "llm_responses": llm_cache.cache_stats()}
+
 @app.get("/captions-stats")
 def get_captions_stats():
     """Return statistics about captions.txt (total captions, unique sources)."""
-    captions_file = "captions.txt"
-    if not os.path.exists(captions_file):
-        return {"total_captions": 0, "sources": {}}
-    
-    import re
-    sources = {}
-    total = 0
-    with open(captions_file, "r") as f:
-        for line in f:
-            if ": " in line:
-                total += 1
-                frame = line.strip().split(": ", 1)[0]
-                # Detect source type
-                if frame.startswith("youtube_"):
-                    m = re.match(r"youtube_(\d+)_frame", frame)
-                    source = f"youtube_{m.group(1)}" if m else "youtube"
-                elif frame.startswith("clip_"):
-                    m = re.match(r"clip_(\d+)_frame", frame)
-                    source = f"clip_{m.group(1)}" if m else "clip"
-                else:
-                    source = "legacy"
-                sources[source] = sources.get(source, 0) + 1
-    
+    from frame_catalog import caption_counts
+    # Incremental: only lines appended since the last call are read; sources come from the frame catalog
+    total, sources = caption_counts("captions.txt")
     return {"total_captions": total, "sources": sources}
 
 # Ensure dirs exist before mounting (mount happens at import, startup runs later)
@@ -223,29 +261,138 @@ os.makedirs("frames", exist_ok=True)
 
 # Mount current directory to serve video.mp4 (simple approach for dev)
 app.mount("/videos", StaticFiles(directory="."), name="videos")
-app.mount("/clips", StaticFiles(directory="clips"), name="clips")
-app.mount("/frames", StaticFiles(directory="frames"), name="frames")
 app.mount("/source_clips", StaticFiles(directory="source_clips"), name="source_clips")
 
+@app.get("/clips/{filename}")
+async def get_clip(filename: str):
+    """Serve a result clip; search returns the URL before rendering finishes, so wait for it here."""
+    from clip_service import wait_for_clip_async
+    if os.path.basename(filename) != filename or not filename.endswith(".mp4"):
+        raise HTTPException(status_code=404, detail="Clip not found")
+    path = await wait_for_clip_async(filename)
+    if not path:
+        raise HTTPException(status_code=404, detail="Clip not found")
+    return FileResponse(path, media_type="video/mp4")
+
+STREAM_CHUNK_BYTES = 1024 * 1024
+
+def _parse_range(header, size):
+    """(start, end) inclusive byte range from a single-range "bytes=a-b" header, or None if unsatisfiable."""
+    unit, _, spec = header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if first:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+        else:  # suffix range: last N bytes
+            start, end = max(0, size - int(last)), size - 1
+    except ValueError:
+        return None
+    return (start, end) if 0 <= start <= end < size else None
+
+def _iter_file(path, start, length):
+    with open(path, "rb") as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(STREAM_CHUNK_BYTES, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+@app.get("/stream/{source_id}")
+def stream_source(source_id: str, request: Request):
+    """
+    Serve the original source video with HTTP range support, so result players seek straight
+    to #t=start,end (Media Fragments) instead of loading a rendered MP4 per result.
+    """
+    import mimetypes
+    from frame_catalog import source_video_path
+    if os.path.basename(source_id) != source_id:
+        raise HTTPException(status_code=404, detail="Source not found")
+    path = source_video_path(source_id)
+    if not path:
+        raise HTTPException(status_code=404, detail="Source not found")
+    size = os.path.getsize(path)
+    media_type = mimetypes.guess_type(path)[0] or "video/mp4"
+    headers = {"Accept-Ranges": "bytes"}
+    range_header = request.headers.get("range")
+    if not range_header:
+        headers["Content-Length"] = str(size)
+        return StreamingResponse(_iter_file(path, 0, size), media_type=media_type, headers=headers)
+    byte_range = _parse_range(range_header, size)
+    if byte_range is None:
+        return Response(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(_iter_file(path, start, end - start + 1), status_code=206,
+                             media_type=media_type, headers=headers)
+
+@app.get("/frames/{frame_name}")
+async def get_frame(frame_name: str):
+    """Serve a frame thumbnail; rendered from the source video on first request (streaming ingest)."""
+    from video_utils import ensure_frame_thumbnail_async
+    if os.path.basename(frame_name) != frame_name or not frame_name.endswith(".jpg"):
+        raise HTTPException(status_code=404, detail="Frame not found")
+    path = await ensure_frame_thumbnail_async(frame_name)
+    if not path:
+        raise HTTPException(status_code=404, detail="Frame not found")
+    return FileResponse(path, media_type="image/jpeg")
+
+# Search endpoints are async: embedding/Chroma/NumPy work runs on the size-capped inference
+# executor (429/503 when it is saturated), so polling endpoints keep their threads
 @app.post("/search")
-def search(query: str):
-    return search_frames(query)
+async def search(query: str):
+    await prefetch_query_embedding(query)  # batched on the event loop, before taking an executor slot
+    return await run_inference(search_frames, query)
 
 @app.post("/intent-search")
-def intent(query: str):
-    return intent_search(query)
+async def intent(query: str):
+    await prefetch_query_embedding(clean_query(query))
+    return await run_inference(intent_search, query)
 
 # RAG endpoints
 if RAG_AVAILABLE:
     @app.post("/rag-search")
-    def rag_search_endpoint(query: str):
-        """RAG-enhanced search with explanations (run after user picks a suggestion)."""
-        return rag_search(query)
+    async def rag_search_endpoint(query: str, explain: bool = True):
+        """RAG-enhanced search with explanations (run after user picks a suggestion). explain=false returns results only."""
+        return await rag_search_async(query, explain=explain)
+
+    @app.post("/rag-search/stream")
+    async def rag_search_stream_endpoint(query: str, audio_only: bool = False, explain: bool = True,
+                                         format: str = "sse"):
+        """
+        Streaming /rag-search: hits as soon as retrieval finishes, then clip-ready and explanation
+        token events. format=sse (text/event-stream) or ndjson (one JSON object per line).
+        """
+        import json
+        events = rag_search_stream(query, audio_only=audio_only, explain=explain)
+        # Pull the first event before responding so a full inference queue still returns 429/503
+        first = await events.__anext__()
+
+        async def body():
+            async for event in _prepend(first, events):
+                if format == "ndjson":
+                    yield json.dumps(event) + "\n"
+                else:
+                    yield f"event: {event['event']}\ndata: {json.dumps(event)}\n\n"
+
+        media_type = "application/x-ndjson" if format == "ndjson" else "text/event-stream"
+        return StreamingResponse(body(), media_type=media_type,
+                                 headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+    async def _prepend(first, rest):
+        yield first
+        async for item in rest:
+            yield item
 
     @app.post("/audio-search")
-    def audio_search_endpoint(query: str):
+    async def audio_search_endpoint(query: str, explain: bool = True):
         """Audio-focused search: prioritizes dialog matches, generates clips for matched speech."""
-        return rag_search(query, audio_only=True)
+        return await rag_search_async(query, audio_only=True, explain=explain)
 
 # Production Planner endpoints
 if PRODUCTION_PLANNER_AVAILABLE:
@@ -1,16 +1,28 @@
 """
 Audio processing module: Extract audio from video, transcribe with Whisper, and store transcriptions.
+AUDIO_PIPELINE="stream" (default) pipes float32 PCM from ffmpeg straight into the transcriber;
+"wav" extracts audio_extracts/<prefix>.wav first. WAVs are deleted after transcription unless
+KEEP_AUDIO_WAV=1 (which, in stream mode, also writes one while streaming).
 """
 import os
 import subprocess
 import json
 import re
+import threading
+import wave
 from datetime import datetime
 
+import numpy as np
+
 # Use same base dir as vector_store so transcriptions are always found
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 AUDIO_DIR = os.path.join(BASE_DIR, "audio_extracts")
 TRANSCRIPTIONS_FILE = os.path.join(BASE_DIR, "audio_transcriptions.txt")
+AUDIO_PIPELINE = os.getenv("AUDIO_PIPELINE", "stream")
+KEEP_AUDIO_WAV = os.getenv("KEEP_AUDIO_WAV", "0") == "1"
+AUDIO_SAMPLE_RATE = 16000
+AUDIO_BLOCK_SECONDS = 10
+_transcriptions_lock = threading.Lock()
 
 def default_logger(msg):
     print(msg)
@@ -51,40 +63,77 @@ def extract_audio_from_video(video_path: str, output_audio_path: str, update_sta
         update_status(f"⚠️ Unexpected error in audio extraction: {e}")
         raise
 
-def transcribe_audio_with_whisper(audio_path: str, video_prefix: str, update_status=default_logger):
+def stream_audio_pcm(video_path: str, wav_path: str = None, block_seconds: float = AUDIO_BLOCK_SECONDS):
+    """
+    Yield the video's audio as float32 16 kHz mono NumPy blocks read from an ffmpeg stdout pipe
+    (nothing written to disk unless wav_path is given). Raises CalledProcessError if ffmpeg fails.
+    """
+    cmd = [
+        "ffmpeg",
+        "-v", "error",
+        "-i", video_path,
+        "-vn",  # No video
+        "-f", "f32le",  # Raw float32 PCM
+        "-ar", str(AUDIO_SAMPLE_RATE),
+        "-ac", "1",  # Mono
+        "pipe:1"
+    ]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    wav = None
+    if wav_path:
+        os.makedirs(os.path.dirname(wav_path), exist_ok=True)
+        wav = wave.open(wav_path, "wb")
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(AUDIO_SAMPLE_RATE)
+    block_bytes = int(block_seconds * AUDIO_SAMPLE_RATE) * 4
+    try:
+        while True:
+            data = proc.stdout.read(block_bytes)
+            if not data:
+                break
+            block = np.frombuffer(data[:len(data) - len(data) % 4], dtype=np.float32)
+            if wav:
+                wav.writeframes((np.clip(block, -1.0, 1.0) * 32767).astype(np.int16).tobytes())
+            yield block
+        if proc.wait() != 0:
+            raise subprocess.CalledProcessError(proc.returncode, cmd)
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+        proc.stdout.close()
+        if wav:
+            wav.close()
+
+def transcribe_audio_with_whisper(audio_path: str, video_prefix: str, update_status=default_logger, video_path: str = None,
+                                  stats: dict = None):
     """
     Transcribe audio using Whisper and return segments with timestamps.
+    Audio without speech (per the VAD) skips Whisper entirely. The default chunked engine sends only
+    speech regions and drops segments Whisper rates as non-speech; WHISPER_ENGINE=single sends the
+    whole file, as before.
+    audio_path=None streams the audio of video_path through an ffmpeg pipe instead of reading a WAV.
+    stats, if given, is filled with duration_seconds, speech_seconds and speech_ratio.
     Returns list of dicts: [{"start": float, "end": float, "text": str}, ...]
     """
     try:
-        import whisper
-        
-        update_status("🤖 Loading Whisper model...")
-        # Use base model for balance of speed and accuracy
-        # Options: tiny, base, small, medium, large
-        model = whisper.load_model("base")
-        
-        update_status(f"🎤 Transcribing audio: {os.path.basename(audio_path)}...")
-        result = model.transcribe(
-            audio_path,
-            language=None,  # Auto-detect language
-            task="transcribe",
-            verbose=False
-        )
-        
-        segments = []
-        for segment in result.get("segments", []):
-            segments.append({
-                "start": segment["start"],
-                "end": segment["end"],
-                "text": segment["text"].strip()
-            })
+        # VAD-chunked and parallel by default (WHISPER_ENGINE, WHISPER_BACKEND, WHISPER_WORKERS);
+        # model size from WHISPER_MODEL (tiny, base, small, medium, large)
+        from transcription_engine import transcribe
+
+        if audio_path:
+            segments = transcribe(audio_path, update_status, stats=stats)
+        else:
+            wav_path = get_audio_path(video_prefix) if KEEP_AUDIO_WAV else None
+            segments = transcribe(stream_audio_pcm(video_path, wav_path), update_status,
+                                  label=f"audio of {os.path.basename(video_path)}", stats=stats)
         
         update_status(f"✅ Transcribed {len(segments)} audio segments")
         return segments
         
     except ImportError:
-        update_status("⚠️ Whisper not installed. Install with: pip install openai-whisper")
+        update_status("⚠️ Whisper not installed. Install with: pip install openai-whisper (or faster-whisper)")
         return []
     except Exception as e:
         update_status(f"⚠️ Error transcribing audio: {e}")
@@ -102,7 +151,8 @@ def save_transcriptions_to_file(segments: list, video_prefix: str, video_path: s
     
     update_status(f"💾 Saving {len(segments)} transcriptions...")
     
-    with open(TRANSCRIPTIONS_FILE, "a", encoding="utf-8") as f:
+    # Lock so concurrent ingest workers don't interleave lines
+    with _transcriptions_lock, open(TRANSCRIPTIONS_FILE, "a", encoding="utf-8") as f:
         for segment in segments:
             # Create a unique ID based on video prefix and timestamp
             # Format: youtube_001_audio_123.45 or clip_001_audio_123.45
@@ -117,7 +167,7 @@ def save_transcriptions_to_file(segments: list, video_prefix: str, video_path: s
 def process_audio_for_video(video_path: str, video_prefix: str, update_status=default_logger):
     """
     Complete audio processing pipeline:
-    1. Extract audio from video
+    1. Extract audio from video (WAV mode only; stream mode pipes it into step 2)
     2. Transcribe with Whisper
     3. Save transcriptions to file
     
@@ -125,28 +175,54 @@ def process_audio_for_video(video_path: str, video_prefix: str, update_status=de
     """
     try:
         # 1. Extract audio
-        os.makedirs(AUDIO_DIR, exist_ok=True)
-        audio_filename = f"{video_prefix}.wav"
-        audio_path = os.path.join(AUDIO_DIR, audio_filename)
-        
-        extract_audio_from_video(video_path, audio_path, update_status)
-        
-        # 2. Transcribe
-        segments = transcribe_audio_with_whisper(audio_path, video_prefix, update_status)
-        
-        if not segments:
-            update_status("⚠️ No audio transcriptions generated")
-            return []
+        audio_path = None
+        if AUDIO_PIPELINE == "wav":
+            audio_path = get_audio_path(video_prefix)
+            extract_audio_from_video(video_path, audio_path, update_status)
         
-        # 3. Save to file
-        save_transcriptions_to_file(segments, video_prefix, video_path, update_status)
-        
-        return segments
+        # 2-3. Transcribe and save
+        return transcribe_and_save(audio_path, video_prefix, video_path, update_status)
         
     except Exception as e:
         update_status(f"⚠️ Error processing audio: {e}")
         return []
 
+def get_audio_path(video_prefix: str):
+    """Path of the extracted WAV for a video prefix (audio_extracts/<prefix>.wav)."""
+    os.makedirs(AUDIO_DIR, exist_ok=True)
+    return os.path.join(AUDIO_DIR, f"{video_prefix}.wav")
+
+def transcribe_and_save(audio_path: str, video_prefix: str, video_path: str, update_status=default_logger):
+    """
+    Transcribe already-extracted audio (or, with audio_path=None, stream it from video_path)
+    and append to audio_transcriptions.txt.
+    Split from process_audio_for_video so ingest can extract audio for the next clip
+    while this one is transcribed. Returns list of transcription segments.
+    """
+    stats = {}
+    segments = transcribe_audio_with_whisper(audio_path, video_prefix, update_status, video_path=video_path, stats=stats)
+    if audio_path and not KEEP_AUDIO_WAV and os.path.exists(audio_path):
+        os.remove(audio_path)
+    if stats:
+        update_status(f"🗣️ Speech in {video_prefix}: {stats['speech_ratio']:.0%} of {stats['duration_seconds']:.0f}s")
+        record_speech_ratio(video_prefix, video_path, stats)
+
+    if not segments:
+        update_status("⚠️ No audio transcriptions generated")
+        return []
+
+    save_transcriptions_to_file(segments, video_prefix, video_path, update_status)
+    return segments
+
+def record_speech_ratio(video_prefix: str, video_path: str, stats: dict):
+    """
+    Store a source's speech_ratio / speech_seconds in video_history.json, on its existing entry
+    (YouTube videos) or a new "clip" entry for uploaded clips.
+    """
+    from source_dedup import update_history_entry
+    update_history_entry(video_prefix, video_path=video_path, speech_ratio=stats["speech_ratio"],
+                         speech_seconds=stats["speech_seconds"])
+
 def get_existing_transcriptions():
     """Return set of transcription IDs already in audio_transcriptions.txt"""
     if not os.path.exists(TRANSCRIPTIONS_FILE):
@@ -0,0 +1,88 @@
+"""
+Compare the single-call Whisper path with the chunked engine (transcription_engine).
+Reports wall time, real-time factor and word error rate for each audio/video file given.
+WER is measured against --reference (a plain-text transcript) when provided, otherwise
+against the single-call output.
+
+    python benchmark_transcription.py audio_extracts/clip_001.wav [--reference clip_001.txt]
+    python benchmark_transcription.py source_clips/clip_001.mp4 --backend faster
+"""
+import os
+import re
+import sys
+import time
+import argparse
+
+import transcription_engine
+from audio_processor import extract_audio_from_video, get_audio_path
+
+def _words(text):
+    return re.findall(r"[a-z0-9']+", text.lower())
+
+def word_error_rate(reference, hypothesis):
+    """Word-level Levenshtein distance divided by the reference length."""
+    ref, hyp = _words(reference), _words(hypothesis)
+    if not ref:
+        return 0.0 if not hyp else 1.0
+    prev = list(range(len(hyp) + 1))
+    for i, r in enumerate(ref, 1):
+        cur = [i] + [0] * len(hyp)
+        for j, h in enumerate(hyp, 1):
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (r != h))
+        prev = cur
+    return prev[-1] / len(ref)
+
+def _as_wav(path):
+    if path.lower().endswith(".wav"):
+        return path
+    prefix = "bench_" + os.path.splitext(os.path.basename(path))[0]
+    return extract_audio_from_video(path, get_audio_path(prefix))
+
+def _timed(fn, *args, **kwargs):
+    started = time.perf_counter()
+    segments = fn(*args, **kwargs)
+    return segments, time.perf_counter() - started
+
+def benchmark(path, backend=None, reference=None):
+    audio_path = _as_wav(path)
+    duration = len(transcription_engine.load_wav(audio_path)) / transcription_engine.SAMPLE_RATE
+    backend = transcription_engine.resolve_backend(backend)
+
+    # Load models up front (here and in every chunk worker) so neither run is charged for it
+    transcription_engine.warm_pool(backend)
+    single, single_s = _timed(transcription_engine.transcribe_single, audio_path, backend)
+    chunked, chunked_s = _timed(transcription_engine.transcribe_chunked, audio_path, backend, lambda _msg: None)
+
+    single_text = " ".join(s["text"] for s in single)
+    chunked_text = " ".join(s["text"] for s in chunked)
+    ref_text = reference if reference is not None else single_text
+    print(f"\n📊 {os.path.basename(path)} ({duration:.1f}s audio, {backend}-whisper, "
+          f"{transcription_engine.WHISPER_WORKERS} workers)")
+    print(f"{'path':<10}{'wall s':>10}{'RTF':>8}{'segments':>10}{'WER':>8}")
+    for name, segments, seconds, text in (("single", single, single_s, single_text),
+                                          ("chunked", chunked, chunked_s, chunked_text)):
+        wer = word_error_rate(ref_text, text)
+        print(f"{name:<10}{seconds:>10.2f}{seconds / max(duration, 1e-9):>8.3f}{len(segments):>10}{wer:>8.3f}")
+    print(f"speedup: {single_s / max(chunked_s, 1e-9):.2f}x"
+          + ("" if reference is not None else " (WER relative to the single-call output)"))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("paths", nargs="+", help="WAV files or videos (audio is extracted first)")
+    parser.add_argument("--backend", choices=["auto", "faster", "openai"], default=None)
+    parser.add_argument("--reference", help="reference transcript (text file) for a single input")
+    args = parser.parse_args()
+    if args.reference and len(args.paths) != 1:
+        sys.exit("--reference applies to a single input")
+    reference = None
+    if args.reference:
+        with open(args.reference, "r", encoding="utf-8") as f:
+            reference = f.read()
+    try:
+        for path in args.paths:
+            benchmark(path, args.backend, reference)
+    finally:
+        transcription_engine.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+"""
+Batched frame captioning engine (ViT-GPT2).
+Shared by process_clips.py, process_video.py and caption_frames.py.
+JPEGs are decoded on a thread pool that prefetches the next batch while the model
+generates captions for the current one. caption_stream takes in-memory frames
+(e.g. from frame_sampling.iter_frames) instead of files.
+Captions are appended to captions.txt per batch. Near-duplicate frames of a clip (perceptual
+dHash within CAPTION_PHASH_DISTANCE bits of a recently captioned frame) reuse its caption.
+"""
+import os
+import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from model_registry import CAPTION_MODEL_NAME, get_caption_model
+
+CAPTIONS_FILE = "captions.txt"
+# Frames per model.generate call; larger batches keep more CPU cores busy
+CAPTION_BATCH_SIZE = int(os.getenv("CAPTION_BATCH_SIZE", "16"))
+# Threads used to decode JPEGs ahead of the model
+CAPTION_DECODE_WORKERS = int(os.getenv("CAPTION_DECODE_WORKERS", str(min(8, os.cpu_count() or 1))))
+MAX_LENGTH = 16
+NUM_BEAMS = 4
+# Max Hamming distance (of 64 bits) for two frames to share a caption; -1 disables sharing
+CAPTION_PHASH_DISTANCE = int(os.getenv("CAPTION_PHASH_DISTANCE", "2"))
+# Recently captioned frames compared against (static shots are consecutive frames)
+PHASH_RECENT = 8
+
+def default_logger(msg):
+    print(msg)
+
+def load_caption_model():
+    """Shared ViT-GPT2 captioner from the model registry. Returns (model, feature_extractor, tokenizer, device)."""
+    return get_caption_model(CAPTION_MODEL_NAME)
+
+def _decode_image(path):
+    """Open a frame as RGB. Returns (path, image_or_None, error_or_None)."""
+    from PIL import Image
+    try:
+        with Image.open(path) as img:
+            return path, img.convert("RGB"), None
+    except Exception as e:
+        return path, None, e
+
+def _decode_batch(executor, paths):
+    """Submit decode jobs for one batch; returns list of futures (order preserved)."""
+    return [executor.submit(_decode_image, p) for p in paths]
+
+def generate_captions(images, captioner=None):
+    """Caption a list of PIL images in a single generate call. Returns list of strings."""
+    import torch
+
+    model, feature_extractor, tokenizer, device = captioner or load_caption_model()
+    pixel_values = feature_extractor(images=images, return_tensors="pt").pixel_values.to(device)
+    with torch.no_grad():
+        output_ids = model.generate(pixel_values, max_length=MAX_LENGTH, num_beams=NUM_BEAMS)
+    return [t.strip() for t in tokenizer.batch_decode(output_ids, skip_special_tokens=True)]
+
+def dhash(img) -> int:
+    """64-bit difference hash: brightness gradients of a 9x8 grayscale thumbnail."""
+    import numpy as np
+    from PIL import Image
+
+    pixels = np.asarray(img.convert("L").resize((9, 8), Image.BILINEAR), dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+def _near(a, b):
+    return bin(a ^ b).count("1") <= CAPTION_PHASH_DISTANCE
+
+def _shared_caption(phash, recent):
+    """Caption of a recent frame within CAPTION_PHASH_DISTANCE bits, else None."""
+    for other, caption in reversed(recent):
+        if _near(phash, other):
+            return caption
+    return None
+
+def _caption_batches(batches, captions_file, update_status, captioner, total=None):
+    """
+    Shared loop: batches yields lists of (frame_name, image_or_None, error_or_None).
+    Captions each batch in one generate call and appends lines to captions_file.
+    Returns list of captioned frame names.
+    """
+    captioned = []
+    recent = []  # [(dhash, caption)] of the last PHASH_RECENT captioned frames
+    shared = 0
+    t0 = time.perf_counter()
+    with open(captions_file, "a") as outf:
+        for batch in batches:
+            frames, images = [], []
+            for frame, img, err in batch:
+                if err is not None:
+                    update_status(f"⚠️ Caption error for {frame}: {err}")
+                    continue
+                frames.append(frame)
+                images.append(img)
+            if not images:
+                continue
+
+            # Only frames that differ from recent ones (and from each other) go to the model
+            hashes = [dhash(img) for img in images] if CAPTION_PHASH_DISTANCE >= 0 else [None] * len(images)
+            captions = [None] * len(images)
+            same_as = {}  # index -> earlier index in this batch whose caption it shares
+            to_generate = []
+            for i, phash in enumerate(hashes):
+                if phash is not None:
+                    captions[i] = _shared_caption(phash, recent)
+                    if captions[i] is None:
+                        match = next((j for j in to_generate if _near(phash, hashes[j])), None)
+                        if match is not None:
+                            same_as[i] = match
+                if captions[i] is None and i not in same_as:
+                    to_generate.append(i)
+            try:
+                generated = generate_captions([images[i] for i in to_generate], captioner) if to_generate else []
+            except Exception as e:
+                # Retry one frame at a time so a single bad frame doesn't cost the whole batch
+                update_status(f"⚠️ Caption error for batch starting at {frames[0]}: {e}; retrying frames one by one")
+                generated = []
+                for i in to_generate:
+                    try:
+                        generated.extend(generate_captions([images[i]], captioner))
+                    except Exception as frame_err:
+                        update_status(f"⚠️ Caption error for {frames[i]}: {frame_err}")
+                        generated.append(None)
+            for i, caption in zip(to_generate, generated):
+                captions[i] = caption
+            for i, match in same_as.items():
+                captions[i] = captions[match]
+            shared += len(images) - len(to_generate)
+            recent.extend((phash, caption) for phash, caption in zip(hashes, captions)
+                          if phash is not None and caption is not None)
+            del recent[:-PHASH_RECENT]
+
+            done = [(frame, caption) for frame, caption in zip(frames, captions) if caption is not None]
+            outf.writelines(f"{frame}: {caption}\n" for frame, caption in done)
+            outf.flush()  # Keep progress on disk in case of crash
+            captioned.extend(frame for frame, _ in done)
+
+            elapsed = time.perf_counter() - t0
+            fps = len(captioned) / elapsed if elapsed > 0 else 0.0
+            progress = f"{len(captioned)}/{total}" if total else f"{len(captioned)}"
+            update_status(f"🤖 Captioned {progress} frames ({fps:.1f} frames/sec)")
+
+    elapsed = time.perf_counter() - t0
+    fps = len(captioned) / elapsed if elapsed > 0 else 0.0
+    update_status(f"✅ Captioned {len(captioned)} frames in {elapsed:.1f}s ({fps:.1f} frames/sec"
+                  + (f", {shared} near-duplicates shared a caption)" if shared else ")"))
+    return captioned
+
+def caption_frames(frame_paths, captions_file=CAPTIONS_FILE, batch_size=None,
+                   update_status=default_logger, captioner=None):
+    """
+    Caption frames in batches and append "frame.jpg: caption" lines to captions_file.
+    Decoding of batch N+1 overlaps with generation of batch N.
+    Returns number of frames captioned.
+    """
+    if not frame_paths:
+        return 0
+    batch_size = max(1, batch_size or CAPTION_BATCH_SIZE)
+    captioner = captioner or load_caption_model()
+    path_batches = [frame_paths[i:i + batch_size] for i in range(0, len(frame_paths), batch_size)]
+
+    with ThreadPoolExecutor(max_workers=max(1, CAPTION_DECODE_WORKERS)) as executor:
+        def decoded_batches():
+            pending = _decode_batch(executor, path_batches[0])
+            for b in range(len(path_batches)):
+                decoded = [f.result() for f in pending]
+                # Prefetch next batch while the model works on this one
+                if b + 1 < len(path_batches):
+                    pending = _decode_batch(executor, path_batches[b + 1])
+                yield [(os.path.basename(p), img, err) for p, img, err in decoded]
+
+        captioned = _caption_batches(decoded_batches(), captions_file, update_status, captioner,
+                                     total=len(frame_paths))
+    return len(captioned)
+
+def caption_stream(frames, captions_file=CAPTIONS_FILE, batch_size=None,
+                   update_status=default_logger, captioner=None, prefetch_batches=2):
+    """
+    Caption an iterable of (frame_name, PIL.Image) without touching disk for images.
+    A producer thread pulls frames (e.g. from an ffmpeg pipe) into a bounded queue
+    so video decoding overlaps generation. Returns list of captioned frame names.
+    """
+    batch_size = max(1, batch_size or CAPTION_BATCH_SIZE)
+    captioner = captioner or load_caption_model()
+    batch_queue = queue.Queue(maxsize=max(1, prefetch_batches))
+    stop = threading.Event()
+    _DONE = object()
+
+    def put(item):
+        # Give up if the consumer has stopped, instead of blocking forever on a full queue
+        while not stop.is_set():
+            try:
+                batch_queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        batch = []
+        try:
+            for frame, img in frames:
+                batch.append((frame, img, None))
+                if len(batch) >= batch_size:
+                    if not put(batch):
+                        return
+                    batch = []
+            if batch and not put(batch):
+                return
+            put(_DONE)
+        except Exception as e:
+            put(e)
+
+    def consumed_batches():
+        while True:
+            item = batch_queue.get()
+            if item is _DONE:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        return _caption_batches(consumed_batches(), captions_file, update_status, captioner)
+    finally:
+        stop.set()
+
+def caption_video_stream(video_path, output_prefix, captions_file=CAPTIONS_FILE, skip_frames=None,
+                         batch_size=None, update_status=default_logger):
+    """
+    Streaming ingest: decode sampled frames straight from the video into the captioner.
+    No JPEGs are written; thumbnails are rendered on demand (video_utils.ensure_frame_thumbnail).
+    Records frame timestamps and returns number of frames captioned.
+    """
+    from frame_sampling import iter_frames, save_frame_timestamps
+
+    skip_frames = skip_frames or set()
+    kept = []
+
+    def frames():
+        for name, ts, img in iter_frames(video_path, output_prefix):
+            kept.append((name, ts))
+            if name not in skip_frames:
+                yield name, img
+
+    captioned = caption_stream(frames(), captions_file, batch_size, update_status)
+    save_frame_timestamps(kept, video_path)
+    return len(captioned)
@@ -0,0 +1,176 @@
+"""
+Clip render service for search results.
+Search requests a clip and gets its filename back immediately; the ffmpeg encode runs on a
+bounded pool (CLIP_RENDER_WORKERS concurrent ffmpeg processes) and /clips/{filename} waits
+for it. Concurrent requests for the same file share one render. clips/ is kept under
+CLIPS_MAX_MB by evicting least-recently-used files (mtime is refreshed on every use).
+"""
+import os
+import glob
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from video_utils import CLIPS_DIR, clip_spec, render_clip, _get_source_video_for_frame
+
+CLIP_RENDER_WORKERS = int(os.getenv("CLIP_RENDER_WORKERS", "2"))
+CLIPS_MAX_MB = int(os.getenv("CLIPS_MAX_MB", "2048"))
+CLIP_WAIT_SECONDS = float(os.getenv("CLIP_WAIT_SECONDS", "60"))
+CLIP_SPECS_MAX = 4096  # render specs remembered so an evicted clip can be rendered again
+# "stream": result URLs point into the source via /stream/{source_id}#t=start,end (no file written);
+# "render": an MP4 per result in clips/
+CLIP_DELIVERY = os.getenv("CLIP_DELIVERY", "stream")
+SERVER_URL = "http://localhost:8000"
+
+# Each worker thread drives one ffmpeg process, so this bounds concurrent encodes
+_executor = ThreadPoolExecutor(max_workers=CLIP_RENDER_WORKERS, thread_name_prefix="clip-render")
+_lock = threading.Lock()
+_evict_lock = threading.Lock()
+_inflight = {}           # filename -> Future
+_specs = OrderedDict()   # filename -> (source_video, start, end)
+_stats = {"requests": 0, "cache_hits": 0, "renders": 0, "shared_renders": 0, "errors": 0, "evicted": 0}
+
+def _touch(path):
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+def _remember_spec(filename, spec):
+    _specs[filename] = spec
+    _specs.move_to_end(filename)
+    while len(_specs) > CLIP_SPECS_MAX:
+        _specs.popitem(last=False)
+
+def _render(filename, source_video, start, end):
+    output_path = os.path.join(CLIPS_DIR, filename)
+    try:
+        print(f"Generating clip: {filename}...")
+        ok = render_clip(source_video, start, end, output_path)
+        with _lock:
+            _stats["renders" if ok else "errors"] += 1
+        if ok:
+            evict_clips()
+        return output_path if ok else None
+    finally:
+        with _lock:
+            _inflight.pop(filename, None)
+
+def _schedule(filename, spec):
+    """Future for filename's render; must hold _lock. Joins an in-flight render if there is one."""
+    future = _inflight.get(filename)
+    if future is not None:
+        _stats["shared_renders"] += 1
+        return future
+    future = _executor.submit(_render, filename, *spec)
+    _inflight[filename] = future
+    return future
+
+def request_clip(start: float, end: float, best_frame: str = None) -> str:
+    """Return the clip filename right away; render it in the background if it doesn't exist."""
+    filename, spec = clip_spec(start, end, best_frame)
+    output_path = os.path.join(CLIPS_DIR, filename)
+    with _lock:
+        _stats["requests"] += 1
+        _remember_spec(filename, spec)
+        if filename not in _inflight and os.path.exists(output_path):
+            _stats["cache_hits"] += 1
+            _touch(output_path)
+            return filename
+        _schedule(filename, spec)
+    return filename
+
+def _clip_future(filename: str):
+    """(path, None) if the clip is on disk, (None, Future) if it is rendering, (None, None) if unknown."""
+    output_path = os.path.join(CLIPS_DIR, filename)
+    with _lock:
+        future = _inflight.get(filename)
+        if future is None:
+            if os.path.exists(output_path):
+                _touch(output_path)
+                return output_path, None
+            spec = _specs.get(filename)
+            if spec is None:
+                return None, None
+            future = _schedule(filename, spec)
+    return None, future
+
+def wait_for_clip(filename: str, timeout: float = CLIP_WAIT_SECONDS):
+    """Path of a rendered clip, waiting for an in-flight render (or re-rendering an evicted one)."""
+    path, future = _clip_future(filename)
+    if future is None:
+        return path
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeoutError:
+        return None
+
+async def wait_for_clip_async(filename: str, timeout: float = CLIP_WAIT_SECONDS):
+    """wait_for_clip for async endpoints: awaits the render without holding a thread."""
+    path, future = _clip_future(filename)
+    if future is None:
+        return path
+    try:
+        return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout)
+    except asyncio.TimeoutError:
+        return None
+
+async def wait_for_url_async(video_url: str, timeout: float = CLIP_WAIT_SECONDS) -> bool:
+    """True once a result URL is playable (stream URLs always are; /clips URLs when rendered)."""
+    marker = f"{SERVER_URL}/clips/"
+    if not video_url or not video_url.startswith(marker):
+        return True
+    return await wait_for_clip_async(video_url[len(marker):], timeout) is not None
+
+def ensure_clip(start: float, end: float, best_frame: str = None) -> str:
+    """Blocking variant: request the clip and wait until it is rendered. Returns the filename."""
+    filename = request_clip(start, end, best_frame)
+    wait_for_clip(filename)
+    return filename
+
+def clip_url(start: float, end: float, best_frame: str = None, delivery: str = None) -> str:
+    """Playable URL for a result: a Media Fragments URL on /stream, or a rendered clip under /clips."""
+    if (delivery or CLIP_DELIVERY) == "stream":
+        _, source_id = _get_source_video_for_frame(best_frame or "frame_0001.jpg")
+        return f"{SERVER_URL}/stream/{source_id or 'legacy'}#t={round(start, 2)},{round(end, 2)}"
+    return f"{SERVER_URL}/clips/{request_clip(start, end, best_frame)}"
+
+def evict_clips(max_mb: int = None):
+    """Delete least-recently-used clips until clips/ fits in max_mb (in-flight renders are kept)."""
+    budget = (CLIPS_MAX_MB if max_mb is None else max_mb) * 1024 * 1024
+    with _evict_lock:
+        entries = []
+        for path in glob.glob(os.path.join(CLIPS_DIR, "*.mp4")):
+            if path.endswith(".part.mp4"):
+                continue  # render in progress
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        if total <= budget:
+            return 0
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= budget:
+                break
+            with _lock:
+                if os.path.basename(path) in _inflight:
+                    continue
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+            total -= size
+            removed += 1
+        with _lock:
+            _stats["evicted"] += removed
+        if removed:
+            print(f"🧹 Evicted {removed} clips (clips/ now {total / 1024 / 1024:.0f} MB)")
+        return removed
+
+def clip_stats():
+    with _lock:
+        return {**_stats, "in_flight": len(_inflight), "workers": CLIP_RENDER_WORKERS, "max_mb": CLIPS_MAX_MB}
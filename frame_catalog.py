@@ -0,0 +1,285 @@
+"""
+Frame catalog: one row per extracted frame with integer source ID, frame index,
+timestamp and source video path. Rows are written once at ingest (frame_catalog.db)
+and loaded into NumPy arrays plus a frame name -> row dict, so search, clip rendering
+and /captions-stats look frames up in O(1) instead of parsing filenames with regexes.
+Frames ingested before the catalog existed are added by backfill_from_captions().
+"""
+import os
+import re
+import glob
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+from incremental_source import make_mark, valid_offset, iter_appended_lines
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CATALOG_DB = os.path.join(BASE_DIR, "frame_catalog.db")
+SOURCE_CLIPS_DIR = os.path.join(BASE_DIR, "source_clips")
+LEGACY_VIDEO_PATH = "video.mp4"
+LEGACY_SOURCE = "legacy"  # frame_0001.jpg from the original single-video mode
+
+# Only used when a frame is registered (ingest/backfill), never per query
+_FRAME_NAME_RE = re.compile(r"^(?:((?:clip|youtube)_\d+)_)?frame_(\d+)\.jpg$")
+
+_lock = threading.RLock()
+_state = {
+    "mtime": None,
+    "last_rowid": 0,
+    "rows": {},                                   # frame name -> array row
+    "names": [],                                  # per row: frame name
+    "source_codes": np.empty(0, dtype=np.int32),  # per row: sources.id
+    "frame_index": np.empty(0, dtype=np.int32),
+    "timestamps": np.empty(0, dtype=np.float64),
+    "source_names": {},                           # sources.id -> name
+    "source_ids": {},                             # name -> sources.id
+    "source_paths": {},                           # sources.id -> video path
+    "by_number": {},                              # (kind, number) -> name, for clip_1 -> clip_001
+}
+_caption_counts = {"mark": None, "counts": {}}
+
+@contextmanager
+def _db():
+    conn = sqlite3.connect(CATALOG_DB, timeout=30)
+    try:
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS sources ("
+            "id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL, path TEXT)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS frames ("
+            "name TEXT PRIMARY KEY, source_id INTEGER NOT NULL, "
+            "frame_index INTEGER NOT NULL, timestamp REAL NOT NULL)"
+        )
+        yield conn
+    finally:
+        conn.close()
+
+def parse_frame_name(frame: str):
+    """(source name, frame index) from a frame filename; (None, None) if it isn't one."""
+    m = _FRAME_NAME_RE.match(os.path.basename(frame))
+    if not m:
+        return None, None
+    return m.group(1) or LEGACY_SOURCE, int(m.group(2))
+
+def resolve_source_path(source: str):
+    """Locate the video a source's frames came from (source_clips/<source>.*, else video.mp4)."""
+    if source and source != LEGACY_SOURCE:
+        matches = glob.glob(os.path.join(SOURCE_CLIPS_DIR, f"{source}.*"))
+        matches = [p for p in matches if not p.endswith((".part", ".json", ".tmp"))]  # skip uploads, keyframe indexes
+        if matches:
+            return matches[0]
+        if not source.startswith("youtube_"):
+            return None
+    return LEGACY_VIDEO_PATH
+
+def register_frames(frames, source_path: str = None):
+    """Record (frame_path_or_name, timestamp) pairs. Called at ingest, once per extracted frame."""
+    rows = []
+    for frame, ts in frames:
+        name = os.path.basename(frame)
+        source, index = parse_frame_name(name)
+        if source is not None:
+            rows.append((name, source, index, float(ts)))
+    if not rows:
+        return 0
+    with _db() as conn, conn:
+        source_ids = {}
+        for source in {r[1] for r in rows}:
+            path = source_path or resolve_source_path(source)
+            conn.execute(
+                "INSERT INTO sources (name, path) VALUES (?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET path = COALESCE(excluded.path, sources.path)",
+                (source, path),
+            )
+            source_ids[source] = conn.execute("SELECT id FROM sources WHERE name = ?", (source,)).fetchone()[0]
+        conn.executemany(
+            "INSERT OR REPLACE INTO frames (name, source_id, frame_index, timestamp) VALUES (?, ?, ?, ?)",
+            [(name, source_ids[source], index, ts) for name, source, index, ts in rows],
+        )
+    return len(rows)
+
+def _refresh():
+    """Load rows added since the last refresh (ingest runs in other processes)."""
+    try:
+        mtime = os.path.getmtime(CATALOG_DB)
+    except OSError:
+        return
+    with _lock:
+        if _state["mtime"] == mtime:
+            return
+        with _db() as conn:
+            sources = conn.execute("SELECT id, name, path FROM sources").fetchall()
+            new = conn.execute(
+                "SELECT rowid, name, source_id, frame_index, timestamp FROM frames WHERE rowid > ? ORDER BY rowid",
+                (_state["last_rowid"],),
+            ).fetchall()
+        # Built in locals and swapped in with one update, so a reader's snapshot (_snapshot) never
+        # sees rows pointing past the end of the arrays
+        update = {
+            "mtime": mtime,
+            "source_names": {sid: name for sid, name, _ in sources},
+            "source_ids": {name: sid for sid, name, _ in sources},
+            "source_paths": {sid: path for sid, _, path in sources},
+            "by_number": {},
+        }
+        for _, name, _ in sources:
+            kind, _, number = name.rpartition("_")
+            if number.isdigit():
+                update["by_number"][(kind, int(number))] = name
+        if new:
+            # INSERT OR REPLACE gives a replaced frame a new rowid; its old slot is just unused
+            base = len(_state["timestamps"])
+            rows = dict(_state["rows"])
+            for i, row in enumerate(new):
+                rows[row[1]] = base + i
+            update["rows"] = rows
+            update["names"] = _state["names"] + [r[1] for r in new]
+            update["source_codes"] = np.concatenate([_state["source_codes"], np.fromiter((r[2] for r in new), np.int32, len(new))])
+            update["frame_index"] = np.concatenate([_state["frame_index"], np.fromiter((r[3] for r in new), np.int32, len(new))])
+            update["timestamps"] = np.concatenate([_state["timestamps"], np.fromiter((r[4] for r in new), np.float64, len(new))])
+            update["last_rowid"] = new[-1][0]
+        _state.update(update)
+
+def _snapshot():
+    """Refresh, then a consistent view of _state (rows and arrays from the same refresh)."""
+    _refresh()
+    with _lock:
+        return dict(_state)
+
+def frame_info(frame: str):
+    """Catalog entry for a frame: {source, source_code, frame_index, timestamp, source_path}, or None."""
+    state = _snapshot()
+    row = state["rows"].get(frame)
+    if row is None:
+        return None
+    code = int(state["source_codes"][row])
+    return {
+        "source": state["source_names"].get(code),
+        "source_code": code,
+        "frame_index": int(state["frame_index"][row]),
+        "timestamp": float(state["timestamps"][row]),
+        "source_path": state["source_paths"].get(code),
+    }
+
+def frame_arrays(frames, backfill=True):
+    """
+    Parallel arrays for a list of frame names: (source_codes, timestamps, {code: source name}).
+    Unknown frames get code -1 / timestamp NaN; with backfill they are registered first.
+    """
+    state = _snapshot()
+    if backfill:
+        missing = [f for f in frames if f not in state["rows"]]
+        if missing:
+            from frame_sampling import load_frame_timestamps, frame_timestamp
+            recorded = load_frame_timestamps()
+            if register_frames([(f, frame_timestamp(f, recorded)) for f in missing]):
+                state = _snapshot()
+    rows = state["rows"]
+    idx = np.fromiter((rows.get(f, -1) for f in frames), dtype=np.int64, count=len(frames))
+    known = idx >= 0
+    codes = np.full(len(frames), -1, dtype=np.int32)
+    times = np.full(len(frames), np.nan)
+    codes[known] = state["source_codes"][idx[known]]
+    times[known] = state["timestamps"][idx[known]]
+    return codes, times, dict(state["source_names"])
+
+def nearest_frame(source: str, timestamp: float):
+    """Name of the catalogued frame of source closest to timestamp, or None if it has no frames."""
+    state = _snapshot()
+    code = state["source_ids"].get(canonical_source(source))
+    if code is None:
+        return None
+    # A re-registered frame leaves its old row behind; only current rows count
+    rows = np.array([r for r in np.flatnonzero(state["source_codes"] == code)
+                     if state["rows"].get(state["names"][r]) == r], dtype=np.int64)
+    if not len(rows):
+        return None
+    return state["names"][rows[int(np.argmin(np.abs(state["timestamps"][rows] - timestamp)))]]
+
+def frame_clip_id(frame: str) -> str:
+    """Search-side source ID for a frame (clip_001, youtube_002); "0" for legacy or unknown frames."""
+    info = frame_info(frame)
+    if info is None or info["source"] == LEGACY_SOURCE:
+        return "0"
+    return info["source"]
+
+def canonical_source(source: str) -> str:
+    """Catalog spelling of a source ID (clip_1 -> clip_001); unchanged if unknown."""
+    if not source or source == "0":
+        return source
+    state = _snapshot()
+    if source in state["source_ids"]:
+        return source
+    kind, _, number = source.rpartition("_")
+    if number.isdigit():
+        return state["by_number"].get((kind, int(number)), f"{kind}_{number.zfill(3)}")
+    return source
+
+def source_video_path(source: str):
+    """Video file for a source ID (clip_001, youtube_002, legacy), or None if it can't be found."""
+    if not source or source in ("0", LEGACY_SOURCE):
+        return LEGACY_VIDEO_PATH if os.path.exists(LEGACY_VIDEO_PATH) else None
+    source = canonical_source(source)
+    state = _snapshot()
+    path = state["source_paths"].get(state["source_ids"].get(source))
+    if not path or not os.path.exists(path):
+        path = resolve_source_path(source)
+    return path if path and os.path.exists(path) else None
+
+def frame_source_video(frame: str):
+    """(video_path, source_id or None) for a frame; unknown frames fall back to filename resolution."""
+    info = frame_info(frame)
+    if info is not None:
+        source, path = info["source"], info["source_path"]
+    else:
+        source, _ = parse_frame_name(frame)
+        path = resolve_source_path(source) if source else LEGACY_VIDEO_PATH
+    if source in (None, LEGACY_SOURCE):
+        return LEGACY_VIDEO_PATH, None
+    if not path or not os.path.exists(path):
+        # Source moved/renamed since ingest (or was never recorded): look it up again
+        path = resolve_source_path(source)
+    if path is None:
+        return LEGACY_VIDEO_PATH, None
+    return path, source
+
+def backfill_from_captions(captions_file: str):
+    """Register captioned frames missing from the catalog (data ingested before it existed)."""
+    if not os.path.exists(captions_file):
+        return 0
+    with open(captions_file, "r", errors="replace") as f:
+        frames = [line.split(": ", 1)[0].strip() for line in f if ": " in line]
+    before = len(_snapshot()["rows"])
+    frame_arrays(frames)
+    added = len(_snapshot()["rows"]) - before
+    if added:
+        print(f"🗂️ Frame catalog: backfilled {added} frames")
+    return added
+
+def caption_counts(captions_file: str):
+    """Captions per source, updated from lines appended since the last call (no full rescan)."""
+    if not os.path.exists(captions_file):
+        return 0, {}
+    with _lock:
+        offset = valid_offset(_caption_counts["mark"], captions_file)
+        if offset is None:
+            offset, _caption_counts["counts"] = 0, {}
+        _refresh()
+        counts = _caption_counts["counts"]
+        rows, codes, names = _state["rows"], _state["source_codes"], _state["source_names"]
+        end_offset = offset
+        for line, end_offset in iter_appended_lines(captions_file, offset):
+            if ": " not in line:
+                continue
+            frame = line.split(": ", 1)[0]
+            row = rows.get(frame)
+            source = names.get(int(codes[row])) if row is not None else None
+            if source is None:
+                source = parse_frame_name(frame)[0] or LEGACY_SOURCE
+            counts[source] = counts.get(source, 0) + 1
+        _caption_counts["mark"] = make_mark(captions_file, end_offset)
+        return sum(counts.values()), dict(counts)
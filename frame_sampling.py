@@ -0,0 +1,237 @@
+"""
+Frame extraction with fixed or scene-change-aware adaptive sampling.
+Adaptive mode keeps a frame when ffmpeg's scene score exceeds FRAME_SCENE_THRESHOLD
+or when FRAME_MIN_FPS would otherwise be violated, so static shots produce few frames.
+Each kept frame's real timestamp is recorded in frame_timestamps.txt
+(format: frame.jpg: seconds) so search does not need to assume 5 FPS.
+"""
+import os
+import re
+import bisect
+import queue
+import threading
+import subprocess
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+FRAME_TIMESTAMPS_FILE = os.path.join(BASE_DIR, "frame_timestamps.txt")
+
+# "adaptive" (scene-change sampling) or "fixed" (every frame at FPS)
+FRAME_SAMPLING_MODE = os.getenv("FRAME_SAMPLING_MODE", "adaptive")
+# "files" (JPEGs in frames/, then caption) or "stream" (decode straight into the captioner)
+FRAME_PIPELINE = os.getenv("FRAME_PIPELINE", "files")
+FPS = 5  # Upper bound on sampling rate (and legacy fixed rate)
+FRAME_SCENE_THRESHOLD = float(os.getenv("FRAME_SCENE_THRESHOLD", "0.08"))
+FRAME_MIN_FPS = float(os.getenv("FRAME_MIN_FPS", "0.5"))
+
+# Max time between consecutive kept frames; search uses it as the clustering gap
+MAX_FRAME_INTERVAL = 1.0 / FRAME_MIN_FPS if FRAME_MIN_FPS > 0 else 1.0 / FPS
+
+_SHOWINFO_RE = re.compile(r"\bn:\s*(\d+)\s+pts:\s*\S+\s+pts_time:\s*([-\d.eE+]+)")
+
+def default_logger(msg):
+    print(msg)
+
+def _build_filter(mode, size=None):
+    filters = [f"fps={FPS}"]
+    if mode != "fixed":
+        filters.append(
+            f"select='isnan(prev_selected_t)"
+            f"+gt(scene,{FRAME_SCENE_THRESHOLD})"
+            f"+gte(t-prev_selected_t,{MAX_FRAME_INTERVAL})'"
+        )
+    if size:
+        filters.append(f"scale={size[0]}:{size[1]}")
+    filters.append("showinfo")
+    return ",".join(filters)
+
+def extract_frames(video_path: str, output_prefix: str, frames_dir: str, mode: str = None,
+                   update_status=default_logger):
+    """
+    Extract frames as {output_prefix}_%04d.jpg and record their timestamps.
+    Returns list of (frame_path, timestamp_seconds) in frame order.
+    """
+    mode = mode or FRAME_SAMPLING_MODE
+    os.makedirs(frames_dir, exist_ok=True)
+    output_pattern = os.path.join(frames_dir, f"{output_prefix}_%04d.jpg")
+    cmd = [
+        "ffmpeg", "-i", video_path,
+        "-vf", _build_filter(mode),
+        "-vsync", "vfr",
+        "-y", output_pattern
+    ]
+    proc = subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                          text=True, errors="replace")
+
+    frames = []
+    for m in _SHOWINFO_RE.finditer(proc.stderr):
+        n, ts = int(m.group(1)), float(m.group(2))
+        frame_path = os.path.join(frames_dir, f"{output_prefix}_{n + 1:04d}.jpg")
+        if os.path.exists(frame_path):
+            frames.append((frame_path, round(ts, 3)))
+
+    save_frame_timestamps(frames, video_path)
+    update_status(f"🎞️ Kept {len(frames)} frames ({mode} sampling)")
+    return frames
+
+def _iter_frames_ffmpeg(video_path, mode, size):
+    """Raw RGB frames from an ffmpeg pipe; timestamps come from showinfo on stderr."""
+    from PIL import Image
+
+    width, height = size
+    frame_bytes = width * height * 3
+    cmd = [
+        "ffmpeg", "-i", video_path,
+        "-vf", _build_filter(mode, size),
+        "-vsync", "vfr",
+        "-f", "rawvideo", "-pix_fmt", "rgb24", "pipe:1"
+    ]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    timestamps = queue.Queue()
+
+    def read_stderr():
+        for raw in proc.stderr:
+            m = _SHOWINFO_RE.search(raw.decode("utf-8", errors="replace"))
+            if m:
+                timestamps.put(float(m.group(2)))
+        timestamps.put(None)
+
+    threading.Thread(target=read_stderr, daemon=True).start()
+    try:
+        while True:
+            buf = proc.stdout.read(frame_bytes)
+            if len(buf) < frame_bytes:
+                break
+            # showinfo logs each frame before it is written to the pipe
+            ts = timestamps.get()
+            if ts is None:
+                break
+            yield round(ts, 3), Image.frombytes("RGB", (width, height), buf)
+    finally:
+        proc.stdout.close()
+        returncode = proc.wait()
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, cmd)
+
+def _iter_frames_pyav(video_path, mode, size):
+    """Decode with PyAV; adaptive mode uses mean abs difference of small grayscale frames."""
+    import av
+    import numpy as np
+
+    min_step = 1.0 / FPS
+    next_t = 0.0
+    last_kept_t = None
+    last_small = None
+    with av.open(video_path) as container:
+        stream = container.streams.video[0]
+        stream.thread_type = "AUTO"
+        for frame in container.decode(stream):
+            if frame.time is None or frame.time < next_t:
+                continue
+            next_t = frame.time + min_step
+            if mode != "fixed":
+                small = np.asarray(frame.to_image().convert("L").resize((32, 32)), dtype=np.float32)
+                keep = (
+                    last_kept_t is None
+                    or frame.time - last_kept_t >= MAX_FRAME_INTERVAL
+                    or float(np.abs(small - last_small).mean()) / 255.0 > FRAME_SCENE_THRESHOLD
+                )
+                last_small = small
+                if not keep:
+                    continue
+            last_kept_t = frame.time
+            img = frame.to_image()
+            if size:
+                img = img.resize(size)
+            yield round(float(frame.time), 3), img
+
+def iter_frames(video_path: str, output_prefix: str, mode: str = None, size=(224, 224)):
+    """
+    Stream sampled frames without writing JPEGs.
+    Yields (frame_name, timestamp, PIL.Image). Frame names match extract_frames
+    ({output_prefix}_0001.jpg, ...) so captions and thumbnails line up.
+    Uses PyAV when installed, otherwise an ffmpeg rawvideo pipe.
+    """
+    mode = mode or FRAME_SAMPLING_MODE
+    try:
+        import av  # noqa: F401
+        source = _iter_frames_pyav(video_path, mode, size)
+    except ImportError:
+        source = _iter_frames_ffmpeg(video_path, mode, size)
+    for n, (ts, img) in enumerate(source, start=1):
+        yield f"{output_prefix}_{n:04d}.jpg", ts, img
+
+def save_frame_timestamps(frames, source_path=None):
+    """Append (frame_path, timestamp) pairs to frame_timestamps.txt and the frame catalog."""
+    if not frames:
+        return
+    with open(FRAME_TIMESTAMPS_FILE, "a") as f:
+        f.writelines(f"{os.path.basename(p)}: {ts}\n" for p, ts in frames)
+    from frame_catalog import register_frames
+    register_frames(frames, os.path.abspath(source_path) if source_path else None)
+
+def load_frame_timestamps():
+    """Return dict frame filename -> timestamp (seconds) from frame_timestamps.txt."""
+    timestamps = {}
+    if not os.path.exists(FRAME_TIMESTAMPS_FILE):
+        return timestamps
+    with open(FRAME_TIMESTAMPS_FILE, "r") as f:
+        for line in f:
+            if ": " in line:
+                frame, ts = line.strip().split(": ", 1)
+                try:
+                    timestamps[frame] = float(ts)
+                except ValueError:
+                    pass
+    return timestamps
+
+def frame_timestamp(frame: str, timestamps=None):
+    """Recorded timestamp for a frame; falls back to frame_num / 5 for legacy fixed-rate frames."""
+    if timestamps and frame in timestamps:
+        return timestamps[frame]
+    nums = re.findall(r"\d+", frame)
+    return int(nums[-1]) / float(FPS) if nums else 0.0
+
+_index_cache = {"mtime": None, "timestamps": {}, "by_source": {}}
+
+def _frames_by_source():
+    """Cached {source_id: (sorted timestamps, frame names)} built from frame_timestamps.txt."""
+    try:
+        mtime = os.path.getmtime(FRAME_TIMESTAMPS_FILE)
+    except OSError:
+        return {}
+    if _index_cache["mtime"] != mtime:
+        recorded = load_frame_timestamps()
+        by_source = {}
+        for frame, ts in recorded.items():
+            m = re.match(r"((?:clip|youtube)_\d+)_frame", frame)
+            if m:
+                by_source.setdefault(m.group(1), []).append((ts, frame))
+        _index_cache["by_source"] = {
+            sid: ([ts for ts, _ in sorted(items)], [f for _, f in sorted(items)])
+            for sid, items in by_source.items()
+        }
+        _index_cache["timestamps"] = recorded
+        _index_cache["mtime"] = mtime
+    return _index_cache["by_source"]
+
+def lookup_frame_timestamp(frame: str):
+    """Timestamp of a single frame from the frame catalog (legacy fallback: frame_num / 5)."""
+    from frame_catalog import frame_info
+    info = frame_info(frame)
+    if info is not None:
+        return info["timestamp"]
+    _frames_by_source()
+    return frame_timestamp(frame, _index_cache["timestamps"])
+
+def nearest_frame(source_id: str, timestamp: float):
+    """Name of the kept frame of source_id closest to timestamp, or None if unknown."""
+    entry = _frames_by_source().get(source_id)
+    if not entry:
+        # Not in frame_timestamps.txt (e.g. ingested before it existed): ask the frame catalog
+        from frame_catalog import nearest_frame as catalog_nearest_frame
+        return catalog_nearest_frame(source_id, timestamp)
+    times, names = entry
+    i = bisect.bisect_left(times, timestamp)
+    if i > 0 and (i == len(times) or timestamp - times[i - 1] <= times[i] - timestamp):
+        i -= 1
+    return names[i]
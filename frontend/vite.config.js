@@ -22,6 +22,7 @@ export default defineConfig({
       },
       '/clips': { target: 'http://localhost:8000', changeOrigin: true },
       '/frames': { target: 'http://localhost:8000', changeOrigin: true },
+      '/stream': { target: 'http://localhost:8000', changeOrigin: true },
       '/source_clips': { target: 'http://localhost:8000', changeOrigin: true }
     }
   }
@@ -0,0 +1,37 @@
+"""
+Helpers for incrementally consuming append-only "id: text" files (captions.txt,
+audio_transcriptions.txt). A high-water mark records how many bytes were already
+processed plus a hash of the file head, so a rewritten (not appended) file is detected.
+"""
+import os
+import hashlib
+
+HEAD_HASH_BYTES = 4096
+
+def head_hash(path, length):
+    """Hash of the first `length` bytes of a file."""
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read(length)).hexdigest()
+
+def make_mark(path, offset):
+    """High-water mark dict for `offset` bytes of `path` consumed."""
+    head_len = min(offset, HEAD_HASH_BYTES)
+    return {"offset": offset, "head_len": head_len, "head_hash": head_hash(path, head_len)}
+
+def valid_offset(mark, path):
+    """Byte offset from a mark if the file still starts with the same content, else None."""
+    if not mark or not os.path.exists(path) or mark["offset"] > os.path.getsize(path):
+        return None
+    if head_hash(path, mark["head_len"]) != mark["head_hash"]:
+        return None
+    return mark["offset"]
+
+def iter_appended_lines(path, offset=0):
+    """Yield (line, end_offset) for complete lines after `offset`; a partial last line is left for next run."""
+    with open(path, "rb") as f:
+        f.seek(offset)
+        for raw in f:
+            if not raw.endswith(b"\n"):
+                break
+            offset += len(raw)
+            yield raw.decode("utf-8", errors="replace").strip(), offset
@@ -0,0 +1,62 @@
+"""
+Dedicated, size-capped executor for search work (query embedding, Chroma queries, NumPy scoring).
+Async endpoints await run_inference() so the event loop and Starlette's default threadpool stay
+free for cheap requests like /process-status polling. Admission is bounded: when
+INFERENCE_QUEUE_LIMIT requests are already running or waiting, new ones are rejected
+(InferenceOverloaded -> HTTP 429); a request that can't finish within INFERENCE_TIMEOUT
+seconds gives up (InferenceTimeout -> HTTP 503).
+"""
+import os
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# At least 2 so a request's video and audio retrieval can overlap (Chroma queries release the GIL)
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", str(max(2, min(4, os.cpu_count() or 1)))))
+INFERENCE_QUEUE_LIMIT = int(os.getenv("INFERENCE_QUEUE_LIMIT", str(INFERENCE_WORKERS * 8)))
+INFERENCE_TIMEOUT = float(os.getenv("INFERENCE_TIMEOUT", "30"))
+
+_executor = ThreadPoolExecutor(max_workers=INFERENCE_WORKERS, thread_name_prefix="inference")
+_lock = threading.Lock()
+_stats = {"admitted": 0, "in_flight": 0, "rejected": 0, "timeouts": 0, "errors": 0}
+
+class InferenceOverloaded(Exception):
+    """Queue is full; the client should retry later (429)."""
+
+class InferenceTimeout(Exception):
+    """Work did not finish within INFERENCE_TIMEOUT (503)."""
+
+async def run_inference(fn, *args, timeout: float = None, **kwargs):
+    """Run fn(*args, **kwargs) on the inference executor, with admission control and a timeout."""
+    with _lock:
+        if _stats["in_flight"] >= INFERENCE_QUEUE_LIMIT:
+            _stats["rejected"] += 1
+            raise InferenceOverloaded(f"{_stats['in_flight']} search requests already queued")
+        _stats["in_flight"] += 1
+        _stats["admitted"] += 1
+    future = _executor.submit(functools.partial(fn, *args, **kwargs))
+    # Released when fn returns (or is cancelled before starting), not when the caller gives up
+    future.add_done_callback(_release)
+    try:
+        return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout or INFERENCE_TIMEOUT)
+    except asyncio.TimeoutError:
+        future.cancel()  # only succeeds if it never started
+        with _lock:
+            _stats["timeouts"] += 1
+        raise InferenceTimeout(f"search did not finish within {timeout or INFERENCE_TIMEOUT:g}s")
+    except Exception:
+        with _lock:
+            _stats["errors"] += 1
+        raise
+
+def _release(_future):
+    with _lock:
+        _stats["in_flight"] -= 1
+
+def inference_stats():
+    with _lock:
+        return {**_stats, "workers": INFERENCE_WORKERS, "queue_limit": INFERENCE_QUEUE_LIMIT}
+
+def shutdown():
+    _executor.shutdown(wait=False, cancel_futures=True)
@@ -1,5 +1,5 @@
 from semantic_search import search_frames
-from video_utils import ensure_clip
+from clip_service import clip_url
 
 WINDOW = 5
 import json
@@ -22,13 +22,16 @@ def detect_intent(query: str):
         return "after"
     return "during"
 
-def intent_search(query: str):
-    intent = detect_intent(query)
-
+def clean_query(query: str):
+    """The query without its temporal intent words (what is actually searched)."""
     clean = query.lower()
     for w in ["before", "after", "during"]:
         clean = clean.replace(w, "")
-    clean = clean.strip()
+    return clean.strip()
+
+def intent_search(query: str):
+    intent = detect_intent(query)
+    clean = clean_query(query)
 
     results = search_frames(clean)
     enhanced = []
@@ -67,7 +70,7 @@ def intent_search(query: str):
             "end": adj_end,
             "score": r["score"],
             # "video_url": f"{VIDEO_URL}#t={adj_start},{adj_end}" # OLD
-            "video_url": f"http://localhost:8000/clips/{ensure_clip(adj_start, adj_end)}",
+            "video_url": clip_url(adj_start, adj_end),
             "full_video_url": f"{get_youtube_url()}&t={int(adj_start)}s"
         })
 
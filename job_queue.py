@@ -0,0 +1,447 @@
+"""
+Durable ingest job queue backed by SQLite (jobs.db).
+Each /process-video or /process-clips request becomes a job with its own ID, status and
+per-stage progress (download, extract, caption, transcribe, index). Jobs run in a pool of
+worker processes (JOB_WORKERS). A job that was interrupted by a crash or restart is
+re-queued and resumes after its last completed stage; only crashes count toward
+JOB_MAX_ATTEMPTS (a worker stopped by SIGTERM/SIGINT puts its job back itself).
+The index stage runs in the API process (run_pending_index) so the vector DB and the
+in-memory search index have a single writer.
+"""
+import os
+import json
+import time
+import uuid
+import signal
+import sqlite3
+import threading
+import importlib
+import multiprocessing
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+JOBS_DB = os.path.join(BASE_DIR, "jobs.db")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "1"))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "1.0"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+
+STAGES = ("download", "extract", "caption", "transcribe", "index")
+
+# kind -> "module:function"; handlers take (**payload, update_status=..., job=...)
+JOB_HANDLERS = {
+    "video": "process_video:process_video_logic",
+    "clips": "process_clips:process_clips_logic",
+}
+
+_workers = []
+
+def _connect():
+    conn = sqlite3.connect(JOBS_DB, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+@contextmanager
+def _db():
+    conn = _connect()
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+def init_db():
+    with _db() as conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                state TEXT NOT NULL,
+                message TEXT NOT NULL DEFAULT '',
+                stages TEXT NOT NULL,
+                context TEXT NOT NULL DEFAULT '{}',
+                worker_pid INTEGER,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                run_after TEXT,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            )
+        """)
+        # jobs.db files created before deferred jobs existed
+        if "run_after" not in {r["name"] for r in conn.execute("PRAGMA table_info(jobs)")}:
+            conn.execute("ALTER TABLE jobs ADD COLUMN run_after TEXT")
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, created_at)")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS counters (
+                kind TEXT PRIMARY KEY,
+                next_value INTEGER NOT NULL
+            )
+        """)
+
+def _now():
+    return datetime.now().isoformat()
+
+def _row_to_job(row):
+    return {
+        "id": row["id"],
+        "kind": row["kind"],
+        "state": row["state"],
+        "message": row["message"],
+        "stages": json.loads(row["stages"]),
+        "attempts": row["attempts"],
+        "created_at": row["created_at"],
+        "updated_at": row["updated_at"],
+    }
+
+def create_job(kind, payload, message="Queued"):
+    """Queue a new job. Returns job ID."""
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    job_id = uuid.uuid4().hex[:12]
+    stages = {s: {"state": "pending", "done": 0, "total": None} for s in STAGES}
+    now = _now()
+    with _db() as conn:
+        conn.execute(
+            "INSERT INTO jobs (id, kind, payload, state, message, stages, created_at, updated_at) "
+            "VALUES (?, ?, ?, 'queued', ?, ?, ?, ?)",
+            (job_id, kind, json.dumps(payload), message, json.dumps(stages), now, now),
+        )
+    return job_id
+
+def get_job(job_id):
+    """Job status dict, or None if unknown."""
+    with _db() as conn:
+        row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    return _row_to_job(row) if row else None
+
+def list_jobs(limit=50, state=None):
+    """Most recent jobs first."""
+    query = "SELECT * FROM jobs"
+    args = []
+    if state:
+        query += " WHERE state = ?"
+        args.append(state)
+    query += " ORDER BY created_at DESC LIMIT ?"
+    args.append(limit)
+    with _db() as conn:
+        return [_row_to_job(r) for r in conn.execute(query, args).fetchall()]
+
+def latest_job():
+    jobs = list_jobs(limit=1)
+    return jobs[0] if jobs else None
+
+def reserve_index(kind, floor, count=1):
+    """
+    Atomically reserve `count` consecutive indices (e.g. clip_NNN) across worker processes.
+    floor: lowest index that is free on disk (e.g. get_next_clip_index()).
+    """
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute("SELECT next_value FROM counters WHERE kind = ?", (kind,)).fetchone()
+        start = max(floor, row["next_value"] if row else floor)
+        conn.execute(
+            "INSERT INTO counters (kind, next_value) VALUES (?, ?) "
+            "ON CONFLICT(kind) DO UPDATE SET next_value = excluded.next_value",
+            (kind, start + count),
+        )
+        conn.execute("COMMIT")
+        return start
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+def _pid_alive(pid):
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass  # exists, owned by someone else
+    return True
+
+def requeue_interrupted_jobs(report_live=True):
+    """
+    Jobs left 'running' by a worker that is gone resume from their last completed stage, unless
+    they already used JOB_MAX_ATTEMPTS (same cap as check_workers). Jobs whose worker is still
+    alive (e.g. orphaned by an API process that was killed) are left to finish.
+    """
+    with _db() as conn:
+        rows = conn.execute("SELECT id, worker_pid, attempts FROM jobs WHERE state = 'running'").fetchall()
+        dead = [r for r in rows if not _pid_alive(r["worker_pid"])]
+        failed = requeued = 0
+        for r in dead:
+            if r["attempts"] >= JOB_MAX_ATTEMPTS:
+                failed += conn.execute(
+                    "UPDATE jobs SET state = 'error', worker_pid = NULL, message = 'ERROR: interrupted too many times', "
+                    "updated_at = ? WHERE id = ? AND state = 'running' AND worker_pid IS ?",
+                    (_now(), r["id"], r["worker_pid"]),
+                ).rowcount
+            else:
+                requeued += conn.execute(
+                    "UPDATE jobs SET state = 'queued', worker_pid = NULL, message = 'Resuming after restart', "
+                    "updated_at = ? WHERE id = ? AND state = 'running' AND worker_pid IS ?",
+                    (_now(), r["id"], r["worker_pid"]),
+                ).rowcount
+    if failed:
+        print(f"⚠️ {failed} interrupted job(s) reached {JOB_MAX_ATTEMPTS} attempts; marked as failed")
+    if requeued:
+        print(f"🔁 Re-queued {requeued} interrupted job(s)")
+    if report_live and len(rows) > len(dead):
+        print(f"⏳ {len(rows) - len(dead)} job(s) still running in worker(s) from a previous start")
+
+def _claim_next_job():
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute(
+            "SELECT id FROM jobs WHERE state = 'queued' AND (run_after IS NULL OR run_after <= ?) "
+            "ORDER BY created_at LIMIT 1",
+            (_now(),),
+        ).fetchone()
+        if not row:
+            conn.execute("COMMIT")
+            return None
+        conn.execute(
+            "UPDATE jobs SET state = 'running', worker_pid = ?, attempts = attempts + 1, updated_at = ? "
+            "WHERE id = ?",
+            (os.getpid(), _now(), row["id"]),
+        )
+        conn.execute("COMMIT")
+        return row["id"]
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+
+class Job:
+    """
+    Handle passed to ingest logic for status reporting and resume.
+    update_status is a drop-in for the existing update_status callbacks:
+    "COMPLETED" hands the job to the indexer, "ERROR: ..." fails it.
+    """
+
+    def __init__(self, job_id):
+        self.id = job_id
+        # Ingest stages report from several threads (see process_clips.run_clip_pipeline)
+        self._lock = threading.RLock()
+        with _db() as conn:
+            row = conn.execute("SELECT stages, context FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        self.stages = json.loads(row["stages"])
+        self.context = json.loads(row["context"])
+
+    def _save(self, **fields):
+        with self._lock:
+            fields["stages"] = json.dumps(self.stages)
+            fields["context"] = json.dumps(self.context)
+            fields["updated_at"] = _now()
+            cols = ", ".join(f"{k} = ?" for k in fields)
+            with _db() as conn:
+                conn.execute(f"UPDATE jobs SET {cols} WHERE id = ?", (*fields.values(), self.id))
+
+    def update_status(self, msg):
+        print(f"[job {self.id}] {msg}")
+        if msg == "COMPLETED":
+            with self._lock:
+                for stage in STAGES[:-1]:
+                    if self.stages[stage]["state"] != "done":
+                        self.stages[stage]["state"] = "skipped"
+                self._save(state="indexing", message="Indexing...")
+        elif msg.startswith("ERROR"):
+            self._save(state="error", message=msg)
+        else:
+            self._save(message=msg)
+
+    def is_done(self, stage, item=None):
+        """True if the stage (or one item of it, e.g. a clip) finished in an earlier run."""
+        if self.stages[stage]["state"] == "done":
+            return True
+        return item is not None and item in self.context.get("done_items", {}).get(stage, [])
+
+    def start_stage(self, stage, total=None):
+        with self._lock:
+            entry = self.stages[stage]
+            if entry["state"] != "done":
+                entry["state"] = "running"
+            if total is not None:
+                entry["total"] = total
+            self._save()
+
+    def advance(self, stage, item=None):
+        """Record progress of one unit (e.g. one clip) of a stage."""
+        with self._lock:
+            entry = self.stages[stage]
+            done_items = self.context.setdefault("done_items", {}).setdefault(stage, [])
+            if item is not None:
+                if item in done_items:
+                    return
+                done_items.append(item)
+            entry["done"] += 1
+            if entry["total"] is not None and entry["done"] >= entry["total"]:
+                entry["state"] = "done"
+            self._save()
+
+    def complete_stage(self, stage, **context):
+        """Mark a stage done and persist values later stages need on resume."""
+        with self._lock:
+            self.stages[stage]["state"] = "done"
+            self.context.update(context)
+            self._save()
+
+    def reserve_index(self, kind, floor, count=1):
+        """Reserve source indices (clip_NNN / youtube_NNN) so concurrent jobs don't collide."""
+        return reserve_index(kind, floor, count)
+
+    # Ingest logic may hand the job back (defer) instead of waiting inside the worker
+    deferrable = True
+
+    def defer(self, seconds, message):
+        """
+        Put the job back in the queue to run again in `seconds` (not counted as an attempt).
+        The handler returns right after; the job resumes from its last completed stage.
+        """
+        run_after = (datetime.now() + timedelta(seconds=seconds)).isoformat()
+        self._save(state="queued", worker_pid=None, run_after=run_after, message=message)
+        with _db() as conn:
+            conn.execute("UPDATE jobs SET attempts = MAX(attempts - 1, 0) WHERE id = ?", (self.id,))
+
+
+class NullJob:
+    """Stand-in when ingest runs outside the job queue (CLI, tests): nothing is persisted."""
+
+    context = {}
+    deferrable = False
+
+    def is_done(self, stage, item=None):
+        return False
+
+    def start_stage(self, stage, total=None):
+        pass
+
+    def advance(self, stage, item=None):
+        pass
+
+    def complete_stage(self, stage, **context):
+        pass
+
+    def reserve_index(self, kind, floor, count=1):
+        return floor
+
+
+class WorkerStopped(BaseException):
+    """Raised in a worker on SIGTERM/SIGINT (API restart or shutdown), past ingest's `except Exception`."""
+
+def _stop_worker(signum, frame):
+    raise WorkerStopped()
+
+def run_job(job_id):
+    """Run one job in the current process."""
+    with _db() as conn:
+        row = conn.execute("SELECT kind, payload FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    job = Job(job_id)
+    module_name, func_name = JOB_HANDLERS[row["kind"]].split(":")
+    try:
+        handler = getattr(importlib.import_module(module_name), func_name)
+        handler(**json.loads(row["payload"]), update_status=job.update_status, job=job)
+    except WorkerStopped:
+        # A restart is not a crash: put the job back without using up one of its attempts
+        with _db() as conn:
+            conn.execute(
+                "UPDATE jobs SET state = 'queued', worker_pid = NULL, attempts = MAX(attempts - 1, 0), "
+                "message = 'Resuming after restart', updated_at = ? WHERE id = ? AND state = 'running'",
+                (_now(), job_id),
+            )
+        raise
+    except Exception as e:
+        # Ingest logic reports "ERROR: ..." itself; cover import failures and the like
+        current = get_job(job_id)
+        if current and current["state"] == "running":
+            job.update_status(f"ERROR: {e}")
+
+def _worker_loop():
+    signal.signal(signal.SIGTERM, _stop_worker)
+    signal.signal(signal.SIGINT, _stop_worker)
+    init_db()
+    print(f"👷 Job worker {os.getpid()} started")
+    parent = multiprocessing.parent_process()
+    try:
+        # An orphaned worker (API process killed without its shutdown hook) finishes its job, then exits
+        while parent is None or parent.is_alive():
+            job_id = _claim_next_job()
+            if job_id is None:
+                time.sleep(JOB_POLL_SECONDS)
+                continue
+            run_job(job_id)
+    except WorkerStopped:
+        pass
+    print(f"👷 Job worker {os.getpid()} stopped")
+
+def start_workers(count=None):
+    """Start the job worker processes (call once from the API process)."""
+    init_db()
+    requeue_interrupted_jobs()
+    ctx = multiprocessing.get_context("spawn")  # fresh interpreters; no forked torch/tokenizer state
+    for _ in range(max(1, count or JOB_WORKERS)):
+        proc = ctx.Process(target=_worker_loop, name="ingest-worker")
+        proc.start()
+        _workers.append(proc)
+
+def check_workers():
+    """Replace worker processes that died mid-job and re-queue (or fail) their jobs."""
+    ctx = multiprocessing.get_context("spawn")
+    for i, proc in enumerate(_workers):
+        if proc.is_alive():
+            continue
+        with _db() as conn:
+            conn.execute(
+                "UPDATE jobs SET state = 'error', message = 'ERROR: worker crashed too many times', "
+                "updated_at = ? WHERE state = 'running' AND worker_pid = ? AND attempts >= ?",
+                (_now(), proc.pid, JOB_MAX_ATTEMPTS),
+            )
+            conn.execute(
+                "UPDATE jobs SET state = 'queued', worker_pid = NULL, message = 'Resuming after worker crash', "
+                "updated_at = ? WHERE state = 'running' AND worker_pid = ?",
+                (_now(), proc.pid),
+            )
+        print(f"⚠️ Job worker {proc.pid} exited ({proc.exitcode}); restarting")
+        _workers[i] = ctx.Process(target=_worker_loop, name="ingest-worker")
+        _workers[i].start()
+    # Jobs of workers orphaned by an earlier API process resume once those workers are gone
+    requeue_interrupted_jobs(report_live=False)
+
+def stop_workers():
+    for proc in _workers:
+        proc.terminate()
+    for proc in _workers:
+        proc.join(timeout=5)
+    _workers.clear()
+
+def run_pending_index(index_fn):
+    """
+    Run the index stage for jobs whose worker stages finished.
+    index_fn() reloads the search indexes once for all pending jobs.
+    """
+    with _db() as conn:
+        ids = [r["id"] for r in conn.execute("SELECT id FROM jobs WHERE state = 'indexing'").fetchall()]
+    if not ids:
+        return 0
+    jobs = [Job(job_id) for job_id in ids]
+    for job in jobs:
+        job.start_stage("index")
+    try:
+        index_fn()
+    except Exception as e:
+        for job in jobs:
+            job._save(state="error", message=f"ERROR: indexing failed: {e}")
+        return 0
+    for job in jobs:
+        job.complete_stage("index")
+        job._save(state="completed", message="Done! Search now.")
+    return len(jobs)
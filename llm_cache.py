@@ -0,0 +1,135 @@
+"""
+Persistent cache for LLM responses (explanations and suggestions) in llm_cache.db.
+Keyed by prompt template version, model, request kind, normalized query and a fingerprint of
+the retrieved results, so an identical query over an unchanged index reuses the previous answer.
+Entries expire after LLM_CACHE_TTL seconds; beyond LLM_CACHE_MAX_ENTRIES the least recently
+used are evicted. LLM_CACHE=0 disables it.
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+LLM_CACHE_DB = os.path.join(BASE_DIR, "llm_cache.db")
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE", "1") == "1"
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "5000"))
+
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "expired": 0, "stores": 0, "evictions": 0}
+
+def _connect():
+    conn = sqlite3.connect(LLM_CACHE_DB, timeout=5)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS responses ("
+        "key TEXT PRIMARY KEY, kind TEXT NOT NULL, response TEXT NOT NULL, "
+        "created_at REAL NOT NULL, last_used REAL NOT NULL)"
+    )
+    return conn
+
+def result_fingerprint(results):
+    """Hash of the retrieved results' identities (frame / transcription, time range, text)."""
+    ids = [
+        (
+            r.get("best_frame") or r.get("frame") or r.get("transcription_id") or r.get("clip_id") or "",
+            round(float(r.get("start", r.get("timestamp", 0.0)) or 0.0), 2),
+            round(float(r.get("end", 0.0) or 0.0), 2),
+            r.get("caption") or r.get("text") or "",
+        )
+        for r in results or []
+    ]
+    return hashlib.sha256(json.dumps(ids).encode("utf-8")).hexdigest()
+
+def cache_key(kind, model, query, results, prompt_version):
+    raw = json.dumps([prompt_version, model, kind, " ".join((query or "").lower().split()), result_fingerprint(results)])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def get(key):
+    """Cached response text, or None on a miss / expired entry."""
+    if not LLM_CACHE_ENABLED:
+        return None
+    now = time.time()
+    try:
+        conn = _connect()
+        try:
+            with conn:
+                row = conn.execute("SELECT response, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+                if row and now - row[1] > LLM_CACHE_TTL:
+                    conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    with _lock:
+                        _stats["expired"] += 1
+                    row = None
+                elif row:
+                    conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"⚠️ LLM cache read failed: {e}")
+        return None
+    with _lock:
+        _stats["hits" if row else "misses"] += 1
+    return row[0] if row else None
+
+def put(key, kind, response):
+    """Store a response and trim the cache to LLM_CACHE_MAX_ENTRIES."""
+    if not LLM_CACHE_ENABLED or not response:
+        return
+    now = time.time()
+    try:
+        conn = _connect()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, kind, response, created_at, last_used) VALUES (?, ?, ?, ?, ?)",
+                    (key, kind, response, now, now),
+                )
+                conn.execute("DELETE FROM responses WHERE created_at < ?", (now - LLM_CACHE_TTL,))
+                evicted = conn.execute(
+                    "DELETE FROM responses WHERE key IN ("
+                    "SELECT key FROM responses ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                    (LLM_CACHE_MAX_ENTRIES,),
+                ).rowcount
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"⚠️ LLM cache write failed: {e}")
+        return
+    with _lock:
+        _stats["stores"] += 1
+        _stats["evictions"] += max(evicted, 0)
+
+def cache_stats():
+    entries = 0
+    if os.path.exists(LLM_CACHE_DB):
+        try:
+            conn = _connect()
+            try:
+                entries = conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            pass
+    with _lock:
+        lookups = _stats["hits"] + _stats["misses"]
+        return {
+            **_stats,
+            "entries": entries,
+            "max_entries": LLM_CACHE_MAX_ENTRIES,
+            "ttl_seconds": LLM_CACHE_TTL,
+            "hit_rate": round(_stats["hits"] / lookups, 3) if lookups else 0.0,
+            "enabled": LLM_CACHE_ENABLED,
+        }
+
+def clear_cache():
+    try:
+        conn = _connect()
+        try:
+            with conn:
+                conn.execute("DELETE FROM responses")
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"⚠️ LLM cache clear failed: {e}")
@@ -0,0 +1,194 @@
+"""
+Process-wide model registry.
+Models are loaded lazily on first use, keyed by (kind, model name, device), and shared by
+semantic_search, vector_store, caption_engine and audio_processor.
+When the estimated size of loaded models exceeds MODEL_MEMORY_BUDGET_MB, models idle for
+longer than MODEL_IDLE_SECONDS are evicted least-recently-used first.
+"""
+import os
+import gc
+import time
+import threading
+from collections import OrderedDict
+
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+CAPTION_MODEL_NAME = "nlpconnect/vit-gpt2-image-captioning"
+WHISPER_MODEL_NAME = os.getenv("WHISPER_MODEL", "base")
+
+# 0 disables eviction
+MODEL_MEMORY_BUDGET_MB = int(os.getenv("MODEL_MEMORY_BUDGET_MB", "4096"))
+MODEL_IDLE_SECONDS = float(os.getenv("MODEL_IDLE_SECONDS", "300"))
+
+# Rough resident size (MB) of a model once loaded on CPU, for sizing worker pools before loading it
+_FOOTPRINT_MB = {"sentence_transformer": 250, "caption": 1000}
+_WHISPER_FOOTPRINT_MB = {"tiny": 300, "base": 500, "small": 1200, "medium": 3000, "large": 6000}
+
+_models = OrderedDict()  # (kind, name, device) -> {"model", "bytes", "last_used"}
+_lock = threading.Lock()
+_key_locks = {}
+
+def default_device():
+    """cuda if available, else cpu."""
+    try:
+        import torch
+        return "cuda" if torch.cuda.is_available() else "cpu"
+    except ImportError:
+        return "cpu"
+
+def _load_sentence_transformer(name, device):
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(name, device=device)
+
+def _load_caption_model(name, device):
+    from transformers import VisionEncoderDecoderModel, ViTImageProcessor, AutoTokenizer
+    import torch
+
+    model = VisionEncoderDecoderModel.from_pretrained(name)
+    feature_extractor = ViTImageProcessor.from_pretrained(name)
+    tokenizer = AutoTokenizer.from_pretrained(name)
+    torch_device = torch.device(device)
+    model.to(torch_device)
+    model.eval()
+    return model, feature_extractor, tokenizer, torch_device
+
+def _load_whisper(name, device):
+    import whisper
+    return whisper.load_model(name, device=device)
+
+def _load_faster_whisper(name, device):
+    # CTranslate2 port of Whisper; int8 on CPU (WHISPER_COMPUTE_TYPE), float16 on GPU
+    from faster_whisper import WhisperModel
+    compute_type = os.getenv("WHISPER_COMPUTE_TYPE", "int8") if device == "cpu" else "float16"
+    return WhisperModel(name, device=device, compute_type=compute_type,
+                        cpu_threads=int(os.getenv("WHISPER_CPU_THREADS", "0")))
+
+_LOADERS = {
+    "sentence_transformer": _load_sentence_transformer,
+    "caption": _load_caption_model,
+    "whisper": _load_whisper,
+    "faster_whisper": _load_faster_whisper,
+}
+
+def register_loader(kind, loader):
+    """Register a loader(name, device) for a new model kind."""
+    _LOADERS[kind] = loader
+
+def _estimate_bytes(obj):
+    """Approximate memory of a model (sum of torch parameter and buffer sizes)."""
+    parts = obj if isinstance(obj, tuple) else (obj,)
+    total = 0
+    for part in parts:
+        for attr in ("parameters", "buffers"):
+            fn = getattr(part, attr, None)
+            if not callable(fn):
+                continue
+            try:
+                total += sum(t.numel() * t.element_size() for t in fn())
+            except Exception:
+                pass
+    return total
+
+def _release_memory():
+    gc.collect()
+    try:
+        import torch
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+    except ImportError:
+        pass
+
+def evict_idle_models(keep=None):
+    """Evict idle models (LRU first) until loaded models fit in the memory budget."""
+    if MODEL_MEMORY_BUDGET_MB <= 0:
+        return []
+    budget = MODEL_MEMORY_BUDGET_MB * 1024 * 1024
+    evicted = []
+    now = time.time()
+    with _lock:
+        total = sum(e["bytes"] for e in _models.values())
+        for key in list(_models.keys()):
+            if total <= budget:
+                break
+            entry = _models[key]
+            if key == keep or now - entry["last_used"] < MODEL_IDLE_SECONDS:
+                continue
+            total -= entry["bytes"]
+            del _models[key]
+            evicted.append(key)
+    if evicted:
+        for kind, name, device in evicted:
+            print(f"🧹 Evicted idle model {name} ({kind}, {device})")
+        _release_memory()
+    return evicted
+
+def get_model(kind, name, device=None):
+    """Return a shared model instance, loading it on first use."""
+    device = device or default_device()
+    key = (kind, name, device)
+    with _lock:
+        entry = _models.get(key)
+        if entry is not None:
+            entry["last_used"] = time.time()
+            _models.move_to_end(key)
+            return entry["model"]
+        key_lock = _key_locks.setdefault(key, threading.Lock())
+
+    # Per-key lock so concurrent callers wait for a single load
+    with key_lock:
+        with _lock:
+            entry = _models.get(key)
+            if entry is not None:
+                entry["last_used"] = time.time()
+                _models.move_to_end(key)
+                return entry["model"]
+        if kind not in _LOADERS:
+            raise ValueError(f"Unknown model kind: {kind}")
+        print(f"🔄 Loading model {name} ({kind}) on {device}...")
+        model = _LOADERS[kind](name, device)
+        with _lock:
+            _models[key] = {"model": model, "bytes": _estimate_bytes(model), "last_used": time.time()}
+    evict_idle_models(keep=key)
+    return model
+
+def get_embedding_model(name=EMBEDDING_MODEL_NAME, device=None):
+    """Shared SentenceTransformer used for captions, transcriptions and queries."""
+    return get_model("sentence_transformer", name, device)
+
+def get_caption_model(name=CAPTION_MODEL_NAME, device=None):
+    """Shared ViT-GPT2 captioner. Returns (model, feature_extractor, tokenizer, device)."""
+    return get_model("caption", name, device)
+
+def get_whisper_model(name=WHISPER_MODEL_NAME, device=None):
+    """Shared Whisper model."""
+    return get_model("whisper", name, device)
+
+def get_faster_whisper_model(name=WHISPER_MODEL_NAME, device=None):
+    """Shared faster-whisper (CTranslate2) model."""
+    return get_model("faster_whisper", name, device)
+
+def model_footprint_mb(kind, name):
+    """Estimated memory of a model before it is loaded (faster-whisper int8 is about half of Whisper)."""
+    if kind in ("whisper", "faster_whisper"):
+        size = next((mb for prefix, mb in _WHISPER_FOOTPRINT_MB.items() if name.startswith(prefix)), 6000)
+        return size // 2 if kind == "faster_whisper" else size
+    return _FOOTPRINT_MB.get(kind, 500)
+
+def is_loaded(kind, name):
+    """True if this process already holds the model (on any device)."""
+    with _lock:
+        return any(k[0] == kind and k[1] == name for k in _models)
+
+def registry_stats():
+    """Loaded models with approximate size and idle time."""
+    now = time.time()
+    with _lock:
+        return [
+            {
+                "kind": kind,
+                "name": name,
+                "device": device,
+                "size_mb": round(e["bytes"] / (1024 * 1024), 1),
+                "idle_seconds": round(now - e["last_used"], 1),
+            }
+            for (kind, name, device), e in _models.items()
+        ]
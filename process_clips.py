@@ -8,6 +8,12 @@ import os
 import json
 import re
 import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from frame_sampling import extract_frames, FRAME_PIPELINE
+from job_queue import NullJob
+from source_dedup import (sha256_content, claim_owner, claim_source, release_claim, add_history_alias,
+                          update_history_entry, mark_ingested, SourceBusy, SOURCE_CLAIM_RETRY_SECONDS)
 
 def default_logger(msg):
     print(msg)
@@ -15,7 +21,6 @@ def default_logger(msg):
 SOURCE_CLIPS_DIR = "source_clips"
 FRAMES_DIR = "frames"
 CAPTIONS_FILE = "captions.txt"
-FPS = 5
 
 def get_next_clip_index():
     """Find next available clip index from existing source_clips."""
@@ -41,59 +46,274 @@ def get_existing_captioned_frames():
     return existing
 
 def caption_new_frames(new_frame_paths, update_status=default_logger):
-    """Generate captions for new frames and append to captions.txt."""
+    """Generate captions for new frames (batched) and append to captions.txt."""
     if not new_frame_paths:
         return
     try:
-        from transformers import VisionEncoderDecoderModel, ViTImageProcessor, AutoTokenizer
-        from PIL import Image
-        import torch
-        from tqdm import tqdm
-
-        model_name = "nlpconnect/vit-gpt2-image-captioning"
-        model = VisionEncoderDecoderModel.from_pretrained(model_name)
-        feature_extractor = ViTImageProcessor.from_pretrained(model_name)
-        tokenizer = AutoTokenizer.from_pretrained(model_name)
-        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        model.to(device)
-        max_length, num_beams = 16, 4
-        gen_kwargs = {"max_length": max_length, "num_beams": num_beams}
-
-        def predict_step(paths):
-            images = [Image.open(p).convert("RGB") for p in paths]
-            pixel_values = feature_extractor(images=images, return_tensors="pt").pixel_values.to(device)
-            output_ids = model.generate(pixel_values, **gen_kwargs)
-            return [t.strip() for t in tokenizer.batch_decode(output_ids, skip_special_tokens=True)]
-
-        with open(CAPTIONS_FILE, "a") as outf:
-            for path in tqdm(new_frame_paths, desc="Captioning new frames"):
-                frame = os.path.basename(path)
-                try:
-                    captions = predict_step([path])
-                    outf.write(f"{frame}: {captions[0]}\n")
-                    outf.flush()
-                except Exception as e:
-                    update_status(f"⚠️ Caption error for {frame}: {e}")
+        from caption_engine import caption_frames
+        caption_frames(new_frame_paths, CAPTIONS_FILE, update_status=update_status)
     except ImportError:
         update_status("⚠️ Falling back to caption_frames.py (will overwrite - run with transformers for incremental)")
         subprocess.run([sys.executable, "caption_frames.py"], check=True)
 
-def extract_frames_for_clip(video_path: str, output_prefix: str, frames_dir: str):
-    """Extract frames from a video with a given prefix (e.g. clip_001_frame)."""
-    os.makedirs(frames_dir, exist_ok=True)
-    output_pattern = os.path.join(frames_dir, f"{output_prefix}_%04d.jpg")
-    cmd = [
-        "ffmpeg", "-i", video_path,
-        "-vf", f"fps={FPS}",
-        "-y", output_pattern
-    ]
-    subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-
-def process_clips_logic(file_data, update_status=default_logger):
+def caption_clip_stream(video_path, output_prefix, existing=None, update_status=default_logger):
+    """Streaming mode: caption frames decoded in memory from the video (no JPEGs in frames/)."""
+    try:
+        from caption_engine import caption_video_stream
+        caption_video_stream(video_path, output_prefix, CAPTIONS_FILE, skip_frames=existing,
+                             update_status=update_status)
+    except ImportError:
+        update_status("⚠️ Transformers not available for streaming captioning")
+
+def extract_frames_for_clip(video_path: str, output_prefix: str, frames_dir: str, update_status=default_logger):
+    """Extract frames from a video with a given prefix (e.g. clip_001_frame). Returns [(path, timestamp), ...]."""
+    return extract_frames(video_path, output_prefix, frames_dir, update_status=update_status)
+
+def _available_memory_gb():
+    """Memory available right now in GB (psutil, else free pages), or None if it can't be determined."""
+    try:
+        import psutil
+        return psutil.virtual_memory().available / (1024 ** 3)
+    except ImportError:
+        pass
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_AVPHYS_PAGES") / (1024 ** 3)
+    except (ValueError, OSError, AttributeError):
+        return None
+
+# Frame + audio extraction (ffmpeg) runs ahead of the model stages; unset = sized by _ingest_budget
+INGEST_EXTRACT_WORKERS = os.getenv("INGEST_EXTRACT_WORKERS")
+# The captioner (this process) and the Whisper chunk pool run at the same time and split the cores:
+# this share goes to the captioner's torch threads, the rest to the Whisper pool.
+CAPTION_CORE_SHARE = float(os.getenv("INGEST_CAPTION_CORE_SHARE", "0.5"))
+# Each model stage shares one model instance (Whisper's decoder is not safe to call
+# concurrently), so one worker per model stage.
+CAPTION_WORKERS = 1
+TRANSCRIBE_WORKERS = 1
+
+def _ingest_budget():
+    """
+    One core and memory budget for a pipeline run: torch threads for the captioner, cores and
+    processes for the Whisper pool, and ffmpeg extraction workers (~1 GB each). Memory is what is
+    available now minus the models this run has yet to load.
+    """
+    import transcription_engine
+    from model_registry import CAPTION_MODEL_NAME, WHISPER_MODEL_NAME, model_footprint_mb, is_loaded
+
+    cores = os.cpu_count() or 1
+    caption_threads = max(1, min(cores - 1, round(cores * CAPTION_CORE_SHARE))) if cores > 1 else 1
+    whisper_cores = max(1, cores - caption_threads)
+    whisper_workers = max(1, min(transcription_engine.WHISPER_WORKERS, whisper_cores))
+    extract_workers = max(1, min(4, cores // 2))
+    mem_gb = _available_memory_gb()
+    if mem_gb is not None:
+        if not is_loaded("caption", CAPTION_MODEL_NAME):
+            mem_gb -= model_footprint_mb("caption", CAPTION_MODEL_NAME) / 1024
+        if transcription_engine._pool is None:
+            kind = "faster_whisper" if transcription_engine.resolve_backend() == "faster" else "whisper"
+            whisper_gb = model_footprint_mb(kind, WHISPER_MODEL_NAME) / 1024
+            whisper_workers = max(1, min(whisper_workers, int(max(mem_gb, 0) // whisper_gb)))
+            mem_gb -= whisper_workers * whisper_gb
+        extract_workers = max(1, min(extract_workers, int(max(mem_gb, 0))))
+    if INGEST_EXTRACT_WORKERS:
+        extract_workers = max(1, int(INGEST_EXTRACT_WORKERS))
+    return {"caption_threads": caption_threads, "whisper_cores": whisper_cores,
+            "whisper_workers": whisper_workers, "extract_workers": extract_workers}
+
+def _set_torch_threads(threads):
+    """Set torch's intra-op threads for this process; returns the previous value (None without torch)."""
+    try:
+        import torch
+    except ImportError:
+        return None
+    previous = torch.get_num_threads()
+    torch.set_num_threads(threads)
+    return previous
+
+def _list_clip_frames(clip_id):
+    """Frame paths already extracted for a clip (used when resuming a job)."""
+    prefix = f"clip_{clip_id}_frame"
+    return sorted(
+        os.path.join(FRAMES_DIR, f) for f in os.listdir(FRAMES_DIR)
+        if f.startswith(prefix) and f.endswith(".jpg")
+    )
+
+def run_clip_pipeline(saved_paths, update_status=default_logger, job=None):
+    """
+    Run extract -> caption / transcribe for saved clips as a pipeline with bounded pools.
+    saved_paths: list of (clip_id, video_path). Captions are written in clip order.
+    Per-stage progress is reported through update_status (and job stages when queued).
+    """
+    from audio_processor import extract_audio_from_video, get_audio_path, transcribe_and_save, AUDIO_PIPELINE
+    from video_utils import ensure_keyframe_index
+
+    job = job or NullJob()
+    total = len(saved_paths)
+    for stage in ("extract", "caption", "transcribe"):
+        job.start_stage(stage, total)
+    existing = get_existing_captioned_frames()
+    progress = {"extract": 0, "caption": 0, "transcribe": 0}
+    lock = threading.Lock()
+
+    def report(stage, clip_id):
+        job.advance(stage, clip_id)
+        with lock:
+            progress[stage] += 1
+            msg = (f"⚙️ Extracted {progress['extract']}/{total} · "
+                   f"Captioned {progress['caption']}/{total} · "
+                   f"Transcribed {progress['transcribe']}/{total}")
+        update_status(msg)
+
+    def extract(clip_id, video_path):
+        if job.is_done("extract", clip_id):
+            audio_path = get_audio_path(f"clip_{clip_id}")
+            frame_paths = [] if FRAME_PIPELINE == "stream" else _list_clip_frames(clip_id)
+            frame_paths = [p for p in frame_paths if os.path.basename(p) not in existing]
+            report("extract", clip_id)
+            return frame_paths, audio_path if os.path.exists(audio_path) else None
+        frame_paths = []
+        # Keyframe index next to the source lets result clips be stream-copied
+        ensure_keyframe_index(video_path, update_status)
+        if FRAME_PIPELINE != "stream":
+            update_status(f"🎞️ Extracting frames from clip {clip_id}...")
+            frames = extract_frames_for_clip(video_path, f"clip_{clip_id}_frame", FRAMES_DIR, update_status)
+            frame_paths = [p for p, _ in frames if os.path.basename(p) not in existing]
+        audio_path = None
+        # In stream mode the transcribe stage decodes audio itself through a pipe
+        if AUDIO_PIPELINE == "wav":
+            try:
+                audio_path = extract_audio_from_video(video_path, get_audio_path(f"clip_{clip_id}"), update_status)
+            except Exception as e:
+                update_status(f"⚠️ Audio processing error for clip {clip_id}: {e}")
+        report("extract", clip_id)
+        return frame_paths, audio_path
+
+    def caption(clip_id, video_path, frame_paths):
+        if job.is_done("caption", clip_id):
+            pass
+        elif FRAME_PIPELINE == "stream":
+            update_status(f"🤖 Streaming frames from clip {clip_id} into the captioner...")
+            caption_clip_stream(video_path, f"clip_{clip_id}_frame", existing, update_status)
+        elif frame_paths:
+            update_status(f"🤖 Generating visual captions for clip {clip_id}...")
+            caption_new_frames(frame_paths, update_status)
+        else:
+            update_status(f"📝 No new frames to caption for clip {clip_id}.")
+        report("caption", clip_id)
+
+    def transcribe(clip_id, video_path, audio_path):
+        if (audio_path or AUDIO_PIPELINE == "stream") and not job.is_done("transcribe", clip_id):
+            update_status(f"🎵 Processing audio for clip {clip_id}...")
+            try:
+                segments = transcribe_and_save(audio_path, f"clip_{clip_id}", video_path, update_status)
+                if segments:
+                    update_status(f"✅ Processed {len(segments)} audio segments for clip {clip_id}")
+                else:
+                    update_status(f"⚠️ No audio segments extracted for clip {clip_id}")
+            except Exception as e:
+                update_status(f"⚠️ Audio processing error for clip {clip_id}: {e}")
+        report("transcribe", clip_id)
+
+    import transcription_engine
+    budget = _ingest_budget()
+    update_status(f"⚙️ Ingest budget: {budget['extract_workers']} extract workers, "
+                  f"{budget['caption_threads']} caption threads, "
+                  f"{budget['whisper_workers']} Whisper workers on {budget['whisper_cores']} cores")
+    transcription_engine.set_cpu_budget(budget["whisper_cores"], budget["whisper_workers"])
+    previous_threads = _set_torch_threads(budget["caption_threads"])
+    try:
+        with ThreadPoolExecutor(max_workers=budget["extract_workers"]) as extract_pool, \
+                ThreadPoolExecutor(max_workers=CAPTION_WORKERS) as caption_pool, \
+                ThreadPoolExecutor(max_workers=TRANSCRIBE_WORKERS) as transcribe_pool:
+            extracted = [
+                (clip_id, video_path, extract_pool.submit(extract, clip_id, video_path))
+                for clip_id, video_path in saved_paths
+            ]
+            downstream = []
+            # Hand clips to the model stages in order as soon as each extraction finishes
+            for clip_id, video_path, future in extracted:
+                frame_paths, audio_path = future.result()
+                downstream.append(caption_pool.submit(caption, clip_id, video_path, frame_paths))
+                downstream.append(transcribe_pool.submit(transcribe, clip_id, video_path, audio_path))
+            for future in downstream:
+                future.result()
+    finally:
+        transcription_engine.set_cpu_budget(None)
+        if previous_threads is not None:
+            _set_torch_threads(previous_threads)
+
+def _save_upload(content, save_path):
+    """Move a staged upload (path) into place, or write raw bytes."""
+    if isinstance(content, (bytes, bytearray)):
+        with open(save_path, "wb") as f:
+            f.write(content)
+    else:
+        os.replace(content, save_path)
+
+def _claim_hashes(digests, update_status, job, sizes=None):
+    """
+    Claim content hashes for this job in sorted order (so two jobs with overlapping batches can't
+    wait on each other). Returns {digest: existing prefix or None}. Raises SourceBusy for a queued
+    job when another job holds one of them; claims taken so far are then released.
+    """
+    owner = claim_owner(job)
+    existing_for = {}
+    try:
+        for digest in sorted(set(digests)):
+            existing_for[digest] = claim_source(digest, (sizes or {}).get(digest), update_status,
+                                                owner=owner, wait=not job.deferrable)
+    except BaseException:
+        for digest, existing in existing_for.items():
+            if existing is None:
+                release_claim(digest, owner)
+        raise
+    return existing_for
+
+def _dedup_uploads(file_data, update_status=default_logger, job=None):
+    """
+    Hash each upload (streaming SHA-256) and drop those identical to an ingested source or to an
+    earlier file in the same batch; they are recorded as aliases instead of being processed again.
+    The remaining hashes are claimed (source_dedup.claim_source), so an identical upload in a
+    concurrent job is deferred until this one is done rather than being ingested twice.
+    Entries may carry the hash computed while the upload was staged: (filename, content[, sha256]).
+    Returns [(filename, content, sha256, duplicate_index_or_None)] for the batch.
+    """
+    hashed = []
+    for filename, content, *staged_hash in file_data:
+        if not isinstance(content, (bytes, bytearray)) and not os.path.exists(content):
+            # An interrupted run already moved it into source_clips/ before the download stage finished
+            update_status(f"⚠️ Staged upload for {filename} is gone (moved by an interrupted run); skipped")
+            continue
+        digest = staged_hash[0] if staged_hash else sha256_content(content)
+        size = len(content) if isinstance(content, (bytes, bytearray)) else os.path.getsize(content)
+        hashed.append((filename, content, digest, size))
+    existing_for = _claim_hashes([h[2] for h in hashed], update_status, job or NullJob(),
+                                 sizes={digest: size for _, _, digest, size in hashed})
+    uploads = []
+    first_in_batch = {}
+    for i, (filename, content, digest, _) in enumerate(hashed):
+        existing = existing_for[digest]
+        if existing:
+            if not isinstance(content, (bytes, bytearray)):
+                os.remove(content)
+            add_history_alias(existing, type="clip", filename=filename, sha256=digest)
+            update_status(f"♻️ {filename} is identical to {existing}; reusing its frames, captions and transcriptions")
+            uploads.append((filename, None, digest, None))
+            continue
+        uploads.append((filename, content, digest, first_in_batch.get(digest)))
+        first_in_batch.setdefault(digest, i)
+    return uploads
+
+def process_clips_logic(file_data, update_status=default_logger, job=None):
     """
     Process multiple uploaded video files. Incremental: keeps existing frames and captions.
-    file_data: list of (filename, file_content_bytes) - content read before passing.
+    file_data: list of (filename, staged_path_or_bytes[, sha256]) - staged uploads are moved into source_clips/.
+    Uploads whose content (SHA-256) was already ingested are aliased, not processed again.
+    job: job_queue.Job when run from the job queue; completed stages are skipped on resume.
     """
+    job = job or NullJob()
+    hashes = {}
+    claimed = set()
     try:
         update_status("Starting processing for uploaded clips...")
 
@@ -103,16 +323,46 @@ def process_clips_logic(file_data, update_status=default_logger):
         os.makedirs("clips", exist_ok=True)
 
         # 2. Find next clip index and save uploaded files
-        start_idx = get_next_clip_index()
-        saved_paths = []
-        for i, (filename, content) in enumerate(file_data):
-            clip_id = f"{start_idx + i:03d}"
-            ext = os.path.splitext(filename)[1] or ".mp4"
-            save_path = os.path.join(SOURCE_CLIPS_DIR, f"clip_{clip_id}{ext}")
-            with open(save_path, "wb") as f:
-                f.write(content)
-            saved_paths.append((clip_id, save_path))
-            update_status(f"📥 Saved clip {clip_id}: {os.path.basename(save_path)}")
+        if job.is_done("download"):
+            saved_paths = [tuple(p) for p in job.context["saved_paths"]]
+            hashes = job.context.get("hashes", {})
+            update_status(f"🔁 Resuming {len(saved_paths)} saved clip(s)")
+            # Normally still ours (claims belong to the job, not the crashed worker); re-taken if they lapsed
+            _claim_hashes(hashes.values(), update_status, job)
+        else:
+            job.start_stage("download", len(file_data))
+            uploads = _dedup_uploads(file_data, update_status, job)
+            new_uploads = [u for u in uploads if u[1] is not None and u[3] is None]
+            claimed = {u[2] for u in new_uploads}
+            start_idx = job.reserve_index("clip", get_next_clip_index(), len(new_uploads)) if new_uploads else 0
+            saved_paths = []
+            hashes = {}
+            clip_for_upload = {}
+            for i, (filename, content, digest, duplicate_of) in enumerate(uploads):
+                if content is None:
+                    continue
+                if duplicate_of is not None:
+                    # Same bytes as an earlier file in this batch: keep one copy
+                    if not isinstance(content, (bytes, bytearray)):
+                        os.remove(content)
+                    add_history_alias(f"clip_{clip_for_upload[duplicate_of]}", type="clip", filename=filename, sha256=digest)
+                    update_status(f"♻️ {filename} duplicates clip {clip_for_upload[duplicate_of]} in this upload; skipped")
+                    continue
+                clip_id = f"{start_idx + len(saved_paths):03d}"
+                ext = os.path.splitext(filename)[1] or ".mp4"
+                save_path = os.path.join(SOURCE_CLIPS_DIR, f"clip_{clip_id}{ext}")
+                _save_upload(content, save_path)
+                update_history_entry(f"clip_{clip_id}", type="clip", filename=filename, video_path=save_path)
+                saved_paths.append((clip_id, save_path))
+                hashes[clip_id] = digest
+                clip_for_upload[i] = clip_id
+                update_status(f"📥 Saved clip {clip_id}: {os.path.basename(save_path)}")
+            job.complete_stage("download", saved_paths=saved_paths, hashes=hashes)
+
+        if not saved_paths:
+            update_status("♻️ All uploads were already ingested; nothing new to process")
+            update_status("COMPLETED")
+            return
 
         # 3. Update config with all sources
         all_sources = []
@@ -124,47 +374,26 @@ def process_clips_logic(file_data, update_status=default_logger):
         with open("video_config.json", "w") as f:
             json.dump(config, f, indent=4)
 
-        # 4. Extract frames for new clips only (keep existing frames)
-        new_frame_paths = []
-        for clip_id, video_path in saved_paths:
-            update_status(f"🎞️ Extracting frames from clip {clip_id}...")
-            prefix = f"clip_{clip_id}_frame"
-            extract_frames_for_clip(video_path, prefix, FRAMES_DIR)
-            for f in os.listdir(FRAMES_DIR):
-                if f.startswith(prefix) and f.endswith(".jpg"):
-                    new_frame_paths.append(os.path.join(FRAMES_DIR, f))
-        new_frame_paths.sort()
-
-        # 5. Caption only new frames and append to captions.txt
-        existing = get_existing_captioned_frames()
-        to_caption = [p for p in new_frame_paths if os.path.basename(p) not in existing]
-        if to_caption:
-            update_status("🤖 Generating visual captions for new frames...")
-            caption_new_frames(to_caption, update_status)
-        else:
-            update_status("📝 No new frames to caption.")
+        # 4-6. Pipelined ingest: extract clip N+1 while clip N is captioned and transcribed
+        run_clip_pipeline(saved_paths, update_status, job)
 
-        # 6. Extract and transcribe audio for each clip
-        for clip_id, video_path in saved_paths:
-            try:
-                from audio_processor import process_audio_for_video
-                update_status(f"🎵 Processing audio for clip {clip_id}...")
-                prefix = f"clip_{clip_id}"
-                segments = process_audio_for_video(video_path, prefix, update_status)
-                if segments:
-                    update_status(f"✅ Processed {len(segments)} audio segments for clip {clip_id}")
-                else:
-                    update_status(f"⚠️ No audio segments extracted for clip {clip_id}")
-            except ImportError:
-                update_status("⚠️ Audio processing not available (install openai-whisper)")
-                break
-            except Exception as e:
-                update_status(f"⚠️ Audio processing error for clip {clip_id}: {e}")
+        # Only fully ingested sources get a hash, so later duplicates never alias a half-processed clip
+        for clip_id, save_path in saved_paths:
+            if clip_id in hashes:
+                mark_ingested(f"clip_{clip_id}", save_path, hashes[clip_id])
 
         update_status("COMPLETED")
 
+    except SourceBusy as e:
+        # Don't hold the worker while another job ingests the same content: retry later
+        message = f"⏳ Waiting: {e}; retrying in {SOURCE_CLAIM_RETRY_SECONDS:g}s"
+        update_status(message)
+        job.defer(SOURCE_CLAIM_RETRY_SECONDS, message)
+
     except Exception as e:
         update_status(f"ERROR: {str(e)}")
+        for digest in claimed | set(hashes.values()):
+            release_claim(digest, claim_owner(job))
         raise e
 
 
@@ -4,6 +4,8 @@ import json
 import subprocess
 import hashlib
 from datetime import datetime
+from frame_sampling import extract_frames, FRAME_SAMPLING_MODE, FRAME_PIPELINE
+from job_queue import NullJob
 
 def default_logger(msg):
     print(msg)
@@ -65,54 +67,29 @@ def save_video_history(history):
     with open(VIDEO_HISTORY_FILE, "w") as f:
         json.dump(history, f, indent=4)
 
-def extract_frames_for_youtube(video_path: str, output_prefix: str, frames_dir: str):
-    """Extract frames from a video with a given prefix (e.g. youtube_001_frame)."""
-    os.makedirs(frames_dir, exist_ok=True)
-    output_pattern = os.path.join(frames_dir, f"{output_prefix}_%04d.jpg")
-    cmd = [
-        "ffmpeg", "-i", video_path,
-        "-vf", f"fps={FPS}",
-        "-y", output_pattern
-    ]
-    subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+def extract_frames_for_youtube(video_path: str, output_prefix: str, frames_dir: str, update_status=default_logger):
+    """Extract frames from a video with a given prefix (e.g. youtube_001_frame). Returns [(path, timestamp), ...]."""
+    return extract_frames(video_path, output_prefix, frames_dir, update_status=update_status)
 
 def caption_new_frames_for_youtube(new_frame_paths, update_status=default_logger):
-    """Generate captions for new frames and append to captions.txt."""
+    """Generate captions for new frames (batched) and append to captions.txt."""
     if not new_frame_paths:
         return
     try:
-        from transformers import VisionEncoderDecoderModel, ViTImageProcessor, AutoTokenizer
-        from PIL import Image
-        import torch
-        from tqdm import tqdm
-
-        model_name = "nlpconnect/vit-gpt2-image-captioning"
-        model = VisionEncoderDecoderModel.from_pretrained(model_name)
-        feature_extractor = ViTImageProcessor.from_pretrained(model_name)
-        tokenizer = AutoTokenizer.from_pretrained(model_name)
-        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        model.to(device)
-        max_length, num_beams = 16, 4
-        gen_kwargs = {"max_length": max_length, "num_beams": num_beams}
-
-        def predict_step(paths):
-            images = [Image.open(p).convert("RGB") for p in paths]
-            pixel_values = feature_extractor(images=images, return_tensors="pt").pixel_values.to(device)
-            output_ids = model.generate(pixel_values, **gen_kwargs)
-            return [t.strip() for t in tokenizer.batch_decode(output_ids, skip_special_tokens=True)]
-
-        with open(CAPTIONS_FILE, "a") as outf:
-            for path in tqdm(new_frame_paths, desc="Captioning new frames"):
-                frame = os.path.basename(path)
-                try:
-                    captions = predict_step([path])
-                    outf.write(f"{frame}: {captions[0]}\n")
-                    outf.flush()
-                except Exception as e:
-                    update_status(f"⚠️ Caption error for {frame}: {e}")
+        from caption_engine import caption_frames
+        caption_frames(new_frame_paths, CAPTIONS_FILE, update_status=update_status)
     except ImportError:
         update_status("⚠️ Transformers not available for incremental captioning")
 
+def caption_youtube_stream(video_path, output_prefix, existing=None, update_status=default_logger):
+    """Streaming mode: caption frames decoded in memory from the video (no JPEGs in frames/)."""
+    try:
+        from caption_engine import caption_video_stream
+        caption_video_stream(video_path, output_prefix, CAPTIONS_FILE, skip_frames=existing,
+                             update_status=update_status)
+    except ImportError:
+        update_status("⚠️ Transformers not available for streaming captioning")
+
 def parse_time(time_str):
     """Converts HH:MM:SS,mmm or HH:MM:SS.mmm to seconds"""
     h, m, s = time_str.replace(',', '.').split(':')
@@ -144,114 +121,185 @@ def srt_to_captions(srt_path, output_path, fps=5, prefix="youtube_001"):
                 # Using prefix for unique naming
                 f.write(f"{prefix}_frame_{frame_idx:04d}.jpg: {text}\n")
 
-def process_video_logic(youtube_url, update_status=default_logger):
+def process_video_logic(youtube_url, update_status=default_logger, job=None):
     """
     Process YouTube video. INCREMENTAL: keeps existing frames and captions from all videos.
     Uses unique prefixes (youtube_001, youtube_002, etc.) to avoid conflicts.
     Saves YouTube video to source_clips/ so it appears in "Your uploaded clips".
+    job: job_queue.Job when run from the job queue; completed stages are skipped on resume.
     """
+    job = job or NullJob()
+    claimed_sha256 = None
     try:
         update_status("Starting processing for: " + youtube_url)
         
         video_id = get_youtube_video_id(youtube_url)
         
-        # Check if this video was already processed
-        history = load_video_history()
-        for v in history.get("videos", []):
-            if v.get("video_id") == video_id:
-                update_status(f"⚠️ Video {video_id} already processed. Skipping to avoid duplicates.")
+        if job.is_done("download"):
+            youtube_prefix = job.context["youtube_prefix"]
+            youtube_video_path = job.context["video_path"]
+            video_sha256 = job.context.get("sha256")
+            update_status(f"🔁 Resuming {youtube_prefix} after download")
+            if video_sha256:
+                # Normally still ours (claims belong to the job, not the crashed worker); re-taken if it lapsed
+                from source_dedup import claim_owner, claim_source, SourceBusy, SOURCE_CLAIM_RETRY_SECONDS
+                try:
+                    claim_source(video_sha256, None, update_status, owner=claim_owner(job), wait=not job.deferrable)
+                except SourceBusy as e:
+                    message = f"⏳ Waiting: {e}; retrying in {SOURCE_CLAIM_RETRY_SECONDS:g}s"
+                    update_status(message)
+                    job.defer(SOURCE_CLAIM_RETRY_SECONDS, message)
+                    return
+                claimed_sha256 = video_sha256
+        else:
+            # Check if this video was already processed
+            history = load_video_history()
+            for v in history.get("videos", []):
+                if v.get("video_id") == video_id:
+                    update_status(f"⚠️ Video {video_id} already processed. Skipping to avoid duplicates.")
+                    update_status("COMPLETED")
+                    return
+
+            # 1. Get next youtube index and prepare directories (NO DELETION)
+            job.start_stage("download")
+            youtube_idx = job.reserve_index("youtube", get_next_youtube_index())
+            youtube_prefix = f"youtube_{youtube_idx:03d}"
+            
+            os.makedirs(FRAMES_DIR, exist_ok=True)
+            os.makedirs("clips", exist_ok=True)
+            os.makedirs(SOURCE_CLIPS_DIR, exist_ok=True)
+            
+            # Save YouTube video to source_clips/ so it appears in "Your uploaded clips"
+            youtube_video_path = os.path.join(SOURCE_CLIPS_DIR, f"{youtube_prefix}.mp4")
+
+            # 2. Download Video directly to source_clips/
+            update_status("⬇️ Downloading video...")
+            cmd_dl = [
+                "yt-dlp",
+                "-f", "best[ext=mp4]/best", 
+                "-o", youtube_video_path,
+                "--force-overwrites",
+                "--extractor-args", "youtube:player_client=android",
+                youtube_url
+            ]
+            subprocess.run(cmd_dl, check=True)
+            
+            update_status(f"📥 Saved as {youtube_prefix}.mp4 in source_clips/")
+
+            # Same video under another URL/ID (re-upload, mirror): alias the ingested source
+            # The hash is claimed until mark_ingested, so a concurrent identical download waits for this job
+            from source_dedup import (sha256_file, claim_owner, claim_source, add_history_alias, SourceBusy,
+                                      SOURCE_CLAIM_RETRY_SECONDS)
+            video_sha256 = sha256_file(youtube_video_path)
+            try:
+                existing = claim_source(video_sha256, os.path.getsize(youtube_video_path), update_status,
+                                        owner=claim_owner(job), wait=not job.deferrable)
+            except SourceBusy as e:
+                # Re-queued rather than holding the worker; the retry downloads again
+                os.remove(youtube_video_path)
+                message = f"⏳ Waiting: {e}; retrying in {SOURCE_CLAIM_RETRY_SECONDS:g}s"
+                update_status(message)
+                job.defer(SOURCE_CLAIM_RETRY_SECONDS, message)
+                return
+            if existing:
+                os.remove(youtube_video_path)
+                add_history_alias(existing, type="youtube", url=youtube_url, video_id=video_id, sha256=video_sha256)
+                update_status(f"♻️ Video {video_id} is identical to {existing}; reusing its frames, captions and transcriptions")
+                job.complete_stage("download")
                 update_status("COMPLETED")
                 return
+            claimed_sha256 = video_sha256
 
-        # 1. Get next youtube index and prepare directories (NO DELETION)
-        youtube_idx = get_next_youtube_index()
-        youtube_prefix = f"youtube_{youtube_idx:03d}"
-        
-        os.makedirs(FRAMES_DIR, exist_ok=True)
-        os.makedirs("clips", exist_ok=True)
-        os.makedirs(SOURCE_CLIPS_DIR, exist_ok=True)
-        
-        # Save YouTube video to source_clips/ so it appears in "Your uploaded clips"
-        youtube_video_path = os.path.join(SOURCE_CLIPS_DIR, f"{youtube_prefix}.mp4")
+            # 3. Update Configuration (append to history, not replace)
+            update_status("📝 Updating config...")
+            config = {
+                "mode": "youtube", 
+                "url": youtube_url,
+                "current_prefix": youtube_prefix,
+                "video_id": video_id,
+                "video_path": youtube_video_path
+            }
+            with open("video_config.json", "w") as f:
+                json.dump(config, f, indent=4)
+            
+            # Add to video history (re-read under the history lock, so concurrent jobs' entries are kept)
+            from source_dedup import update_history_entry
+            update_history_entry(youtube_prefix, type="youtube", url=youtube_url, video_id=video_id,
+                                 video_path=youtube_video_path, processed_at=datetime.now().isoformat())
+            job.complete_stage("download", youtube_prefix=youtube_prefix, video_path=youtube_video_path,
+                               sha256=video_sha256)
 
-        # 2. Download Video directly to source_clips/
-        update_status("⬇️ Downloading video...")
-        cmd_dl = [
-            "yt-dlp",
-            "-f", "best[ext=mp4]/best", 
-            "-o", youtube_video_path,
-            "--force-overwrites",
-            "--extractor-args", "youtube:player_client=android",
-            youtube_url
-        ]
-        subprocess.run(cmd_dl, check=True)
+        # Keyframe index next to the source lets result clips be stream-copied
+        from video_utils import ensure_keyframe_index
+        ensure_keyframe_index(youtube_video_path, update_status)
         
-        update_status(f"📥 Saved as {youtube_prefix}.mp4 in source_clips/")
+        if job.is_done("caption"):
+            pass
+        elif FRAME_PIPELINE == "stream":
+            # 4+5. Decode frames straight into the captioner (no JPEGs written)
+            job.start_stage("caption")
+            update_status(f"🤖 Streaming frames ({FRAME_SAMPLING_MODE} sampling) into the captioner...")
+            caption_youtube_stream(youtube_video_path, f"{youtube_prefix}_frame",
+                                   get_existing_captioned_frames(), update_status)
+            job.complete_stage("extract")
+            job.complete_stage("caption")
+        else:
+            # 4. Extract Frames with unique prefix (keeps existing frames)
+            if job.is_done("extract"):
+                new_frame_paths = sorted(
+                    os.path.join(FRAMES_DIR, f) for f in os.listdir(FRAMES_DIR)
+                    if f.startswith(f"{youtube_prefix}_frame") and f.endswith(".jpg")
+                )
+            else:
+                job.start_stage("extract")
+                update_status(f"🎞️ Extracting frames ({FRAME_SAMPLING_MODE} sampling) with prefix {youtube_prefix}...")
+                frames = extract_frames_for_youtube(youtube_video_path, f"{youtube_prefix}_frame", FRAMES_DIR, update_status)
+                new_frame_paths = [path for path, _ in frames]
+                job.complete_stage("extract")
 
-        # 3. Update Configuration (append to history, not replace)
-        update_status("📝 Updating config...")
-        config = {
-            "mode": "youtube", 
-            "url": youtube_url,
-            "current_prefix": youtube_prefix,
-            "video_id": video_id,
-            "video_path": youtube_video_path
-        }
-        with open("video_config.json", "w") as f:
-            json.dump(config, f, indent=4)
-        
-        # Add to video history
-        history["videos"].append({
-            "type": "youtube",
-            "url": youtube_url,
-            "video_id": video_id,
-            "prefix": youtube_prefix,
-            "video_path": youtube_video_path,
-            "processed_at": datetime.now().isoformat()
-        })
-        save_video_history(history)
-        
-        # 4. Extract Frames with unique prefix (keeps existing frames)
-        update_status(f"🎞️ Extracting frames (5 FPS) with prefix {youtube_prefix}...")
-        extract_frames_for_youtube(youtube_video_path, f"{youtube_prefix}_frame", FRAMES_DIR)
-        
-        # Collect new frame paths
-        new_frame_paths = []
-        for f in os.listdir(FRAMES_DIR):
-            if f.startswith(youtube_prefix) and f.endswith(".jpg"):
-                new_frame_paths.append(os.path.join(FRAMES_DIR, f))
-        new_frame_paths.sort()
-        
-        update_status(f"📁 Extracted {len(new_frame_paths)} frames")
+            update_status(f"📁 Extracted {len(new_frame_paths)} frames")
 
-        # 5. Generate Captions for NEW frames only (append to captions.txt)
-        existing_captions = get_existing_captioned_frames()
-        to_caption = [p for p in new_frame_paths if os.path.basename(p) not in existing_captions]
-        
-        if to_caption:
-            update_status(f"🤖 Generating visual captions for {len(to_caption)} new frames...")
-            caption_new_frames_for_youtube(to_caption, update_status)
-        else:
-            update_status("📝 No new frames to caption.")
+            # 5. Generate Captions for NEW frames only (append to captions.txt)
+            job.start_stage("caption")
+            existing_captions = get_existing_captioned_frames()
+            to_caption = [p for p in new_frame_paths if os.path.basename(p) not in existing_captions]
 
-        # 6. Extract and transcribe audio
-        try:
-            from audio_processor import process_audio_for_video
-            update_status("🎵 Processing audio...")
-            segments = process_audio_for_video(youtube_video_path, youtube_prefix, update_status)
-            if segments:
-                update_status(f"✅ Processed {len(segments)} audio segments")
+            if to_caption:
+                update_status(f"🤖 Generating visual captions for {len(to_caption)} new frames...")
+                caption_new_frames_for_youtube(to_caption, update_status)
             else:
-                update_status("⚠️ No audio segments extracted")
-        except ImportError:
-            update_status("⚠️ Audio processing not available (install openai-whisper)")
-        except Exception as e:
-            update_status(f"⚠️ Audio processing error: {e}")
+                update_status("📝 No new frames to caption.")
+            job.complete_stage("caption")
+
+        # 6. Extract and transcribe audio
+        if not job.is_done("transcribe"):
+            job.start_stage("transcribe")
+            try:
+                from audio_processor import process_audio_for_video
+                update_status("🎵 Processing audio...")
+                segments = process_audio_for_video(youtube_video_path, youtube_prefix, update_status)
+                if segments:
+                    update_status(f"✅ Processed {len(segments)} audio segments")
+                else:
+                    update_status("⚠️ No audio segments extracted")
+            except ImportError:
+                update_status("⚠️ Audio processing not available (install openai-whisper)")
+            except Exception as e:
+                update_status(f"⚠️ Audio processing error: {e}")
+            job.complete_stage("transcribe")
+
+        # Only fully ingested sources get a hash, so later duplicates never alias a half-processed video
+        if video_sha256:
+            from source_dedup import mark_ingested
+            mark_ingested(youtube_prefix, youtube_video_path, video_sha256)
 
         update_status("COMPLETED")
         
     except Exception as e:
         update_status(f"ERROR: {str(e)}")
+        if claimed_sha256:
+            from source_dedup import claim_owner, release_claim
+            release_claim(claimed_sha256, claim_owner(job))
         raise e
 
 if __name__ == "__main__":
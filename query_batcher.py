@@ -0,0 +1,123 @@
+"""
+Micro-batching query encoder. Concurrent cache misses from query_cache are collected for up to
+QUERY_BATCH_WINDOW_MS (or QUERY_BATCH_MAX queries), encoded in one forward pass of the shared
+SentenceTransformer, and each vector is handed back to its caller. Identical queries in a batch
+are encoded once. QUERY_BATCH_WINDOW_MS=0 encodes each query directly.
+Async endpoints use encode_query_async, which waits on the event loop rather than on an inference
+executor thread, so a batch can hold as many queries as there are concurrent requests.
+"""
+import os
+import time
+import asyncio
+import queue
+import threading
+from concurrent.futures import Future
+
+import numpy as np
+
+from model_registry import get_embedding_model
+
+QUERY_BATCH_WINDOW_MS = float(os.getenv("QUERY_BATCH_WINDOW_MS", "3"))
+QUERY_BATCH_MAX = int(os.getenv("QUERY_BATCH_MAX", "32"))
+
+_queue = queue.Queue()
+_start_lock = threading.Lock()
+_worker = None
+_stats_lock = threading.Lock()
+_stats = {"batches": 0, "queries": 0, "encoded": 0, "max_batch": 0, "total_wait_ms": 0.0, "max_wait_ms": 0.0,
+          "total_encode_ms": 0.0}
+
+def _ensure_worker():
+    global _worker
+    with _start_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_batch_loop, daemon=True, name="query-batcher")
+            _worker.start()
+
+def _collect():
+    """Block for the first request, then gather more until the window closes or the batch is full."""
+    batch = [_queue.get()]
+    deadline = time.perf_counter() + QUERY_BATCH_WINDOW_MS / 1000.0
+    while len(batch) < QUERY_BATCH_MAX:
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            break
+        try:
+            batch.append(_queue.get(timeout=remaining))
+        except queue.Empty:
+            break
+    return batch
+
+def _encode_batch(batch):
+    by_model = {}
+    for model_name, text, future, _ in batch:
+        by_model.setdefault(model_name, {}).setdefault(text, []).append(future)
+    encoded = 0
+    started = time.perf_counter()
+    for model_name, by_text in by_model.items():
+        texts = list(by_text)
+        try:
+            vectors = np.asarray(get_embedding_model(model_name).encode(texts, convert_to_numpy=True), dtype=np.float32)
+        except Exception as e:
+            for futures in by_text.values():
+                for future in futures:
+                    future.set_exception(e)
+            continue
+        encoded += len(texts)
+        for text, vector in zip(texts, vectors):
+            for future in by_text[text]:
+                future.set_result(vector)
+    return encoded, (time.perf_counter() - started) * 1000.0
+
+def _batch_loop():
+    while True:
+        batch = _collect()
+        now = time.perf_counter()
+        waits = [(now - enqueued) * 1000.0 for _, _, _, enqueued in batch]
+        encoded, encode_ms = _encode_batch(batch)
+        with _stats_lock:
+            _stats["batches"] += 1
+            _stats["queries"] += len(batch)
+            _stats["encoded"] += encoded
+            _stats["max_batch"] = max(_stats["max_batch"], len(batch))
+            _stats["total_wait_ms"] += sum(waits)
+            _stats["max_wait_ms"] = max(_stats["max_wait_ms"], max(waits))
+            _stats["total_encode_ms"] += encode_ms
+
+def _encode_now(text, model_name):
+    return np.asarray(get_embedding_model(model_name).encode(text), dtype=np.float32)
+
+def _submit(text, model_name):
+    _ensure_worker()
+    future = Future()
+    _queue.put((model_name, text, future, time.perf_counter()))
+    return future
+
+def encode_query(text: str, model_name: str):
+    """Embedding of one query as float32, encoded together with queries arriving at the same time."""
+    if QUERY_BATCH_WINDOW_MS <= 0:
+        return _encode_now(text, model_name)
+    return _submit(text, model_name).result()
+
+async def encode_query_async(text: str, model_name: str):
+    """encode_query for the event loop: no thread is held while the batch fills."""
+    if QUERY_BATCH_WINDOW_MS <= 0:
+        return await asyncio.to_thread(_encode_now, text, model_name)
+    return await asyncio.wrap_future(_submit(text, model_name))
+
+def batcher_stats():
+    with _stats_lock:
+        batches = _stats["batches"]
+        queries = _stats["queries"]
+        return {
+            "window_ms": QUERY_BATCH_WINDOW_MS,
+            "max_batch_size": QUERY_BATCH_MAX,
+            "batches": batches,
+            "queries": queries,
+            "encoded": _stats["encoded"],
+            "mean_batch_size": round(queries / batches, 2) if batches else 0.0,
+            "largest_batch": _stats["max_batch"],
+            "mean_wait_ms": round(_stats["total_wait_ms"] / queries, 3) if queries else 0.0,
+            "max_wait_ms": round(_stats["max_wait_ms"], 3),
+            "mean_encode_ms": round(_stats["total_encode_ms"] / batches, 3) if batches else 0.0,
+        }
@@ -0,0 +1,153 @@
+"""
+Query-embedding cache shared by every search path (semantic_search, vector_store, suggestions).
+Keyed by (model name, normalized query). In-memory LRU with hit/miss counters and an
+optional SQLite tier (QUERY_CACHE_DISK=1) so popular queries survive restarts.
+Async endpoints call prefetch_query_embedding before taking an inference executor slot, so
+misses are batched on the event loop and the search itself finds the embedding cached.
+"""
+import os
+import asyncio
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from model_registry import EMBEDDING_MODEL_NAME
+from query_batcher import encode_query, encode_query_async
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "2048"))
+QUERY_CACHE_DISK = os.getenv("QUERY_CACHE_DISK", "0") == "1"
+QUERY_CACHE_DB = os.path.join(BASE_DIR, "query_cache.db")
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+_stats = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+_prefetched = {}  # key -> lookups already counted by prefetch_query_embedding
+
+def normalize_query(query: str) -> str:
+    """Lowercase and collapse whitespace (MiniLM is uncased, so the embedding is unchanged)."""
+    return " ".join(query.lower().split())
+
+def _disk_connect():
+    conn = sqlite3.connect(QUERY_CACHE_DB, timeout=5)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS query_embeddings ("
+        "model TEXT NOT NULL, query TEXT NOT NULL, embedding BLOB NOT NULL, "
+        "PRIMARY KEY (model, query))"
+    )
+    return conn
+
+def _disk_get(model_name, query):
+    try:
+        conn = _disk_connect()
+        try:
+            row = conn.execute(
+                "SELECT embedding FROM query_embeddings WHERE model = ? AND query = ?", (model_name, query)
+            ).fetchone()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"⚠️ Query cache disk read failed: {e}")
+        return None
+    return np.frombuffer(row[0], dtype=np.float32) if row else None
+
+def _disk_put(model_name, query, embedding):
+    try:
+        conn = _disk_connect()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO query_embeddings (model, query, embedding) VALUES (?, ?, ?)",
+                    (model_name, query, embedding.tobytes()),
+                )
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"⚠️ Query cache disk write failed: {e}")
+
+def _remember(key, embedding):
+    with _lock:
+        _cache[key] = embedding
+        _cache.move_to_end(key)
+        while len(_cache) > QUERY_CACHE_SIZE:
+            evicted, _ = _cache.popitem(last=False)
+            _prefetched.pop(evicted, None)
+            _stats["evictions"] += 1
+
+def _lookup(key):
+    """Memory-tier hit (counted, unless prefetch_query_embedding already counted this lookup) or None."""
+    with _lock:
+        embedding = _cache.get(key)
+        if embedding is not None:
+            _cache.move_to_end(key)
+            if _prefetched.get(key):
+                _prefetched[key] -= 1
+                if not _prefetched[key]:
+                    del _prefetched[key]
+            else:
+                _stats["hits"] += 1
+        return embedding
+
+def get_query_embedding(query: str, model_name: str = EMBEDDING_MODEL_NAME):
+    """Embedding of a search query as a read-only float32 vector, computed at most once per query."""
+    normalized = normalize_query(query)
+    key = (model_name, normalized)
+    embedding = _lookup(key)
+    if embedding is not None:
+        return embedding
+
+    embedding = _disk_get(model_name, normalized) if QUERY_CACHE_DISK else None
+    if embedding is not None:
+        with _lock:
+            _stats["disk_hits"] += 1
+    else:
+        with _lock:
+            _stats["misses"] += 1
+        # Misses from concurrent requests share one forward pass
+        embedding = encode_query(normalized, model_name)
+        if QUERY_CACHE_DISK:
+            _disk_put(model_name, normalized, embedding)
+
+    embedding.setflags(write=False)  # shared between callers
+    _remember(key, embedding)
+    return embedding
+
+async def prefetch_query_embedding(query: str, model_name: str = EMBEDDING_MODEL_NAME):
+    """
+    Make sure a query's embedding is cached, awaiting the batcher on the event loop on a miss.
+    The search's own get_query_embedding call then hits without encoding (and isn't counted twice).
+    """
+    normalized = normalize_query(query)
+    key = (model_name, normalized)
+    with _lock:
+        if key in _cache:
+            return
+    embedding = await asyncio.to_thread(_disk_get, model_name, normalized) if QUERY_CACHE_DISK else None
+    with _lock:
+        _stats["disk_hits" if embedding is not None else "misses"] += 1
+    if embedding is None:
+        embedding = await encode_query_async(normalized, model_name)
+        if QUERY_CACHE_DISK:
+            await asyncio.to_thread(_disk_put, model_name, normalized, embedding)
+    embedding.setflags(write=False)  # shared between callers
+    _remember(key, embedding)
+    with _lock:
+        _prefetched[key] = _prefetched.get(key, 0) + 1
+
+def cache_stats():
+    with _lock:
+        lookups = _stats["hits"] + _stats["disk_hits"] + _stats["misses"]
+        return {
+            **_stats,
+            "size": len(_cache),
+            "capacity": QUERY_CACHE_SIZE,
+            "hit_rate": round((_stats["hits"] + _stats["disk_hits"]) / lookups, 3) if lookups else 0.0,
+            "disk_tier": QUERY_CACHE_DISK,
+        }
+
+def clear_cache():
+    with _lock:
+        _cache.clear()
+        _prefetched.clear()
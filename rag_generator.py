@@ -1,41 +1,72 @@
 # rag_generator.py
 import os
+import asyncio
 from dotenv import load_dotenv
 
+import llm_cache
+
 load_dotenv()
 
 # Try to import OpenAI, but handle gracefully if not available
+# async_client serves the async endpoints (same key/model, non-blocking HTTP)
 try:
-    from openai import OpenAI
+    from openai import OpenAI, AsyncOpenAI
     api_key = os.getenv("OPENAI_API_KEY")
     if api_key:
         client = OpenAI(api_key=api_key)
+        async_client = AsyncOpenAI(api_key=api_key)
         OPENAI_AVAILABLE = True
     else:
         print("⚠️ OPENAI_API_KEY not found in .env file")
         OPENAI_AVAILABLE = False
         client = None
+        async_client = None
 except ImportError:
     print("⚠️ OpenAI package not installed. Install with: pip install openai")
     OPENAI_AVAILABLE = False
     client = None
+    async_client = None
 except Exception as e:
     print(f"⚠️ OpenAI client initialization failed: {e}")
     OPENAI_AVAILABLE = False
     client = None
-
-def generate_explanation(query, search_results):
-    """Generate natural language explanation of search results"""
-    
+    async_client = None
+
+# Bump when a prompt template below changes so cached responses from the old prompt aren't reused
+PROMPT_VERSION = "1"
+
+def _cached_chat(kind, query, results, request):
+    """Response text for a chat request, served from llm_cache when the same query/results were answered before."""
+    key = llm_cache.cache_key(kind, request["model"], query, results, PROMPT_VERSION)
+    cached = llm_cache.get(key)
+    if cached is not None:
+        return cached
+    response = client.chat.completions.create(**request)
+    content = response.choices[0].message.content
+    llm_cache.put(key, kind, content)
+    return content
+
+async def _cached_chat_async(kind, query, results, request):
+    # llm_cache is synchronous SQLite; keep it off the event loop
+    key = llm_cache.cache_key(kind, request["model"], query, results, PROMPT_VERSION)
+    cached = await asyncio.to_thread(llm_cache.get, key)
+    if cached is not None:
+        return cached
+    response = await async_client.chat.completions.create(**request)
+    content = response.choices[0].message.content
+    await asyncio.to_thread(llm_cache.put, key, kind, content)
+    return content
+
+def _explanation_fallback(search_results, with_score=True):
     if not search_results:
-        return "No matching moments found. Try rephrasing your query or using different keywords."
-    
-    if not OPENAI_AVAILABLE or not client:
-        # Fallback explanation without LLM
-        if search_results:
-            return f"Found {len(search_results)} matching moments. Top result: '{search_results[0]['caption']}' at {search_results[0]['start']:.1f}s with {search_results[0]['score']:.0%} relevance."
         return "No results found."
-    
+    top = search_results[0]
+    if with_score:
+        return f"Found {len(search_results)} matching moments. Top result: '{top['caption']}' at {top['start']:.1f}s with {top['score']:.0%} relevance."
+    return f"Found {len(search_results)} matching moments. Top result: '{top['caption']}' at {top['start']:.1f}s."
+
+def _explanation_request(query, search_results):
+    """chat.completions.create kwargs for an explanation of search_results."""
     # Build context from results
     context_parts = []
     for i, result in enumerate(search_results[:5], 1):
@@ -59,23 +90,74 @@ Provide a concise, friendly explanation (2-3 sentences) that:
 
 Be conversational and helpful."""
 
+    return dict(
+        model=os.getenv("OPENAI_MODEL", "gpt-3.5-turbo"),
+        messages=[
+            {"role": "system", "content": "You are a helpful video search assistant."},
+            {"role": "user", "content": prompt}
+        ],
+        max_tokens=150,
+        temperature=0.7
+    )
+
+def generate_explanation(query, search_results):
+    """Generate natural language explanation of search results"""
+    
+    if not search_results:
+        return "No matching moments found. Try rephrasing your query or using different keywords."
+    
+    if not OPENAI_AVAILABLE or not client:
+        # Fallback explanation without LLM
+        return _explanation_fallback(search_results)
+
     try:
-        response = client.chat.completions.create(
-            model=os.getenv("OPENAI_MODEL", "gpt-3.5-turbo"),
-            messages=[
-                {"role": "system", "content": "You are a helpful video search assistant."},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=150,
-            temperature=0.7
-        )
-        return response.choices[0].message.content
+        return _cached_chat("explanation", query, search_results, _explanation_request(query, search_results))
     except Exception as e:
         print(f"⚠️ Error generating explanation: {e}")
         # Fallback
-        if search_results:
-            return f"Found {len(search_results)} matching moments. Top result: '{search_results[0]['caption']}' at {search_results[0]['start']:.1f}s."
-        return "No results found."
+        return _explanation_fallback(search_results, with_score=False)
+
+async def generate_explanation_async(query, search_results):
+    """generate_explanation for async endpoints: awaits the OpenAI round-trip instead of blocking a thread."""
+    if not search_results:
+        return "No matching moments found. Try rephrasing your query or using different keywords."
+    if not OPENAI_AVAILABLE or not async_client:
+        return _explanation_fallback(search_results)
+    try:
+        return await _cached_chat_async("explanation", query, search_results, _explanation_request(query, search_results))
+    except Exception as e:
+        print(f"⚠️ Error generating explanation: {e}")
+        return _explanation_fallback(search_results, with_score=False)
+
+async def stream_explanation_async(query, search_results):
+    """Yield the explanation as text chunks as the model generates them (one chunk for the fallback)."""
+    if not search_results:
+        yield "No matching moments found. Try rephrasing your query or using different keywords."
+        return
+    if not OPENAI_AVAILABLE or not async_client:
+        yield _explanation_fallback(search_results)
+        return
+    request = _explanation_request(query, search_results)
+    key = llm_cache.cache_key("explanation", request["model"], query, search_results, PROMPT_VERSION)
+    cached = await asyncio.to_thread(llm_cache.get, key)
+    if cached is not None:
+        yield cached
+        return
+    sent = False
+    parts = []
+    try:
+        stream = await async_client.chat.completions.create(stream=True, **request)
+        async for chunk in stream:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                sent = True
+                parts.append(delta)
+                yield delta
+        await asyncio.to_thread(llm_cache.put, key, "explanation", "".join(parts))
+    except Exception as e:
+        print(f"⚠️ Error streaming explanation: {e}")
+        if not sent:
+            yield _explanation_fallback(search_results, with_score=False)
 
 def generate_suggestions(query, search_results):
     """Generate suggestion prompts that will give the best search results.
@@ -117,7 +199,7 @@ Suggest exactly 3 SEARCH QUERIES that would give the BEST results for this video
 Return ONLY the 3 search phrases, one per line. No numbers, bullets, or explanations."""
 
     try:
-        response = client.chat.completions.create(
+        raw = _cached_chat("suggestions", query, search_results[:5], dict(
             model=os.getenv("OPENAI_MODEL", "gpt-3.5-turbo"),
             messages=[
                 {"role": "system", "content": "You suggest concrete video search queries that get the best results. Output only the 3 search phrases, one per line."},
@@ -125,8 +207,7 @@ Return ONLY the 3 search phrases, one per line. No numbers, bullets, or explanat
             ],
             max_tokens=120,
             temperature=0.7
-        )
-        raw = response.choices[0].message.content.strip()
+        )).strip()
         suggestions = raw.split("\n")
         cleaned = [s.strip("- ").strip().strip('"').strip("'").strip() for s in suggestions if s.strip()]
         # Remove leading numbers (e.g. "1. query" -> "query")
@@ -176,7 +257,7 @@ Rules for the 3 suggestions:
 Return ONLY 3 short search phrases, one per line. No numbers, bullets, or explanations."""
 
     try:
-        response = client.chat.completions.create(
+        raw = _cached_chat("suggestions_captions", query, vector_db_results[:12], dict(
             model=os.getenv("OPENAI_MODEL", "gpt-3.5-turbo"),
             messages=[
                 {"role": "system", "content": "You suggest video search queries with clear intent (before/after/during) and emotion, based on real video captions. Output only 3 search phrases, one per line."},
@@ -184,8 +265,7 @@ Return ONLY 3 short search phrases, one per line. No numbers, bullets, or explan
             ],
             max_tokens=120,
             temperature=0.6
-        )
-        raw = response.choices[0].message.content.strip()
+        )).strip()
         suggestions = raw.split("\n")
         cleaned = [s.strip("- ").strip().strip('"').strip("'").strip() for s in suggestions if s.strip()]
         cleaned = [s.lstrip("0123456789.").strip() for s in cleaned]
@@ -235,7 +315,7 @@ Rules for the 3 suggestions:
 Return ONLY 3 short search phrases, one per line. No numbers, bullets, or explanations."""
 
     try:
-        response = client.chat.completions.create(
+        raw = _cached_chat("suggestions_audio", query, audio_vector_results[:12], dict(
             model=os.getenv("OPENAI_MODEL", "gpt-3.5-turbo"),
             messages=[
                 {"role": "system", "content": "You suggest search queries for finding video moments by spoken dialogue. Output only 3 phrases, one per line."},
@@ -243,8 +323,7 @@ Return ONLY 3 short search phrases, one per line. No numbers, bullets, or explan
             ],
             max_tokens=120,
             temperature=0.6
-        )
-        raw = response.choices[0].message.content.strip()
+        )).strip()
         suggestions = raw.split("\n")
         cleaned = [s.strip("- ").strip().strip('"').strip("'").strip() for s in suggestions if s.strip()]
         cleaned = [s.lstrip("0123456789.").strip() for s in cleaned]
@@ -1,10 +1,21 @@
 # rag_search.py
 from vector_store import search_vector_db, search_audio_vector_db
-from rag_generator import generate_explanation, generate_summary
-from video_utils import ensure_clip, _get_source_video_for_frame
+from rag_generator import generate_explanation, generate_explanation_async, stream_explanation_async, generate_summary
+from inference_pool import run_inference
+from query_cache import prefetch_query_embedding
+from video_utils import _get_source_video_for_frame
+from clip_service import clip_url, wait_for_url_async
+from frame_sampling import nearest_frame
+from frame_catalog import canonical_source
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 import json
 import os
-import re
+import time
+
+# Runs video retrieval and the explanation alongside the calling thread in sync rag_search
+_pipeline_executor = ThreadPoolExecutor(max_workers=int(os.getenv("RAG_PIPELINE_WORKERS", "4")),
+                                        thread_name_prefix="rag-pipeline")
 
 def get_video_config():
     try:
@@ -28,21 +39,17 @@ def get_full_video_url(best_frame: str, start: float):
     return f"{url}&t={int(start)}s"
 
 def _normalize_clip_id_for_frame(clip_id: str) -> str:
-    """Ensure clip_id has 3-digit padding for frame lookup (clip_001, youtube_001)."""
-    if not clip_id or clip_id == "0":
-        return clip_id
-    m = re.match(r"(clip|youtube)_(\d+)$", clip_id)
-    if m:
-        return f"{m.group(1)}_{m.group(2).zfill(3)}"
-    return clip_id
-
-def rag_search(query: str, audio_only: bool = False):
-    """RAG-enhanced search with explanations. When audio_only=True, prioritizes dialog/audio matches."""
-    
-    # Step 1: Retrieve from video captions and/or audio transcriptions
-    video_results = [] if audio_only else search_vector_db(query, top_k=10, threshold=0.4)
-    audio_results = search_audio_vector_db(query, top_k=15 if audio_only else 10, threshold=0.35 if audio_only else 0.4)
-    
+    """Ensure clip_id matches the frame catalog's spelling (clip_1 -> clip_001)."""
+    return canonical_source(clip_id)
+
+def _search_video(query: str, audio_only: bool = False):
+    return [] if audio_only else search_vector_db(query, top_k=10, threshold=0.4)
+
+def _search_audio(query: str, audio_only: bool = False):
+    return search_audio_vector_db(query, top_k=15 if audio_only else 10, threshold=0.35 if audio_only else 0.4)
+
+def _merge_results(video_results, audio_results, audio_only: bool = False):
+    """Merge video + audio hits into the ranked search_results."""
     # Merge and deduplicate results (prioritize higher scores)
     all_results = []
     seen_timestamps = set()
@@ -58,13 +65,14 @@ def rag_search(query: str, audio_only: bool = False):
     for result in audio_results:
         key = (result.get("clip_id", "0"), round(result["start"], 1))
         if key not in seen_timestamps:
-            # Frame 0 may not exist (FFmpeg usually starts at 1); ensure min duration for single segment
-            frame_num = max(1, int(result["start"] * 5))  # 5 FPS
+            # Ensure min duration for single segment
             if result["start"] == result["end"]:
                 result["end"] = result["start"] + 3.0  # Estimate ~3s for single utterance
             clip_id = _normalize_clip_id_for_frame(result.get("clip_id", "0"))
             if clip_id and clip_id != "0":
-                result["best_frame"] = f"{clip_id}_frame_{frame_num:04d}.jpg"
+                # Frame numbers don't map to timestamps under adaptive sampling: use the kept frame
+                # nearest the utterance; a source with no frames on record keeps its first frame name
+                result["best_frame"] = nearest_frame(clip_id, result["start"]) or f"{clip_id}_frame_0001.jpg"
             else:
                 result["best_frame"] = "frame_0001.jpg"  # fallback
             all_results.append(result)
@@ -74,6 +82,10 @@ def rag_search(query: str, audio_only: bool = False):
     all_results.sort(key=lambda x: x["score"], reverse=True)
     search_results = all_results[:15] if audio_only else all_results[:10]
     
+    return search_results
+
+def _apply_intent(query: str, search_results):
+    """Temporal intent windows + playable URLs for each hit (clip renders are only dispatched)."""
     # Step 2: Apply temporal intent (reuse existing logic)
     intent_results = []
     if search_results:
@@ -117,7 +129,8 @@ def rag_search(query: str, audio_only: bool = False):
                 adj_start = max(0, adj_start - diff / 2)
                 adj_end = adj_end + diff / 2
             
-            clip_filename = ensure_clip(adj_start, adj_end, r["best_frame"])
+            # Seekable stream URL (or a clip rendered in the background, per CLIP_DELIVERY)
+            video_url = clip_url(adj_start, adj_end, r["best_frame"])
             full_url = get_full_video_url(r["best_frame"], adj_start)
             intent_results.append({
                 "best_frame": r["best_frame"],
@@ -128,22 +141,158 @@ def rag_search(query: str, audio_only: bool = False):
                 "start": adj_start,
                 "end": adj_end,
                 "score": r["score"],
-                "video_url": f"http://localhost:8000/clips/{clip_filename}",
+                "video_url": video_url,
                 "full_video_url": full_url,
                 "is_youtube": get_video_config().get("mode", "youtube") != "clips",
                 "source": r.get("source", "video")  # "video" or "audio"
             })
     
-    # Step 3: Generate explanations (RAG)
-    explanation = generate_explanation(query, search_results)
-    summary = generate_summary(query, search_results)
-    
-    # Step 4: Return enhanced results
+    return intent_results
+
+def _timed(fn, *args):
+    """(fn(*args), elapsed ms)."""
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, _elapsed_ms(started)
+
+async def _timed_async(coro):
+    started = time.perf_counter()
+    result = await coro
+    return result, _elapsed_ms(started)
+
+def _elapsed_ms(started):
+    return round((time.perf_counter() - started) * 1000.0, 1)
+
+def _response(query, search_results, intent_results, explanation, timings):
     return {
         "query": query,
         "results": intent_results,
         "explanation": explanation,
-        "summary": summary,
-        "count": len(intent_results)
+        "summary": generate_summary(query, search_results),
+        "count": len(intent_results),
+        "timings": timings
     }
 
+def rag_search(query: str, audio_only: bool = False, explain: bool = True):
+    """
+    RAG-enhanced search with explanations. When audio_only=True, prioritizes dialog/audio matches.
+    Video and audio retrieval run in parallel; the explanation (an LLM round-trip) overlaps with
+    building the result list. explain=False skips it so results come back at retrieval latency.
+    Per-stage timings (ms) are returned under "timings".
+    """
+    timings = {}
+    started = time.perf_counter()
+
+    # Step 1: Retrieve from video captions and audio transcriptions concurrently
+    video_future = _pipeline_executor.submit(_timed, _search_video, query, audio_only)
+    audio_results, timings["audio_retrieval_ms"] = _timed(_search_audio, query, audio_only)
+    video_results, timings["video_retrieval_ms"] = video_future.result()
+    timings["retrieval_ms"] = _elapsed_ms(started)
+    search_results, timings["merge_ms"] = _timed(_merge_results, video_results, audio_results, audio_only)
+
+    # Step 3 (RAG) only needs the ranked hits, so start it before step 2
+    explanation_future = (_pipeline_executor.submit(_timed, generate_explanation, query, search_results)
+                          if explain else None)
+
+    # Step 2: Apply temporal intent; clip renders are dispatched, not awaited
+    intent_results, timings["intent_ms"] = _timed(_apply_intent, query, search_results)
+
+    explanation = None
+    if explanation_future is not None:
+        explanation, timings["explanation_ms"] = explanation_future.result()
+    timings["total_ms"] = _elapsed_ms(started)
+
+    # Step 4: Return enhanced results
+    return _response(query, search_results, intent_results, explanation, timings)
+
+async def rag_search_async(query: str, audio_only: bool = False, explain: bool = True):
+    """
+    rag_search for async endpoints: embedding + Chroma retrieval run on the size-capped inference
+    executor (video and audio concurrently), the explanation is awaited on the async OpenAI client
+    while the result list is built. Raises InferenceOverloaded / InferenceTimeout when the
+    inference queue is full or slow.
+    """
+    timings = {}
+    started = time.perf_counter()
+    # Embed on the event loop first: concurrent requests share one batch without holding executor threads
+    await prefetch_query_embedding(query)
+    (video_results, timings["video_retrieval_ms"]), (audio_results, timings["audio_retrieval_ms"]) = await asyncio.gather(
+        run_inference(_timed, _search_video, query, audio_only),
+        run_inference(_timed, _search_audio, query, audio_only),
+    )
+    timings["retrieval_ms"] = _elapsed_ms(started)
+    search_results, timings["merge_ms"] = await run_inference(
+        _timed, _merge_results, video_results, audio_results, audio_only)
+
+    explanation_task = (asyncio.create_task(_timed_async(generate_explanation_async(query, search_results)))
+                        if explain else None)
+    try:
+        intent_results, timings["intent_ms"] = await run_inference(_timed, _apply_intent, query, search_results)
+    except BaseException:
+        if explanation_task is not None:
+            explanation_task.cancel()
+        raise
+
+    explanation = None
+    if explanation_task is not None:
+        explanation, timings["explanation_ms"] = await explanation_task
+    timings["total_ms"] = _elapsed_ms(started)
+    return _response(query, search_results, intent_results, explanation, timings)
+
+async def rag_search_stream(query: str, audio_only: bool = False, explain: bool = True):
+    """
+    Streaming rag_search. Yields events as they become available:
+      {"event": "results", ...}      ranked hits right after retrieval (same shape as rag_search)
+      {"event": "clip", "index", "video_url", "ready"}  when a rendered clip is playable
+      {"event": "explanation", "delta"}  explanation text as the LLM generates it
+      {"event": "done", "explanation", "timings"}
+    Clip readiness and explanation tokens are interleaved in arrival order.
+    """
+    timings = {}
+    started = time.perf_counter()
+    # Embed on the event loop first: concurrent requests share one batch without holding executor threads
+    await prefetch_query_embedding(query)
+    (video_results, timings["video_retrieval_ms"]), (audio_results, timings["audio_retrieval_ms"]) = await asyncio.gather(
+        run_inference(_timed, _search_video, query, audio_only),
+        run_inference(_timed, _search_audio, query, audio_only),
+    )
+    timings["retrieval_ms"] = _elapsed_ms(started)
+    search_results, timings["merge_ms"] = await run_inference(
+        _timed, _merge_results, video_results, audio_results, audio_only)
+    intent_results, timings["intent_ms"] = await run_inference(_timed, _apply_intent, query, search_results)
+    timings["first_result_ms"] = _elapsed_ms(started)
+    yield {"event": "results", **_response(query, search_results, intent_results, None, dict(timings))}
+
+    events = asyncio.Queue()
+    explanation_parts = []
+
+    async def watch_clip(index, video_url):
+        if video_url and "/clips/" in video_url:
+            ready = await wait_for_url_async(video_url)
+            await events.put({"event": "clip", "index": index, "video_url": video_url, "ready": ready})
+
+    async def stream_explanation():
+        explain_started = time.perf_counter()
+        async for delta in stream_explanation_async(query, search_results):
+            explanation_parts.append(delta)
+            await events.put({"event": "explanation", "delta": delta})
+        timings["explanation_ms"] = _elapsed_ms(explain_started)
+
+    producers = [asyncio.create_task(watch_clip(i, r["video_url"])) for i, r in enumerate(intent_results)]
+    if explain:
+        producers.append(asyncio.create_task(stream_explanation()))
+    finished = asyncio.gather(*producers, return_exceptions=True)
+    try:
+        while not (finished.done() and events.empty()):
+            getter = asyncio.ensure_future(events.get())
+            await asyncio.wait({getter, finished}, return_when=asyncio.FIRST_COMPLETED)
+            if getter.done():
+                yield getter.result()
+            else:
+                getter.cancel()
+    finally:
+        for task in producers:
+            task.cancel()
+
+    timings["total_ms"] = _elapsed_ms(started)
+    yield {"event": "done", "explanation": "".join(explanation_parts) if explain else None, "timings": timings}
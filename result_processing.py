@@ -0,0 +1,69 @@
+"""
+Vectorized post-retrieval processing shared by semantic_search and vector_store.
+Hits are parallel NumPy arrays (source code, timestamp, score) instead of per-hit dicts:
+thresholding, sorting and gap clustering are array operations, so a deep candidate pool
+costs little more than a shallow one. Only the returned top clusters become dicts.
+"""
+import os
+import numpy as np
+
+# Candidates pulled from the index before thresholding/clustering (was a hard-coded 50)
+RESULT_CANDIDATES = int(os.getenv("RESULT_CANDIDATES", "200"))
+
+def encode_source_ids(source_ids):
+    """Map source ID strings (clip_001, youtube_002, ...) to int codes. Returns (codes, names)."""
+    names, codes = np.unique(np.asarray(source_ids, dtype=object).astype(str), return_inverse=True)
+    return codes.astype(np.int32), names.tolist()
+
+def top_candidates(scores, k=None, threshold=None):
+    """Indices of the k highest scores (>= threshold), best first."""
+    k = min(k or RESULT_CANDIDATES, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    idx = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+    if threshold is not None:
+        idx = idx[scores[idx] >= threshold]
+    return idx[np.argsort(-scores[idx], kind="stable")]
+
+def cluster_hits(source_codes, timestamps, scores, threshold=0.0, gap=1.0, limit=None):
+    """
+    Group hits of the same source whose consecutive timestamps are <= gap apart.
+    Arrays are parallel (one entry per candidate). Returns clusters sorted by best score:
+    [{"index": best candidate index, "start", "end", "score", "frame_count", "source_code"}, ...]
+    """
+    source_codes = np.asarray(source_codes)
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    scores = np.asarray(scores, dtype=np.float64)
+
+    keep = np.flatnonzero(scores >= threshold)
+    if keep.size == 0:
+        return []
+    # Sort by source, then time (stable, like the old tuple sort)
+    keep = keep[np.lexsort((timestamps[keep], source_codes[keep]))]
+    src, ts, sc = source_codes[keep], timestamps[keep], scores[keep]
+
+    breaks = np.empty(len(keep), dtype=bool)
+    breaks[0] = True
+    breaks[1:] = (src[1:] != src[:-1]) | (np.diff(ts) > gap)
+    starts = np.flatnonzero(breaks)
+    ends = np.append(starts[1:], len(keep)) - 1
+    cluster = np.cumsum(breaks) - 1
+
+    # Best hit per cluster: order by (cluster, -score); ties keep time order like max()
+    by_score = np.lexsort((-sc, cluster))
+    best = by_score[starts]
+
+    order = np.argsort(-sc[best], kind="stable")
+    if limit is not None:
+        order = order[:limit]
+    return [
+        {
+            "index": int(keep[best[c]]),
+            "start": float(ts[starts[c]]),
+            "end": float(ts[ends[c]]),
+            "score": float(sc[best[c]]),
+            "frame_count": int(ends[c] - starts[c] + 1),
+            "source_code": int(src[starts[c]]),
+        }
+        for c in order
+    ]
@@ -1,126 +1,173 @@
-from sentence_transformers import SentenceTransformer, util
-import torch
-import re
-
-# Load model once (IMPORTANT for performance)
-model = SentenceTransformer("all-MiniLM-L6-v2")
+import os
+import json
+import numpy as np
+from model_registry import EMBEDDING_MODEL_NAME, get_embedding_model
+from query_cache import get_query_embedding
+from frame_sampling import load_frame_timestamps, frame_timestamp, MAX_FRAME_INTERVAL
+from frame_catalog import frame_arrays
+from incremental_source import make_mark, valid_offset, iter_appended_lines
+from result_processing import top_candidates, cluster_hits
+
+CAPTIONS_FILE = "captions.txt"
+# Normalized caption embeddings, one row per caption line, memory-mapped at startup.
+# The manifest ties the rows to the bytes of captions.txt they were computed from.
+EMBEDDINGS_FILE = "caption_embeddings.bin"
+MANIFEST_FILE = "caption_embeddings.json"
+# float32 or float16 (half the disk/RAM; scores are computed in float32)
+EMBEDDINGS_DTYPE = os.getenv("SEMANTIC_EMBEDDINGS_DTYPE", "float32")
+ENCODE_CHUNK_SIZE = 512
+SCORE_CHUNK_ROWS = 65536
 
 captions = []
 frames = []
+# Parallel NumPy arrays (one entry per caption) used by vectorized clustering
+timestamps = np.empty(0)
+clip_codes = np.empty(0, dtype=np.int32)
+clip_names = {}  # catalog source code -> source ID
 caption_embeddings = None
 
+def _read_manifest():
+    if not os.path.exists(MANIFEST_FILE):
+        return None
+    try:
+        with open(MANIFEST_FILE, "r") as f:
+            return json.load(f)
+    except Exception:
+        return None
+
+def _write_manifest(manifest):
+    tmp_path = MANIFEST_FILE + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=4)
+    os.replace(tmp_path, MANIFEST_FILE)
+
+def _append_embeddings(texts, out):
+    """Encode texts in chunks and append normalized rows to the open embeddings file."""
+    model = get_embedding_model()
+    for i in range(0, len(texts), ENCODE_CHUNK_SIZE):
+        emb = model.encode(texts[i:i + ENCODE_CHUNK_SIZE], convert_to_numpy=True, normalize_embeddings=True)
+        out.write(np.asarray(emb, dtype=EMBEDDINGS_DTYPE).tobytes())
+
+def _clear():
+    global captions, frames, timestamps, clip_codes, clip_names, caption_embeddings
+    captions, frames, caption_embeddings = [], [], None
+    timestamps, clip_codes, clip_names = np.empty(0), np.empty(0, dtype=np.int32), {}
+
 def load_data():
-    global captions, frames, caption_embeddings
-    captions = []
-    frames = []
-    
-    if not os.path.exists("captions.txt"):
+    """
+    Load captions and their embeddings. Embeddings persist in EMBEDDINGS_FILE; only captions
+    appended to captions.txt since the manifest was written are encoded, then the file is
+    memory-mapped. A rewritten captions.txt or a model/dtype change triggers a rebuild.
+    """
+    global captions, frames, timestamps, clip_codes, clip_names, caption_embeddings
+
+    if not os.path.exists(CAPTIONS_FILE):
         print("⚠️ captions.txt not found. Search will return empty.")
+        _clear()
         return
 
-    with open("captions.txt", "r") as f:
-        for line in f:
-            if ": " in line:
-                frame, caption = line.strip().split(": ", 1)
-                frames.append(frame)
-                captions.append(caption)
+    manifest = _read_manifest()
+    offset = None
+    if manifest and manifest.get("model") == EMBEDDING_MODEL_NAME and manifest.get("dtype") == EMBEDDINGS_DTYPE:
+        offset = valid_offset(manifest.get("source"), CAPTIONS_FILE)
+        expected_bytes = manifest["rows"] * manifest["dim"] * np.dtype(EMBEDDINGS_DTYPE).itemsize
+        if not os.path.exists(EMBEDDINGS_FILE) or os.path.getsize(EMBEDDINGS_FILE) != expected_bytes:
+            offset = None  # embeddings file doesn't match the manifest (e.g. interrupted append)
+    rebuild = offset is None
+
+    new_frames, new_captions = [], []
+    new_rows = []  # captions past the manifest offset that still need embeddings
+    end_offset = 0
+    known_rows = 0 if rebuild else manifest["rows"]
+    for line, end_offset in iter_appended_lines(CAPTIONS_FILE, 0):
+        if ": " in line:
+            frame, caption = line.split(": ", 1)
+            new_frames.append(frame)
+            new_captions.append(caption)
+            if len(new_frames) > known_rows:
+                new_rows.append(caption)
+
+    # Source and timestamp per caption come from the frame catalog (no filename parsing)
+    new_codes, new_timestamps, new_names = frame_arrays(new_frames)
+    unknown = np.flatnonzero(np.isnan(new_timestamps))
+    if unknown.size:
+        recorded = load_frame_timestamps()
+        new_timestamps[unknown] = [frame_timestamp(new_frames[i], recorded) for i in unknown]
+
+    if not new_captions:
+        print("⚠️ No captions found in file.")
+        _clear()
+        return
 
-    if captions:
-        print(f"🔄 Loading {len(captions)} captions into embeddings...")
-        caption_embeddings = model.encode(captions, convert_to_tensor=True)
+    dim = get_embedding_model().get_sentence_embedding_dimension() if (rebuild or new_rows) else manifest["dim"]
+    if rebuild or new_rows:
+        if rebuild:
+            print(f"🔄 Building embeddings for {len(new_rows)} captions...")
+            # Write a new file and swap it in: searches still scoring against the old mapping
+            # keep a valid (unlinked) file instead of a truncated one
+            tmp_path = EMBEDDINGS_FILE + ".tmp"
+            with open(tmp_path, "wb") as out:
+                _append_embeddings(new_rows, out)
+            os.replace(tmp_path, EMBEDDINGS_FILE)
+        else:
+            print(f"🔄 Embedding {len(new_rows)} new captions (reusing {known_rows})...")
+            # Appending leaves the rows existing mappings cover untouched
+            with open(EMBEDDINGS_FILE, "ab") as out:
+                _append_embeddings(new_rows, out)
+        _write_manifest({
+            "model": EMBEDDING_MODEL_NAME,
+            "dtype": EMBEDDINGS_DTYPE,
+            "dim": dim,
+            "rows": len(new_captions),
+            "source": make_mark(CAPTIONS_FILE, end_offset),
+        })
     else:
-        print("⚠️ No captions found in file.")
+        print(f"⚡ Memory-mapping {len(new_captions)} cached caption embeddings")
+
+    embeddings = np.memmap(EMBEDDINGS_FILE, dtype=EMBEDDINGS_DTYPE, mode="r", shape=(len(new_captions), dim))
+    # Swap in together so concurrent searches see a consistent snapshot
+    captions, frames, caption_embeddings = new_captions, new_frames, embeddings
+    timestamps, clip_codes, clip_names = new_timestamps, new_codes, new_names
 
 # Initial load
-import os
 load_data()
 
 
-def search(query, top_k=10, threshold=0.4):
-
-    query_embedding = model.encode(query, convert_to_tensor=True)
-    scores = util.cos_sim(query_embedding, caption_embeddings)[0]
-
-    # Get a larger pool of potential matches to cluster
-    top_results = torch.topk(scores, k=min(50, len(scores)))
-
-    hits = []
-    for score, idx in zip(top_results.values, top_results.indices):
-        score_val = float(score)
-        if score_val < threshold:
-            continue
-        
-        idx_val = int(idx)
-        frame = frames[idx_val]
-        nums = re.findall(r"\d+", frame)
-        ts = int(nums[-1]) / 5.0 if nums else 0.0
-        
-        # Support both clip_XXX and youtube_XXX prefixes
-        m = re.match(r"clip_(\d+)_frame", frame)
-        if m:
-            clip_id = f"clip_{m.group(1)}"
-        else:
-            m = re.match(r"youtube_(\d+)_frame", frame)
-            if m:
-                clip_id = f"youtube_{m.group(1)}"
-            else:
-                clip_id = "0"
-        
-        hits.append({
-            "frame": frame,
-            "score": score_val,
-            "caption": captions[idx_val],
-            "timestamp": ts,
-            "clip_id": clip_id
-        })
+def _cosine_scores(query):
+    """Cosine similarity of the query against every caption (rows are pre-normalized)."""
+    q = np.asarray(get_query_embedding(query), dtype=np.float32)
+    q = q / (np.linalg.norm(q) or 1.0)
+    emb = caption_embeddings
+    if emb.dtype == np.float32:
+        return emb @ q
+    return np.concatenate([
+        emb[i:i + SCORE_CHUNK_ROWS].astype(np.float32) @ q
+        for i in range(0, len(emb), SCORE_CHUNK_ROWS)
+    ])
 
-    # Sort by clip_id then timestamp for clustering
-    hits.sort(key=lambda x: (x["clip_id"], x["timestamp"]))
 
-    # Cluster hits into clips
-    clips = []
-    if not hits:
+def search(query, top_k=10, threshold=0.4):
+    if caption_embeddings is None:
         return []
 
-    current_clip = [hits[0]]
-    # Time gap threshold to consider frames part of same clip (e.g. 1.0 second)
-    GAP_THRESHOLD = 1.0 
+    scores = _cosine_scores(query)
 
-    for hit in hits[1:]:
-        same_clip = hit["clip_id"] == current_clip[-1]["clip_id"]
-        time_gap_ok = hit["timestamp"] - current_clip[-1]["timestamp"] <= GAP_THRESHOLD
-        if same_clip and time_gap_ok:
-            current_clip.append(hit)
-        else:
-            # Consolidate clip
-            best_hit = max(current_clip, key=lambda x: x["score"])
-            clips.append({
-                "start": current_clip[0]["timestamp"],
-                "end": current_clip[-1]["timestamp"],
-                "score": best_hit["score"],
-                "caption": best_hit["caption"],
-                "best_frame": best_hit["frame"],
-                "frame_count": len(current_clip)
-            })
-            current_clip = [hit]
-    
-    # Append last clip
-    if current_clip:
-        best_hit = max(current_clip, key=lambda x: x["score"])
-        clips.append({
-            "start": current_clip[0]["timestamp"],
-            "end": current_clip[-1]["timestamp"],
-            "score": best_hit["score"],
-            "caption": best_hit["caption"],
-            "best_frame": best_hit["frame"],
-            "frame_count": len(current_clip)
-        })
-
-    # Sort clips by score (descending)
-    clips.sort(key=lambda x: x["score"], reverse=True)
-
-    # Return top clips (e.g. top 5) to avoid noise
-    return clips[:1]
+    # Get a larger pool of potential matches to cluster
+    idx = top_candidates(scores, threshold=threshold)
+    # Time gap threshold to consider frames part of same clip (e.g. 1.0 second);
+    # widened to the adaptive sampler's max interval between kept frames
+    clusters = cluster_hits(clip_codes[idx], timestamps[idx], scores[idx], threshold=threshold,
+                            gap=max(1.0, MAX_FRAME_INTERVAL), limit=1)
+
+    # Return top clip to avoid noise
+    return [{
+        "start": c["start"],
+        "end": c["end"],
+        "score": c["score"],
+        "caption": captions[idx[c["index"]]],
+        "best_frame": frames[idx[c["index"]]],
+        "frame_count": c["frame_count"]
+    } for c in clusters]
 
 
 def search_frames(query):
@@ -0,0 +1,233 @@
+"""
+Content-addressed ingest. Sources are identified by the SHA-256 of their bytes, recorded in
+video_history.json once a source is fully ingested. An upload (or YouTube download) identical
+to an ingested source is not processed again: it is recorded as an alias of that source, whose
+frames, captions and transcriptions already answer searches.
+Also the single writer for per-source fields in video_history.json (see update_history_entry).
+Job workers are separate processes, so every read-modify-write of the history holds an flock on
+video_history.json.lock, and a source being ingested is claimed by its hash (claim_source) so an
+identical upload running concurrently in another job is deferred instead of ingesting it too.
+A queued job owns its claims by job ID, so they survive a worker crash until the job resumes.
+"""
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows: the thread lock alone (single-process use)
+    fcntl = None
+
+VIDEO_HISTORY_FILE = "video_history.json"
+SOURCE_CLIPS_DIR = "source_clips"
+CAPTIONS_FILE = "captions.txt"
+HASH_CHUNK_BYTES = 1024 * 1024
+# A claim older than this is taken over (the claiming job is assumed stuck)
+SOURCE_CLAIM_TIMEOUT = float(os.getenv("SOURCE_CLAIM_TIMEOUT", str(6 * 3600)))
+SOURCE_CLAIM_POLL_SECONDS = 2.0
+# A queued job that finds its content claimed by another job is re-queued to try again after this
+SOURCE_CLAIM_RETRY_SECONDS = float(os.getenv("SOURCE_CLAIM_RETRY_SECONDS", "30"))
+
+_history_lock = threading.RLock()
+_lock_state = threading.local()
+
+def sha256_file(path: str) -> str:
+    """Streaming SHA-256 of a file (1 MB reads)."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def stage_upload(src, dest_path: str):
+    """
+    Copy an upload's file object to dest_path in HASH_CHUNK_BYTES pieces, hashing on the fly,
+    so memory use doesn't depend on the upload size. Returns (sha256, size).
+    """
+    digest = hashlib.sha256()
+    size = 0
+    with open(dest_path, "wb") as out:
+        for chunk in iter(lambda: src.read(HASH_CHUNK_BYTES), b""):
+            digest.update(chunk)
+            out.write(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size
+
+def sha256_content(content) -> str:
+    """SHA-256 of a staged upload (path) or raw bytes."""
+    if isinstance(content, (bytes, bytearray)):
+        return hashlib.sha256(content).hexdigest()
+    return sha256_file(content)
+
+def _load_history():
+    if os.path.exists(VIDEO_HISTORY_FILE):
+        with open(VIDEO_HISTORY_FILE, "r") as f:
+            return json.load(f)
+    return {"videos": []}
+
+def _save_history(history):
+    tmp_path = f"{VIDEO_HISTORY_FILE}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(history, f, indent=4)
+    os.replace(tmp_path, VIDEO_HISTORY_FILE)
+
+@contextmanager
+def _locked_history():
+    """Exclusive access to video_history.json across threads and worker processes (re-entrant per thread)."""
+    with _history_lock:
+        depth = getattr(_lock_state, "depth", 0)
+        if depth == 0 and fcntl is not None:
+            _lock_state.file = open(VIDEO_HISTORY_FILE + ".lock", "a")
+            fcntl.flock(_lock_state.file, fcntl.LOCK_EX)
+        _lock_state.depth = depth + 1
+        try:
+            yield
+        finally:
+            _lock_state.depth = depth
+            if depth == 0 and fcntl is not None:
+                fcntl.flock(_lock_state.file, fcntl.LOCK_UN)
+                _lock_state.file.close()
+
+def update_history_entry(prefix: str, **fields):
+    """
+    Set fields on the video_history.json entry for a source prefix (creating a "clip" entry for
+    uploads that have none yet). Alias entries are never matched.
+    """
+    with _locked_history():
+        history = _load_history()
+        entry = next((v for v in history.setdefault("videos", [])
+                      if v.get("prefix") == prefix and not v.get("alias_of")), None)
+        if entry is None:
+            entry = {"type": "clip", "prefix": prefix, "processed_at": datetime.now().isoformat()}
+            history["videos"].append(entry)
+        entry.update(fields)
+        _save_history(history)
+
+def add_history_alias(alias_of: str, **fields):
+    """Record a re-upload / re-download of an ingested source as an alias entry."""
+    with _locked_history():
+        history = _load_history()
+        history.setdefault("videos", []).append(
+            {**fields, "alias_of": alias_of, "processed_at": datetime.now().isoformat()})
+        _save_history(history)
+
+def _has_captions(prefix: str) -> bool:
+    if not os.path.exists(CAPTIONS_FILE):
+        return False
+    marker = f"{prefix}_frame_"
+    with open(CAPTIONS_FILE, "r") as f:
+        return any(line.startswith(marker) for line in f)
+
+def _legacy_duplicate(digest: str, size: int, known_prefixes):
+    """
+    Match against sources ingested before hashes were recorded: only files of the same size are
+    hashed, and only sources with captions count as ingested. Their hash is recorded on a match.
+    """
+    if not os.path.isdir(SOURCE_CLIPS_DIR):
+        return None
+    for name in sorted(os.listdir(SOURCE_CLIPS_DIR)):
+        m = re.match(r"^((?:clip|youtube)_\d+)\.\w+$", name)
+        if not m or m.group(1) in known_prefixes:
+            continue
+        path = os.path.join(SOURCE_CLIPS_DIR, name)
+        try:
+            if os.path.getsize(path) != size:
+                continue
+        except OSError:
+            continue
+        if sha256_file(path) == digest and _has_captions(m.group(1)):
+            update_history_entry(m.group(1), video_path=path, sha256=digest, size=size)
+            return m.group(1)
+    return None
+
+def find_ingested_source(digest: str, size: int = None):
+    """Prefix of an already-ingested source with this SHA-256 whose file still exists, else None."""
+    with _locked_history():
+        history = _load_history()
+        known = set()
+        for v in history.get("videos", []):
+            if v.get("alias_of"):
+                continue
+            if v.get("sha256"):
+                known.add(v.get("prefix"))
+            if v.get("sha256") == digest and v.get("video_path") and os.path.exists(v["video_path"]):
+                return v["prefix"]
+        return _legacy_duplicate(digest, size, known) if size is not None else None
+
+class SourceBusy(Exception):
+    """Identical content is being ingested by another job (claim_source with wait=False)."""
+
+def claim_owner(job=None) -> str:
+    """Claim owner: the queued job's ID (outlives its worker process), else this process and thread."""
+    job_id = getattr(job, "id", None)
+    return f"job:{job_id}" if job_id else f"{os.getpid()}:{threading.get_ident()}"
+
+def _claim_is_live(claim, owner) -> bool:
+    if claim.get("owner") == owner or time.time() - claim.get("since", 0) > SOURCE_CLAIM_TIMEOUT:
+        return False
+    holder = claim.get("owner", "")
+    if holder.startswith("job:"):
+        # Held until the job completes or fails, including while it waits to resume after a crash
+        from job_queue import get_job
+        state = (get_job(holder[4:]) or {}).get("state")
+        return state in ("queued", "running")
+    try:
+        os.kill(int(holder.split(":")[0]), 0)
+    except ProcessLookupError:
+        return False
+    except (OSError, ValueError):
+        pass
+    return True
+
+def claim_source(digest: str, size: int = None, update_status=print, owner=None, wait=True):
+    """
+    Atomically look up an ingested source with this SHA-256 or claim the hash for owner
+    (claim_owner()). Returns the existing source's prefix, or None once the claim is held (release
+    it with mark_ingested or release_claim); a claim owner already holds is simply kept. While
+    another live owner holds the claim, waits for it (wait=True) or raises SourceBusy, so a queued
+    job can be deferred rather than block its worker. Claim several hashes in sorted order so two
+    waiting jobs can't wait on each other.
+    """
+    owner = owner or claim_owner()
+    waiting = False
+    while True:
+        with _locked_history():
+            existing = find_ingested_source(digest, size)
+            if existing:
+                return existing
+            history = _load_history()
+            claims = history.setdefault("ingesting", {})
+            if digest not in claims or not _claim_is_live(claims[digest], owner):
+                if claims.get(digest, {}).get("owner") != owner:
+                    claims[digest] = {"owner": owner, "since": time.time()}
+                    _save_history(history)
+                return None
+        if not wait:
+            raise SourceBusy(f"identical content ({digest[:12]}) is being ingested by another job")
+        if not waiting:
+            update_status(f"⏳ Identical content is being ingested by another job; waiting for it ({digest[:12]})")
+            waiting = True
+        time.sleep(SOURCE_CLAIM_POLL_SECONDS)
+
+def release_claim(digest: str, owner=None):
+    """Drop owner's claim on a hash (ingest failed or abandoned); owner=None drops any claim."""
+    with _locked_history():
+        history = _load_history()
+        claims = history.get("ingesting", {})
+        if digest in claims and (owner is None or claims[digest].get("owner") == owner):
+            del claims[digest]
+            _save_history(history)
+
+def mark_ingested(prefix: str, video_path: str, digest: str):
+    """Record the content hash once a source's frames, captions and transcriptions are written, and release its claim."""
+    fields = {"video_path": video_path, "sha256": digest}
+    if os.path.exists(video_path):
+        fields["size"] = os.path.getsize(video_path)
+    with _locked_history():
+        update_history_entry(prefix, **fields)
+        release_claim(digest)
@@ -0,0 +1,48 @@
+"""
+Concurrent async searches share one query-encoding batch, even when there are more of them than
+inference executor threads (INFERENCE_WORKERS).
+"""
+import asyncio
+
+import numpy as np
+
+import inference_pool
+import query_batcher
+import query_cache
+
+
+class _FakeEncoder:
+    def __init__(self):
+        self.batches = []
+
+    def encode(self, texts, convert_to_numpy=True):
+        texts = [texts] if isinstance(texts, str) else list(texts)
+        self.batches.append(texts)
+        return np.ones((len(texts), 4), dtype=np.float32)
+
+
+def test_concurrent_queries_share_one_batch(monkeypatch):
+    encoder = _FakeEncoder()
+    monkeypatch.setattr(query_batcher, "get_embedding_model", lambda _name: encoder)
+    monkeypatch.setattr(query_batcher, "QUERY_BATCH_WINDOW_MS", 200.0)
+    monkeypatch.setattr(query_cache, "QUERY_CACHE_DISK", False)
+    query_cache.clear_cache()
+
+    before = query_cache.cache_stats()
+    queries = [f"query number {i}" for i in range(inference_pool.INFERENCE_WORKERS * 4)]
+
+    async def search(query):
+        # What the /search endpoint does: embed on the event loop, then search on the executor
+        await query_cache.prefetch_query_embedding(query)
+        return await inference_pool.run_inference(query_cache.get_query_embedding, query)
+
+    async def run_all():
+        return await asyncio.gather(*(search(q) for q in queries))
+
+    embeddings = asyncio.run(run_all())
+
+    assert encoder.batches == [queries]
+    assert all(e.shape == (4,) for e in embeddings)
+    stats = query_cache.cache_stats()
+    assert stats["misses"] - before["misses"] == len(queries)
+    assert stats["hits"] == before["hits"]  # the executor-side lookups were already counted
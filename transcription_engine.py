@@ -0,0 +1,427 @@
+"""
+Chunked Whisper transcription.
+Audio arrives as float32 blocks (from a WAV file or an ffmpeg pipe), is split at silences
+(energy VAD) into chunks of up to WHISPER_CHUNK_SECONDS as it streams in, the chunks are
+transcribed in parallel on a process pool (WHISPER_WORKERS processes, each holding one
+model), and segment timestamps are shifted back onto the original timeline.
+WHISPER_BACKEND: "auto" (faster-whisper int8 when installed, else openai-whisper),
+"faster" or "openai". WHISPER_ENGINE=single transcribes the whole file in one call as before.
+"""
+import os
+import wave
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+WHISPER_ENGINE = os.getenv("WHISPER_ENGINE", "chunked")
+WHISPER_BACKEND = os.getenv("WHISPER_BACKEND", "auto")
+# Empty = detect on the first chunk and reuse it for the rest
+WHISPER_LANGUAGE = os.getenv("WHISPER_LANGUAGE") or None
+WHISPER_CHUNK_SECONDS = float(os.getenv("WHISPER_CHUNK_SECONDS", "30"))
+WHISPER_WORKERS = int(os.getenv("WHISPER_WORKERS", str(max(1, min(4, (os.cpu_count() or 1) // 2)))))
+
+VAD_FRAME_MS = 30
+# A frame is speech when louder than the noise floor + VAD_MARGIN_DB, and always when above -25 dBFS
+VAD_MARGIN_DB = float(os.getenv("VAD_MARGIN_DB", "10"))
+VAD_MIN_DB = float(os.getenv("VAD_MIN_DB", "-45"))
+VAD_MIN_SILENCE_MS = int(os.getenv("VAD_MIN_SILENCE_MS", "400"))
+VAD_MIN_SPEECH_MS = 150
+VAD_PAD_MS = 200
+# Optional music filter (off by default): speech has syllable-rate dips in loudness, so a good share of
+# its frames fall well below the local average; sustained music rarely does. Regions of at least
+# VAD_MUSIC_MIN_SECONDS whose share of such low-energy frames is under VAD_MIN_LOW_ENERGY_RATIO are
+# dropped before Whisper. Dialog over a music bed looks the same, so only enable it (e.g. 0.15) for
+# libraries without mixed dialog and music.
+VAD_MIN_LOW_ENERGY_RATIO = float(os.getenv("VAD_MIN_LOW_ENERGY_RATIO", "0"))
+VAD_MUSIC_MIN_SECONDS = 2.0
+# Segments Whisper itself rates as probably not speech (music, noise) are dropped after transcription
+WHISPER_NO_SPEECH_PROB = float(os.getenv("WHISPER_NO_SPEECH_PROB", "0.6"))
+# Audio buffered before planning chunks from a stream; chunks still open at the end of the buffer wait for more
+STREAM_PLAN_SECONDS = 2 * WHISPER_CHUNK_SECONDS
+WAV_BLOCK_SECONDS = 10
+
+_pool = None
+_pool_key = None  # (backend, workers, threads) the pool was started with
+_pool_lock = threading.Lock()
+_cpu_budget = (None, None)  # (cores, max workers) for the pool, see set_cpu_budget
+
+def default_logger(msg):
+    print(msg)
+
+def resolve_backend(backend=None):
+    """"faster" or "openai" for the configured backend."""
+    backend = backend or WHISPER_BACKEND
+    if backend != "auto":
+        return backend
+    try:
+        import faster_whisper  # noqa: F401
+        return "faster"
+    except ImportError:
+        return "openai"
+
+def wav_blocks(audio_path: str, block_seconds: float = WAV_BLOCK_SECONDS):
+    """Yield a 16 kHz mono 16-bit WAV (as written by extract_audio_from_video) as float32 blocks."""
+    with wave.open(audio_path, "rb") as wf:
+        if wf.getframerate() != SAMPLE_RATE or wf.getnchannels() != 1 or wf.getsampwidth() != 2:
+            raise ValueError(f"expected 16 kHz mono s16 WAV: {audio_path}")
+        while True:
+            data = wf.readframes(int(block_seconds * SAMPLE_RATE))
+            if not data:
+                break
+            yield np.frombuffer(data, dtype=np.int16).astype(np.float32) / 32768.0
+
+def load_wav(audio_path: str):
+    """Whole WAV as float32 samples."""
+    blocks = list(wav_blocks(audio_path))
+    return np.concatenate(blocks) if blocks else np.empty(0, dtype=np.float32)
+
+def _frame_energy_db(samples):
+    """Energy per VAD frame in dBFS (samples are float32 in [-1, 1])."""
+    frame = SAMPLE_RATE * VAD_FRAME_MS // 1000
+    n = len(samples) // frame
+    if n == 0:
+        return np.empty(0, dtype=np.float32)
+    frames = samples[:n * frame].reshape(n, frame)
+    return 10.0 * np.log10(np.mean(frames * frames, axis=1) + 1e-10)
+
+def low_energy_ratio(energy_db):
+    """Share of frames quieter than half the RMS averaged over the surrounding second."""
+    if len(energy_db) == 0:
+        return 0.0
+    rms = 10.0 ** (energy_db / 20.0)
+    width = min(len(rms), 1000 // VAD_FRAME_MS)
+    local_mean = np.convolve(rms, np.ones(width) / width, mode="same")
+    return float(np.mean(rms < 0.5 * local_mean))
+
+def speech_regions(samples, energy_db=None):
+    """
+    [(start_sample, end_sample)] of speech. Frames above the adaptive threshold are voiced;
+    gaps shorter than VAD_MIN_SILENCE_MS are bridged, blips under VAD_MIN_SPEECH_MS and
+    music-like stretches (see VAD_MIN_LOW_ENERGY_RATIO) dropped, and each region padded by VAD_PAD_MS.
+    """
+    energy_db = _frame_energy_db(samples) if energy_db is None else energy_db
+    if len(energy_db) == 0:
+        return []
+    noise_floor = float(np.percentile(energy_db, 10))
+    threshold = max(VAD_MIN_DB, min(noise_floor + VAD_MARGIN_DB, -25.0))
+    voiced = energy_db > threshold
+    if not voiced.any():
+        return []
+
+    # Run boundaries of voiced frames
+    edges = np.diff(np.concatenate(([0], voiced.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+
+    min_gap = VAD_MIN_SILENCE_MS // VAD_FRAME_MS
+    merged = [[starts[0], ends[0]]]
+    for s, e in zip(starts[1:], ends[1:]):
+        if s - merged[-1][1] < min_gap:
+            merged[-1][1] = e
+        else:
+            merged.append([s, e])
+
+    frame = SAMPLE_RATE * VAD_FRAME_MS // 1000
+    pad = SAMPLE_RATE * VAD_PAD_MS // 1000
+    min_frames = VAD_MIN_SPEECH_MS // VAD_FRAME_MS
+    regions = []
+    music_frames = int(VAD_MUSIC_MIN_SECONDS * 1000) // VAD_FRAME_MS
+    for s, e in merged:
+        if e - s < min_frames:
+            continue
+        if VAD_MIN_LOW_ENERGY_RATIO > 0 and e - s >= music_frames and \
+                low_energy_ratio(energy_db[s:e]) < VAD_MIN_LOW_ENERGY_RATIO:
+            continue
+        start = max(0, s * frame - pad)
+        end = min(len(samples), e * frame + pad)
+        if regions and start <= regions[-1][1]:
+            regions[-1] = (regions[-1][0], end)
+        else:
+            regions.append((start, end))
+    return regions
+
+def plan_chunks(regions, energy_db, max_seconds=None):
+    """
+    Pack speech regions into chunks of at most max_seconds, cutting only in silence.
+    A region longer than max_seconds is cut at its quietest frame in the last 5 s of each window.
+    """
+    max_len = int((max_seconds or WHISPER_CHUNK_SECONDS) * SAMPLE_RATE)
+    frame = SAMPLE_RATE * VAD_FRAME_MS // 1000
+    pieces = []
+    for start, end in regions:
+        while end - start > max_len:
+            lo = max((start + max_len - 5 * SAMPLE_RATE) // frame, start // frame + 1)
+            window = energy_db[lo:(start + max_len) // frame]
+            cut = (lo + int(np.argmin(window))) * frame if len(window) else start + max_len
+            pieces.append((start, cut))
+            start = cut
+        pieces.append((start, end))
+
+    chunks = []
+    for start, end in pieces:
+        if chunks and end - chunks[-1][0] <= max_len:
+            chunks[-1] = (chunks[-1][0], end)
+        else:
+            chunks.append((start, end))
+    return chunks
+
+def _transcribe_samples(audio, backend, language=None):
+    """Transcribe float32 16 kHz samples. Returns (segments with no_speech_prob, detected language)."""
+    if backend == "faster":
+        from model_registry import get_faster_whisper_model
+        segments, info = get_faster_whisper_model().transcribe(audio, language=language, task="transcribe")
+        return [{"start": s.start, "end": s.end, "text": s.text.strip(), "no_speech_prob": s.no_speech_prob}
+                for s in segments], info.language
+    from model_registry import get_whisper_model
+    result = get_whisper_model().transcribe(audio, language=language, task="transcribe", verbose=None)
+    segments = [{"start": s["start"], "end": s["end"], "text": s["text"].strip(),
+                 "no_speech_prob": s.get("no_speech_prob", 0.0)} for s in result.get("segments", [])]
+    return segments, result.get("language")
+
+def _transcribe_chunk(audio, offset, backend, language):
+    """Worker entry point: transcribe one chunk and shift its segments by offset seconds."""
+    duration = len(audio) / SAMPLE_RATE
+    segments, detected = _transcribe_samples(audio, backend, language)
+    shifted = [
+        {"start": round(offset + s["start"], 2), "end": round(offset + min(s["end"], duration), 2), "text": s["text"]}
+        for s in segments if s["text"] and s["no_speech_prob"] < WHISPER_NO_SPEECH_PROB
+    ]
+    return shifted, detected
+
+def _init_worker(backend, threads):
+    """Load the model once per worker process, with threads split between workers."""
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    os.environ.setdefault("WHISPER_CPU_THREADS", str(threads))
+    if backend == "faster":
+        from model_registry import get_faster_whisper_model
+        get_faster_whisper_model()
+    else:
+        from model_registry import get_whisper_model
+        get_whisper_model()
+
+def set_cpu_budget(cores=None, max_workers=None):
+    """
+    Limit the chunk worker pool to `cores` threads in total and at most max_workers processes
+    (e.g. while the captioner runs alongside during ingest); None restores all cores and
+    WHISPER_WORKERS. Applies to the next transcription: a pool of another shape is replaced.
+    """
+    global _cpu_budget
+    _cpu_budget = (cores, max_workers)
+
+def _pool_shape():
+    """(worker processes, threads per worker) within the current CPU budget."""
+    cores, max_workers = _cpu_budget
+    cores = cores or os.cpu_count() or 1
+    workers = max(1, min(WHISPER_WORKERS, max_workers or WHISPER_WORKERS, cores))
+    return workers, max(1, cores // workers)
+
+def _get_pool(backend):
+    global _pool, _pool_key
+    with _pool_lock:
+        key = (backend, *_pool_shape())
+        if _pool is not None and _pool_key != key:
+            _pool.shutdown(wait=True)
+            _pool = None
+        if _pool is None:
+            _, workers, threads = key
+            # spawn: forking a process that already holds torch/CUDA state is unsafe
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                        initializer=_init_worker, initargs=(backend, threads))
+            _pool_key = key
+        return _pool
+
+def _workers_for(backend):
+    """Process pool only pays off on CPU; one GPU model is shared in-process."""
+    from model_registry import default_device
+    return 1 if default_device() != "cpu" else _pool_shape()[0]
+
+def _warm_chunk(backend):
+    """Pool task: transcribe one second of silence so the worker's model and first-call setup are done."""
+    _transcribe_samples(np.zeros(SAMPLE_RATE, dtype=np.float32), backend, WHISPER_LANGUAGE or "en")
+    return os.getpid()
+
+def warm_pool(backend=None):
+    """
+    Load the model in this process and in every pool worker, each running a dummy chunk, so
+    timed work (benchmark_transcription) isn't charged for worker start-up.
+    """
+    backend = resolve_backend(backend)
+    _init_worker(backend, os.cpu_count() or 1)
+    _warm_chunk(backend)
+    if _workers_for(backend) <= 1:
+        return
+    pool = _get_pool(backend)
+    workers = _pool_shape()[0]
+    warmed = set()
+    # A worker still loading its model may leave its dummy chunk to a faster one: retry until each has run one
+    for _ in range(5):
+        warmed.update(f.result() for f in [pool.submit(_warm_chunk, backend) for _ in range(workers)])
+        if len(warmed) >= workers:
+            break
+
+def stitch_segments(chunk_results):
+    """Merge per-chunk segments (already on the source timeline) into one ordered, non-overlapping list."""
+    segments = sorted((s for chunk in chunk_results for s in chunk), key=lambda s: s["start"])
+    stitched = []
+    for seg in segments:
+        if stitched and seg["start"] < stitched[-1]["end"]:
+            seg = {**seg, "start": stitched[-1]["end"]}
+        if seg["end"] > seg["start"]:
+            stitched.append(seg)
+    return stitched
+
+def transcribe_single(audio, backend=None):
+    """Whole input (WAV path or float32 samples) in one transcribe call: the original path, kept for WHISPER_ENGINE=single and the benchmark."""
+    backend = resolve_backend(backend)
+    if backend == "faster":
+        segments, _ = _transcribe_samples(load_wav(audio) if isinstance(audio, str) else audio, backend, WHISPER_LANGUAGE)
+        return [{k: s[k] for k in ("start", "end", "text")} for s in segments]
+    from model_registry import get_whisper_model
+    result = get_whisper_model().transcribe(audio, language=WHISPER_LANGUAGE, task="transcribe", verbose=False)
+    return [{"start": s["start"], "end": s["end"], "text": s["text"].strip()} for s in result.get("segments", [])]
+
+def _closed_chunks(buffer, final):
+    """
+    Chunks of buffer that can be transcribed now, how many samples of buffer they consume, and how
+    many of those samples are speech. Until the stream ends, a chunk must be followed by enough
+    silence that more audio can't extend it.
+    """
+    energy_db = _frame_energy_db(buffer)
+    regions = speech_regions(buffer, energy_db)
+    chunks = plan_chunks(regions, energy_db)
+    if final:
+        closed, consumed = chunks, len(buffer)
+    else:
+        limit = len(buffer) - SAMPLE_RATE * (VAD_MIN_SILENCE_MS + VAD_PAD_MS) // 1000
+        closed = []
+        for start, end in chunks:
+            if end > limit:
+                break
+            closed.append((start, end))
+        if closed:
+            consumed = closed[-1][1]
+        else:
+            consumed = chunks[0][0] if chunks else max(0, limit)
+    speech = sum(max(0, min(end, consumed) - start) for start, end in regions)
+    return closed, consumed, speech
+
+def transcribe_stream(blocks, backend=None, update_status=default_logger, label="audio", stats=None):
+    """
+    VAD-chunked, parallel transcription of float32 16 kHz blocks. Chunks are dispatched as soon as
+    they close, so decoding (e.g. an ffmpeg pipe) overlaps transcription and only about
+    STREAM_PLAN_SECONDS of audio is buffered; Whisper never sees audio without speech.
+    Returns [{"start", "end", "text"}] on the original timeline. If stats (a dict) is given, it is
+    filled with duration_seconds, speech_seconds and speech_ratio.
+    """
+    backend = resolve_backend(backend)
+    workers = _workers_for(backend)
+    pool = _get_pool(backend) if workers > 1 else None
+    update_status(f"🎤 Transcribing {label} with {backend}-whisper on {workers} worker(s)...")
+
+    language = WHISPER_LANGUAGE
+    first = None   # first chunk's future; it fixes the language so every chunk is decoded the same way
+    held = []      # chunks waiting for that language
+    futures = []
+    results = []
+    stats = {} if stats is None else stats
+    counts = {"chunks": 0, "kept": 0, "total": 0, "speech": 0}
+
+    def dispatch(audio, offset):
+        nonlocal language, first
+        counts["chunks"] += 1
+        counts["kept"] += len(audio)
+        if pool is None:
+            segs, detected = _transcribe_chunk(audio, offset, backend, language)
+            language = language or detected
+            results.append(segs)
+            return
+        if language is None and first is not None and first.done():
+            language = first.result()[1]
+        if language is None and first is not None:
+            held.append((audio, offset))
+            return
+        future = pool.submit(_transcribe_chunk, audio, offset, backend, language)
+        first = first or future
+        futures.append(future)
+
+    buffer = np.empty(0, dtype=np.float32)
+    consumed_total = 0
+    plan_len = int(STREAM_PLAN_SECONDS * SAMPLE_RATE)
+    for block in blocks:
+        counts["total"] += len(block)
+        buffer = np.concatenate((buffer, block))
+        if len(buffer) < plan_len:
+            continue
+        chunks, consumed, speech = _closed_chunks(buffer, final=False)
+        counts["speech"] += speech
+        for start, end in chunks:
+            dispatch(buffer[start:end], (consumed_total + start) / SAMPLE_RATE)
+        buffer = buffer[consumed:]
+        consumed_total += consumed
+    chunks, _, speech = _closed_chunks(buffer, final=True)
+    counts["speech"] += speech
+    stats.update(_speech_stats(counts["speech"], counts["total"]))
+    for start, end in chunks:
+        dispatch(buffer[start:end], (consumed_total + start) / SAMPLE_RATE)
+
+    if held:
+        language = language or first.result()[1]
+        futures.extend(pool.submit(_transcribe_chunk, audio, offset, backend, language) for audio, offset in held)
+    results.extend(f.result()[0] for f in futures)
+
+    if not counts["chunks"]:
+        update_status(f"🔇 No speech detected in {label}; skipped Whisper")
+        return []
+    update_status(f"🧩 Transcribed {counts['chunks']} chunks ({counts['kept'] / SAMPLE_RATE:.0f}s of "
+                  f"{counts['total'] / SAMPLE_RATE:.0f}s after dropping silence and music)")
+    return stitch_segments(results)
+
+def _speech_stats(speech_samples, total_samples):
+    return {
+        "duration_seconds": round(total_samples / SAMPLE_RATE, 2),
+        "speech_seconds": round(speech_samples / SAMPLE_RATE, 2),
+        "speech_ratio": round(speech_samples / total_samples, 3) if total_samples else 0.0,
+    }
+
+def transcribe_chunked(audio_path: str, backend=None, update_status=default_logger, stats=None):
+    """transcribe_stream over a WAV file."""
+    return transcribe_stream(wav_blocks(audio_path), backend, update_status, label=os.path.basename(audio_path),
+                             stats=stats)
+
+def transcribe(audio, update_status=default_logger, label=None, stats=None):
+    """
+    Transcribe with the configured engine (WHISPER_ENGINE).
+    audio: a WAV path, or an iterable of float32 16 kHz blocks (e.g. audio_processor.stream_audio_pcm).
+    stats: optional dict filled with duration_seconds, speech_seconds and speech_ratio.
+    """
+    label = label or (os.path.basename(audio) if isinstance(audio, str) else "audio stream")
+    blocks = wav_blocks(audio) if isinstance(audio, str) else audio
+    if WHISPER_ENGINE != "single":
+        return transcribe_stream(blocks, update_status=update_status, label=label, stats=stats)
+
+    # Whole input in one call, but still skipped when the VAD finds no speech
+    blocks = list(blocks)
+    samples = np.concatenate(blocks) if blocks else np.empty(0, dtype=np.float32)
+    regions = speech_regions(samples)
+    speech = _speech_stats(sum(end - start for start, end in regions), len(samples))
+    if stats is not None:
+        stats.update(speech)
+    if not regions:
+        update_status(f"🔇 No speech detected in {label}; skipped Whisper")
+        return []
+    update_status(f"🎤 Transcribing {label}...")
+    return transcribe_single(audio if isinstance(audio, str) else samples)
+
+def shutdown():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
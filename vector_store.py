@@ -1,8 +1,9 @@
 # vector_store.py
 import chromadb
-from sentence_transformers import SentenceTransformer
 import os
 import re
+import json
+import numpy as np
 
 # Path fixed to this package dir so chroma_db is always Intent_search_AI/chroma_db
 # regardless of where uvicorn is started (avoids empty DB when cwd differs)
@@ -10,102 +11,150 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 CHROMA_PATH = os.path.join(BASE_DIR, "chroma_db")
 CAPTIONS_PATH = os.path.join(BASE_DIR, "captions.txt")
 TRANSCRIPTIONS_PATH = os.path.join(BASE_DIR, "audio_transcriptions.txt")
-
-# Initialize embedding model (same as semantic_search.py)
-embedding_model = SentenceTransformer("all-MiniLM-L6-v2")
+# Per-source-file byte offsets already indexed (incremental append_only loads)
+INDEX_STATE_PATH = os.path.join(BASE_DIR, "index_state.json")
+INDEX_BATCH_SIZE = 100  # rows per Chroma upsert call
+# Lines read, embedded and stored per step; peak memory scales with this, not corpus size
+EMBED_CHUNK_SIZE = int(os.getenv("EMBED_CHUNK_SIZE", "512"))
+
+from model_registry import get_embedding_model
+from query_cache import get_query_embedding
+from incremental_source import make_mark, valid_offset, iter_appended_lines
+from frame_sampling import load_frame_timestamps, frame_timestamp, MAX_FRAME_INTERVAL
+from frame_catalog import frame_info, frame_clip_id, backfill_from_captions
+from result_processing import RESULT_CANDIDATES, encode_source_ids, cluster_hits
 
 # Initialize ChromaDB (new client API - PersistentClient for local persistence)
 client = chromadb.PersistentClient(path=CHROMA_PATH)
 
 # Use cosine distance so "1 - distance" = cosine similarity (matches sentence-transformers)
-collection = client.get_or_create_collection(
-    name="video_captions",
-    metadata={"hnsw:space": "cosine", "description": "Video frame captions and embeddings"}
-)
-
-# Audio transcriptions collection (separate from video captions)
+COLLECTION_METADATA = {
+    "video_captions": {"hnsw:space": "cosine", "description": "Video frame captions and embeddings"},
+    # Audio transcriptions collection (separate from video captions)
+    "audio_transcriptions": {"hnsw:space": "cosine", "description": "Audio transcriptions and embeddings"},
+}
+collection = client.get_or_create_collection(name="video_captions", metadata=COLLECTION_METADATA["video_captions"])
 audio_collection = client.get_or_create_collection(
-    name="audio_transcriptions",
-    metadata={"hnsw:space": "cosine", "description": "Audio transcriptions and embeddings"}
+    name="audio_transcriptions", metadata=COLLECTION_METADATA["audio_transcriptions"]
 )
 
+def _reset_collection(name):
+    """Drop and recreate a collection (full reload) without pulling every ID."""
+    try:
+        client.delete_collection(name)
+    except Exception as e:
+        print(f"⚠️ Could not clear existing data: {e}")
+    return client.get_or_create_collection(name=name, metadata=COLLECTION_METADATA[name])
+
+def encode_texts(texts):
+    """Embed texts as a float32 (n, dim) NumPy array."""
+    embeddings = get_embedding_model().encode(texts, convert_to_numpy=True)
+    return np.asarray(embeddings, dtype=np.float32)
+
+def _load_index_state():
+    if not os.path.exists(INDEX_STATE_PATH):
+        return {}
+    try:
+        with open(INDEX_STATE_PATH, "r") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+def _save_index_state(state):
+    tmp_path = INDEX_STATE_PATH + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, indent=4)
+    os.replace(tmp_path, INDEX_STATE_PATH)
+
+def _save_high_water_mark(key, path, offset):
+    state = _load_index_state()
+    state[key] = make_mark(path, offset)
+    _save_index_state(state)
+
+def _index_source_file(path, name, parse_line, label, append_only):
+    """
+    Incrementally index a "id: text" source file into a Chroma collection.
+    append_only: embed only lines appended since the persisted high-water mark (byte offset);
+    otherwise rebuild the collection from the start of the file.
+    parse_line(line) -> (id, document, metadata) or None. Returns the collection.
+    """
+    coll = client.get_or_create_collection(name=name, metadata=COLLECTION_METADATA[name])
+    offset = 0
+    skip_ids = None
+    if append_only:
+        mark = valid_offset(_load_index_state().get(name), path)
+        if mark is not None:
+            offset = mark
+        elif coll.count() > 0:
+            # No high-water mark yet (older DB): one-off diff against stored IDs
+            skip_ids = set(coll.get(include=[])["ids"])
+            print(f"🔄 No index offset for {label}; skipping {len(skip_ids)} already stored")
+    else:
+        coll = _reset_collection(name)
+
+    added = 0
+    end_offset = offset
+    batch = []
+
+    def flush():
+        # One chunk in memory at a time: encode, store, then drop before reading on
+        nonlocal added
+        ids, docs, metas = (list(col) for col in zip(*batch))
+        embeddings = encode_texts(docs)
+        for i in range(0, len(ids), INDEX_BATCH_SIZE):
+            j = i + INDEX_BATCH_SIZE
+            coll.upsert(ids=ids[i:j], documents=docs[i:j], metadatas=metas[i:j], embeddings=embeddings[i:j])
+        added += len(batch)
+        batch.clear()
+        print(f"  Stored {added} new {label}...")
+
+    for line, end_offset in iter_appended_lines(path, offset):
+        parsed = parse_line(line)
+        if parsed and (skip_ids is None or parsed[0] not in skip_ids):
+            batch.append(parsed)
+        if len(batch) >= EMBED_CHUNK_SIZE:
+            flush()
+            _save_high_water_mark(name, path, end_offset)
+    if batch:
+        flush()
+    _save_high_water_mark(name, path, end_offset)
+
+    if added:
+        print(f"✅ Stored {added} new {label} in vector database")
+    else:
+        print(f"✅ No new {label} to add to vector DB")
+    return coll
+
 def load_captions_to_vector_db(append_only=False):
     """
     Load captions.txt into vector database.
-    append_only: If True, only add new captions (by frame name), don't clear existing.
+    append_only: If True, only embed captions appended since the last run (byte offset), don't clear existing.
     """
+    global collection
     if not os.path.exists(CAPTIONS_PATH):
         print("⚠️ captions.txt not found.")
         return
 
-    captions = []
-    frames = []
-    ids = []
-
-    with open(CAPTIONS_PATH, "r") as f:
-        for idx, line in enumerate(f):
-            if ": " in line:
-                frame, caption = line.strip().split(": ", 1)
-                frames.append(frame)
-                captions.append(caption)
-                ids.append(frame)  # Use frame filename as id for deduplication
-
-    if not captions:
-        print("⚠️ No captions found.")
-        return
-
-    # If append_only, skip frames already in the DB
-    if append_only:
-        try:
-            existing = set(collection.get()["ids"])
-            to_add = [(f, c, i) for f, c, i in zip(frames, captions, ids) if i not in existing]
-            if not to_add:
-                print("✅ No new captions to add to vector DB")
-                return
-            frames, captions, ids = zip(*to_add)
-            frames, captions, ids = list(frames), list(captions), list(ids)
-            print(f"🔄 Adding {len(captions)} new captions (skipping {len(existing)} existing)...")
-        except Exception as e:
-            print(f"⚠️ Could not check existing: {e}, doing full reload")
-            append_only = False
-
     if not append_only:
-        try:
-            all_ids = collection.get()["ids"]
-            if all_ids:
-                collection.delete(ids=all_ids)
-        except Exception as e:
-            print(f"⚠️ Could not clear existing data: {e}")
-
-    # Extract timestamps for metadata
-    timestamps = []
-    for frame in frames:
-        try:
-            nums = re.findall(r"\d+", frame)
-            frame_num = int(nums[-1]) if nums else 0
-            timestamp = frame_num / 5.0
-            timestamps.append(timestamp)
-        except:
-            timestamps.append(0.0)
-
-    print(f"🔄 Generating embeddings for {len(captions)} captions...")
-    embeddings = embedding_model.encode(captions).tolist()
-
-    batch_size = 100
-    print(f"💾 Storing {len(captions)} captions in vector database...")
-    for i in range(0, len(captions), batch_size):
-        batch_end = min(i + batch_size, len(captions))
-        collection.add(
-            embeddings=embeddings[i:batch_end],
-            documents=captions[i:batch_end],
-            metadatas=[
-                {"frame": frame, "timestamp": ts}
-                for frame, ts in zip(frames[i:batch_end], timestamps[i:batch_end])
-            ],
-            ids=ids[i:batch_end]
-        )
-        print(f"  Stored {batch_end}/{len(captions)} captions...")
-    print(f"✅ Stored {len(captions)} captions in vector database")
+        backfill_from_captions(CAPTIONS_PATH)  # full reload: make sure older frames are catalogued
+    # Real frame timestamps recorded at extraction (legacy frames fall back to frame_num / 5)
+    recorded = None
+
+    def parse_line(line):
+        nonlocal recorded
+        if ": " not in line:
+            return None
+        frame, caption = line.split(": ", 1)
+        info = frame_info(frame)
+        if info is not None:
+            ts = info["timestamp"]
+        else:
+            recorded = load_frame_timestamps() if recorded is None else recorded
+            ts = frame_timestamp(frame, recorded)
+        # Use frame filename as id for deduplication
+        return frame, caption, {"frame": frame, "timestamp": ts, "clip_id": frame_clip_id(frame)}
+
+    collection = _index_source_file(CAPTIONS_PATH, "video_captions", parse_line, "captions", append_only)
 
 
 def ensure_vector_db_loaded():
@@ -131,89 +180,35 @@ def search_vector_db(query, top_k=10, threshold=0.4):
             return []
         
         # Generate query embedding
-        query_embedding = embedding_model.encode(query).tolist()
+        query_embedding = get_query_embedding(query).tolist()
         
         # Search
         results = collection.query(
             query_embeddings=[query_embedding],
-            n_results=min(50, count),
+            n_results=min(RESULT_CANDIDATES, count),
             include=["documents", "metadatas", "distances"]
         )
         
-        # Process results
-        hits = []
-        for i, (doc, metadata, distance) in enumerate(zip(
-            results["documents"][0],
-            results["metadatas"][0],
-            results["distances"][0]
-        )):
-            # Convert distance to similarity score (ChromaDB uses distance, lower is better)
-            score = 1 - distance  # Convert to similarity
-            
-            if score < threshold:
-                continue
-
-            frame = metadata.get("frame", "")
-            # Support both clip_XXX and youtube_XXX prefixes
-            m = re.match(r"clip_(\d+)_frame", frame)
-            if m:
-                clip_id = f"clip_{m.group(1)}"
-            else:
-                m = re.match(r"youtube_(\d+)_frame", frame)
-                if m:
-                    clip_id = f"youtube_{m.group(1)}"
-                else:
-                    clip_id = "0"
-            
-            hits.append({
-                "frame": frame,
-                "caption": doc,
-                "score": score,
-                "timestamp": metadata.get("timestamp", 0.0),
-                "clip_id": clip_id
-            })
-        
-        # Sort by clip_id then timestamp for clustering (cluster within same clip)
-        hits.sort(key=lambda x: (x["clip_id"], x["timestamp"]))
-        
-        # Cluster hits (same logic as semantic_search.py)
-        clips = []
-        if not hits:
-            return []
-        
-        current_clip = [hits[0]]
-        GAP_THRESHOLD = 1.0
-        
-        for hit in hits[1:]:
-            same_clip = hit["clip_id"] == current_clip[-1]["clip_id"]
-            time_gap_ok = hit["timestamp"] - current_clip[-1]["timestamp"] <= GAP_THRESHOLD
-            if same_clip and time_gap_ok:
-                current_clip.append(hit)
-            else:
-                best_hit = max(current_clip, key=lambda x: x["score"])
-                clips.append({
-                    "start": current_clip[0]["timestamp"],
-                    "end": current_clip[-1]["timestamp"],
-                    "score": best_hit["score"],
-                    "caption": best_hit["caption"],
-                    "best_frame": best_hit["frame"],
-                    "frame_count": len(current_clip)
-                })
-                current_clip = [hit]
-        
-        if current_clip:
-            best_hit = max(current_clip, key=lambda x: x["score"])
-            clips.append({
-                "start": current_clip[0]["timestamp"],
-                "end": current_clip[-1]["timestamp"],
-                "score": best_hit["score"],
-                "caption": best_hit["caption"],
-                "best_frame": best_hit["frame"],
-                "frame_count": len(current_clip)
-            })
-        
-        clips.sort(key=lambda x: x["score"], reverse=True)
-        return clips[:5]  # Return top 5 instead of 1
+        docs = results["documents"][0]
+        metas = results["metadatas"][0]
+        # Convert distance to similarity score (ChromaDB uses distance, lower is better)
+        scores = 1 - np.asarray(results["distances"][0], dtype=np.float64)
+        frames = [m.get("frame", "") for m in metas]
+        # clip_id is stored at index time; older rows fall back to the frame catalog
+        codes, _ = encode_source_ids([m.get("clip_id") or frame_clip_id(f) for m, f in zip(metas, frames)])
+        times = np.fromiter((m.get("timestamp", 0.0) for m in metas), dtype=np.float64, count=len(metas))
+
+        # Adaptive sampling can leave up to MAX_FRAME_INTERVAL between kept frames
+        clusters = cluster_hits(codes, times, scores, threshold=threshold,
+                                gap=max(1.0, MAX_FRAME_INTERVAL), limit=5)
+        return [{
+            "start": c["start"],
+            "end": c["end"],
+            "score": c["score"],
+            "caption": docs[c["index"]],
+            "best_frame": frames[c["index"]],
+            "frame_count": c["frame_count"]
+        } for c in clusters]
         
     except Exception as e:
         print(f"⚠️ Error searching vector database: {e}")
@@ -230,7 +225,7 @@ def get_sample_captions_for_suggestions(query: str, limit: int = 15):
         count = collection.count()
         if count == 0:
             return []
-        query_embedding = embedding_model.encode(query).tolist()
+        query_embedding = get_query_embedding(query).tolist()
         results = collection.query(
             query_embeddings=[query_embedding],
             n_results=min(limit, count),
@@ -254,95 +249,41 @@ def get_sample_captions_for_suggestions(query: str, limit: int = 15):
         return []
 
 
+def _transcription_clip_id(trans_id):
+    """clip_001 / youtube_001 from a transcription ID (zero-padded to 3 digits for consistency)."""
+    m = re.match(r"clip_(\d+)_audio", trans_id)
+    if m:
+        return f"clip_{m.group(1).zfill(3)}"
+    m = re.match(r"youtube_(\d+)_audio", trans_id)
+    if m:
+        return f"youtube_{m.group(1).zfill(3)}"
+    return "0"
+
 def load_transcriptions_to_vector_db(append_only=False):
     """
     Load audio_transcriptions.txt into vector database.
-    append_only: If True, only add new transcriptions (by ID), don't clear existing.
+    append_only: If True, only embed transcriptions appended since the last run (byte offset), don't clear existing.
     """
+    global audio_collection
     if not os.path.exists(TRANSCRIPTIONS_PATH):
         # Not an error - file is created when audio is processed (requires openai-whisper)
         return
 
-    transcriptions = []
-    trans_ids = []
-    timestamps = []
-
-    with open(TRANSCRIPTIONS_PATH, "r", encoding="utf-8") as f:
-        for line in f:
-            if ": " in line:
-                trans_id, text = line.strip().split(": ", 1)
-                trans_ids.append(trans_id)
-                transcriptions.append(text)
-                
-                # Extract timestamp from ID (format: prefix_audio_123.45)
-                try:
-                    match = re.search(r"_audio_([\d.]+)$", trans_id)
-                    if match:
-                        timestamps.append(float(match.group(1)))
-                    else:
-                        timestamps.append(0.0)
-                except:
-                    timestamps.append(0.0)
-
-    if not transcriptions:
-        print("⚠️ No transcriptions found.")
-        return
-
-    # If append_only, skip IDs already in the DB
-    if append_only:
+    def parse_line(line):
+        if ": " not in line:
+            return None
+        trans_id, text = line.split(": ", 1)
+        # Extract timestamp from ID (format: prefix_audio_123.45)
+        match = re.search(r"_audio_([\d.]+)$", trans_id)
         try:
-            existing = set(audio_collection.get()["ids"])
-            to_add = [(t, tid, ts) for t, tid, ts in zip(transcriptions, trans_ids, timestamps) if tid not in existing]
-            if not to_add:
-                print("✅ No new transcriptions to add to vector DB")
-                return
-            transcriptions, trans_ids, timestamps = zip(*to_add)
-            transcriptions, trans_ids, timestamps = list(transcriptions), list(trans_ids), list(timestamps)
-            print(f"🔄 Adding {len(transcriptions)} new transcriptions (skipping {len(existing)} existing)...")
-        except Exception as e:
-            print(f"⚠️ Could not check existing: {e}, doing full reload")
-            append_only = False
+            ts = float(match.group(1)) if match else 0.0
+        except ValueError:
+            ts = 0.0
+        return trans_id, text, {"transcription_id": trans_id, "timestamp": ts,
+                                "clip_id": _transcription_clip_id(trans_id)}
 
-    if not append_only:
-        try:
-            all_ids = audio_collection.get()["ids"]
-            if all_ids:
-                audio_collection.delete(ids=all_ids)
-        except Exception as e:
-            print(f"⚠️ Could not clear existing audio data: {e}")
-
-    print(f"🔄 Generating embeddings for {len(transcriptions)} transcriptions...")
-    embeddings = embedding_model.encode(transcriptions).tolist()
-
-    batch_size = 100
-    print(f"💾 Storing {len(transcriptions)} transcriptions in vector database...")
-    for i in range(0, len(transcriptions), batch_size):
-        batch_end = min(i + batch_size, len(transcriptions))
-        
-        # Extract clip_id from transcription ID (zero-pad to 3 digits for consistency)
-        clip_ids = []
-        for tid in trans_ids[i:batch_end]:
-            m = re.match(r"clip_(\d+)_audio", tid)
-            if m:
-                clip_ids.append(f"clip_{m.group(1).zfill(3)}")
-            else:
-                m = re.match(r"youtube_(\d+)_audio", tid)
-                if m:
-                    clip_ids.append(f"youtube_{m.group(1).zfill(3)}")
-                else:
-                    clip_ids.append("0")
-        
-        audio_collection.add(
-            embeddings=embeddings[i:batch_end],
-            documents=transcriptions[i:batch_end],
-            metadatas=[
-                {"transcription_id": tid, "timestamp": ts, "clip_id": cid}
-                for tid, ts, cid in zip(trans_ids[i:batch_end], timestamps[i:batch_end], clip_ids)
-            ],
-            ids=trans_ids[i:batch_end]
-        )
-        print(f"  Stored {batch_end}/{len(transcriptions)} transcriptions...")
-    print(f"✅ Stored {len(transcriptions)} transcriptions in vector database")
+    audio_collection = _index_source_file(TRANSCRIPTIONS_PATH, "audio_transcriptions", parse_line,
+                                          "transcriptions", append_only)
 
 
 def search_audio_vector_db(query, top_k=10, threshold=0.4):
@@ -352,87 +293,37 @@ def search_audio_vector_db(query, top_k=10, threshold=0.4):
         if count == 0:
             return []
         
-        query_embedding = embedding_model.encode(query).tolist()
+        query_embedding = get_query_embedding(query).tolist()
         
         results = audio_collection.query(
             query_embeddings=[query_embedding],
-            n_results=min(50, count),
+            n_results=min(RESULT_CANDIDATES, count),
             include=["documents", "metadatas", "distances"]
         )
         
-        hits = []
-        for doc, metadata, distance in zip(
-            results["documents"][0],
-            results["metadatas"][0],
-            results["distances"][0]
-        ):
-            score = 1 - distance
-            
-            if score < threshold:
-                continue
-            
-            cid = metadata.get("clip_id", "0")
-            if cid == "0":
-                tid = metadata.get("transcription_id", "")
-                m = re.match(r"clip_(\d+)_audio", tid)
-                if m:
-                    cid = f"clip_{m.group(1).zfill(3)}"
-                else:
-                    m = re.match(r"youtube_(\d+)_audio", tid)
-                    if m:
-                        cid = f"youtube_{m.group(1).zfill(3)}"
-            hits.append({
-                "transcription_id": metadata.get("transcription_id", ""),
-                "text": doc,
-                "score": score,
-                "timestamp": metadata.get("timestamp", 0.0),
-                "clip_id": cid
-            })
-        
-        # Sort and cluster similar to video search
-        hits.sort(key=lambda x: (x["clip_id"], x["timestamp"]))
-        
-        clips = []
-        if not hits:
-            return []
-        
-        current_clip = [hits[0]]
-        GAP_THRESHOLD = 2.0  # Slightly larger gap for audio (speech segments can be longer)
-        
-        for hit in hits[1:]:
-            same_clip = hit["clip_id"] == current_clip[-1]["clip_id"]
-            time_gap_ok = hit["timestamp"] - current_clip[-1]["timestamp"] <= GAP_THRESHOLD
-            if same_clip and time_gap_ok:
-                current_clip.append(hit)
-            else:
-                best_hit = max(current_clip, key=lambda x: x["score"])
-                clips.append({
-                    "start": current_clip[0]["timestamp"],
-                    "end": current_clip[-1]["timestamp"],
-                    "score": best_hit["score"],
-                    "caption": best_hit["text"],
-                    "best_frame": "",
-                    "frame_count": len(current_clip),
-                    "source": "audio",
-                    "clip_id": best_hit["clip_id"]  # Needed for clip generation (youtube_002, clip_001)
-                })
-                current_clip = [hit]
-        
-        if current_clip:
-            best_hit = max(current_clip, key=lambda x: x["score"])
-            clips.append({
-                "start": current_clip[0]["timestamp"],
-                "end": current_clip[-1]["timestamp"],
-                "score": best_hit["score"],
-                "caption": best_hit["text"],
-                "best_frame": "",
-                "frame_count": len(current_clip),
-                "source": "audio",
-                "clip_id": best_hit["clip_id"]
-            })
-        
-        clips.sort(key=lambda x: x["score"], reverse=True)
-        return clips[:5]
+        docs = results["documents"][0]
+        metas = results["metadatas"][0]
+        scores = 1 - np.asarray(results["distances"][0], dtype=np.float64)
+        clip_ids = [
+            m.get("clip_id", "0") if m.get("clip_id", "0") != "0"
+            else _transcription_clip_id(m.get("transcription_id", ""))
+            for m in metas
+        ]
+        codes, names = encode_source_ids(clip_ids)
+        times = np.fromiter((m.get("timestamp", 0.0) for m in metas), dtype=np.float64, count=len(metas))
+
+        # Slightly larger gap for audio (speech segments can be longer)
+        clusters = cluster_hits(codes, times, scores, threshold=threshold, gap=2.0, limit=5)
+        return [{
+            "start": c["start"],
+            "end": c["end"],
+            "score": c["score"],
+            "caption": docs[c["index"]],
+            "best_frame": "",
+            "frame_count": c["frame_count"],
+            "source": "audio",
+            "clip_id": names[c["source_code"]]  # Needed for clip generation (youtube_002, clip_001)
+        } for c in clusters]
         
     except Exception as e:
         print(f"⚠️ Error searching audio vector database: {e}")
@@ -1,11 +1,20 @@
 import os
+import json
+import asyncio
+import bisect
 import subprocess
-import re
-import glob
+import threading
+
+from frame_catalog import frame_source_video
 
 VIDEO_PATH = "video.mp4"
 CLIPS_DIR = "clips"
 SOURCE_CLIPS_DIR = "source_clips"
+FRAMES_DIR = "frames"
+# "fast": stream-copy (-c copy) from a keyframe near the requested start; "precise": always re-encode
+CLIP_MODE = os.getenv("CLIP_MODE", "fast")
+# How much earlier than requested a fast clip may start (seconds)
+CLIP_KEYFRAME_TOLERANCE = float(os.getenv("CLIP_KEYFRAME_TOLERANCE", "1.5"))
 
 # Ensure clips directory exists
 os.makedirs(CLIPS_DIR, exist_ok=True)
@@ -13,49 +22,24 @@ os.makedirs(CLIPS_DIR, exist_ok=True)
 
 def _get_source_video_for_frame(best_frame: str):
     """
-    From frame filename, determine which source video to use.
+    From frame filename, determine which source video to use (via the frame catalog).
     - frame_0001.jpg -> video.mp4 (legacy YouTube mode)
     - youtube_001_frame_0001.jpg -> source_clips/youtube_001.mp4
     - clip_001_frame_0001.jpg -> source_clips/clip_001.*
     Returns (video_path, source_id_or_none).
     """
-    # Check for uploaded clip format
-    m = re.match(r"clip_(\d+)_frame_\d+", best_frame)
-    if m:
-        clip_num = m.group(1).zfill(3)  # Normalize to 3 digits
-        pattern = os.path.join(SOURCE_CLIPS_DIR, f"clip_{clip_num}.*")
-        matches = glob.glob(pattern)
-        if matches:
-            return matches[0], f"clip_{clip_num}"
-        # Fallback: try unpadded (e.g. clip_1)
-        pattern2 = os.path.join(SOURCE_CLIPS_DIR, f"clip_{m.group(1)}.*")
-        matches2 = glob.glob(pattern2)
-        if matches2:
-            return matches2[0], f"clip_{m.group(1)}"
-    
-    # Check for YouTube format with prefix - now stored in source_clips/
-    m = re.match(r"youtube_(\d+)_frame_\d+", best_frame)
-    if m:
-        youtube_num = m.group(1).zfill(3)  # Normalize to 3 digits
-        youtube_path = os.path.join(SOURCE_CLIPS_DIR, f"youtube_{youtube_num}.mp4")
-        if os.path.exists(youtube_path):
-            return youtube_path, f"youtube_{youtube_num}"
-        # Fallback to video.mp4 for legacy
-        return VIDEO_PATH, f"youtube_{youtube_num}"
-    
-    return VIDEO_PATH, None
+    return frame_source_video(best_frame)
 
 
-def ensure_clip(start: float, end: float, best_frame: str = None) -> str:
+def clip_spec(start: float, end: float, best_frame: str = None):
     """
-    Ensures a clip exists for the given start/end times.
+    Clip filename and render parameters for a time range.
     If best_frame is provided (e.g. clip_001_frame_0001.jpg), uses that clip's source video.
-    Returns the filename of the generated clip.
+    Returns (filename, (source_video, start, end)).
     """
     # Round to reasonable precision to avoid duplicate clips for micro-diffs
     start = round(start, 2)
     end = round(end, 2)
-    duration = round(end - start, 2)
 
     source_video, source_id = _get_source_video_for_frame(best_frame or "frame_0001.jpg")
 
@@ -64,11 +48,140 @@ def ensure_clip(start: float, end: float, best_frame: str = None) -> str:
         filename = f"{source_id}_{start}_{end}.mp4"
     else:
         filename = f"clip_{start}_{end}.mp4"
-    output_path = os.path.join(CLIPS_DIR, filename)
+    return filename, (source_video, start, end)
 
-    if os.path.exists(output_path):
-        return filename
 
+def keyframe_index_path(source_video: str) -> str:
+    """Keyframe index stored next to the source (source_clips/clip_001.mp4.keyframes.json)."""
+    return f"{source_video}.keyframes.json"
+
+
+def build_keyframe_index(source_video: str):
+    """Probe keyframe timestamps (packet flags only, no decoding) and save them next to the source."""
+    cmd = [
+        "ffprobe", "-v", "error",
+        "-select_streams", "v:0",
+        "-show_entries", "packet=pts_time,flags",
+        "-of", "csv=p=0",
+        source_video
+    ]
+    out = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+    keyframes = []
+    for line in out.splitlines():
+        pts, _, flags = line.partition(",")
+        if "K" in flags:
+            try:
+                keyframes.append(round(float(pts), 6))
+            except ValueError:
+                pass
+    keyframes.sort()
+    st = os.stat(source_video)
+    index_path = keyframe_index_path(source_video)
+    tmp_path = index_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"source_size": st.st_size, "source_mtime": st.st_mtime, "keyframes": keyframes}, f)
+    os.replace(tmp_path, index_path)
+    _keyframe_cache[source_video] = (st.st_mtime, keyframes)
+    return keyframes
+
+
+def _read_keyframe_index(source_video: str):
+    """Saved keyframes if the index matches the current source file, else None."""
+    try:
+        st = os.stat(source_video)
+        with open(keyframe_index_path(source_video), "r") as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if index.get("source_size") != st.st_size or index.get("source_mtime") != st.st_mtime:
+        return None
+    return index.get("keyframes") or None
+
+
+def ensure_keyframe_index(source_video: str, update_status=print):
+    """Build the keyframe index at ingest (skipped when a current one exists)."""
+    if _read_keyframe_index(source_video) is not None:
+        return
+    try:
+        keyframes = build_keyframe_index(source_video)
+        update_status(f"🔑 Indexed {len(keyframes)} keyframes for {os.path.basename(source_video)}")
+    except (subprocess.CalledProcessError, OSError) as e:
+        update_status(f"⚠️ Keyframe index failed for {os.path.basename(source_video)}: {e}")
+
+
+_keyframe_cache = {}  # source path -> (mtime, keyframes)
+
+def load_keyframes(source_video: str):
+    """Sorted keyframe timestamps of a source; builds the index on first use for older sources."""
+    try:
+        mtime = os.path.getmtime(source_video)
+    except OSError:
+        return None
+    cached = _keyframe_cache.get(source_video)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    keyframes = _read_keyframe_index(source_video)
+    if keyframes is None:
+        try:
+            keyframes = build_keyframe_index(source_video)
+        except (subprocess.CalledProcessError, OSError):
+            return None
+    _keyframe_cache[source_video] = (mtime, keyframes)
+    return keyframes
+
+
+def _fast_clip_start(source_video: str, start: float):
+    """
+    Keyframe to start a stream-copy clip from, or None if the nearest keyframe at/before
+    start is more than CLIP_KEYFRAME_TOLERANCE seconds early (then re-encode for an exact cut).
+    Only the start needs a keyframe; a stream copy can stop on any packet.
+    """
+    keyframes = load_keyframes(source_video)
+    if not keyframes:
+        return None
+    i = bisect.bisect_right(keyframes, start + 1e-3) - 1
+    if i < 0 or start - keyframes[i] > CLIP_KEYFRAME_TOLERANCE:
+        return None
+    return keyframes[i]
+
+
+def _run_ffmpeg(cmd, tmp_path, output_path) -> bool:
+    result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    if result.returncode != 0 or not os.path.exists(tmp_path) or os.path.getsize(tmp_path) == 0:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
+    os.replace(tmp_path, output_path)
+    return True
+
+
+def render_clip(source_video: str, start: float, end: float, output_path: str, mode: str = None) -> bool:
+    """
+    Write [start, end] of source_video to output_path. Writes a temp file first so a partial clip is never served.
+    mode "fast" stream-copies from the nearest keyframe when it is close enough; otherwise (or if the
+    copy fails, e.g. codec not allowed in MP4) the clip is re-encoded with an exact cut.
+    """
+    mode = mode or CLIP_MODE
+    tmp_path = f"{output_path}.{os.getpid()}.{threading.get_ident()}.part.mp4"
+
+    if mode == "fast":
+        key_start = _fast_clip_start(source_video, start)
+        if key_start is not None:
+            cmd_copy = [
+                "ffmpeg",
+                "-y",
+                "-ss", str(key_start),
+                "-i", source_video,
+                "-t", str(round(end - key_start, 3)),
+                "-c", "copy",
+                "-avoid_negative_ts", "make_zero",
+                "-movflags", "+faststart",
+                tmp_path
+            ]
+            if _run_ffmpeg(cmd_copy, tmp_path, output_path):
+                return True
+
+    duration = round(end - start, 2)
     cmd_precise = [
         "ffmpeg",
         "-y",
@@ -78,10 +191,70 @@ def ensure_clip(start: float, end: float, best_frame: str = None) -> str:
         "-c:v", "libx264",
         "-c:a", "aac",
         "-strict", "experimental",
+        tmp_path
+    ]
+    return _run_ffmpeg(cmd_precise, tmp_path, output_path)
+
+
+def ensure_clip(start: float, end: float, best_frame: str = None) -> str:
+    """
+    Ensures a clip exists for the given start/end times (waits for the render).
+    Search paths use clip_service.request_clip instead, which returns immediately.
+    Returns the filename of the generated clip.
+    """
+    from clip_service import ensure_clip as ensure_clip_rendered
+    return ensure_clip_rendered(start, end, best_frame)
+
+
+def _thumbnail_command(frame_name: str, output_path: str):
+    """ffmpeg command rendering one frame from its source video, or None if the source is missing."""
+    from frame_sampling import lookup_frame_timestamp
+
+    source_video, _ = _get_source_video_for_frame(frame_name)
+    if not source_video or not os.path.exists(source_video):
+        return None
+    os.makedirs(FRAMES_DIR, exist_ok=True)
+    return [
+        "ffmpeg",
+        "-y",
+        "-ss", str(lookup_frame_timestamp(frame_name)),
+        "-i", source_video,
+        "-frames:v", "1",
+        "-q:v", "3",
         output_path
     ]
 
-    print(f"Generating clip: {filename}...")
-    subprocess.run(cmd_precise, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
 
-    return filename
+def ensure_frame_thumbnail(frame_name: str):
+    """
+    Return path to frames/<frame_name>, rendering it from the source video if missing.
+    Streaming ingest writes no JPEGs, so result thumbnails (best_frame) are created on first request.
+    Returns None if the frame cannot be rendered.
+    """
+    output_path = os.path.join(FRAMES_DIR, frame_name)
+    if os.path.exists(output_path):
+        return output_path
+    cmd = _thumbnail_command(frame_name, output_path)
+    if cmd is None:
+        return None
+    subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return output_path if os.path.exists(output_path) else None
+
+
+async def run_ffmpeg_async(cmd) -> int:
+    """Run an ffmpeg command as an asyncio subprocess (no thread blocked while it runs). Returns the exit code."""
+    proc = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.DEVNULL,
+                                                stderr=asyncio.subprocess.DEVNULL)
+    return await proc.wait()
+
+
+async def ensure_frame_thumbnail_async(frame_name: str):
+    """ensure_frame_thumbnail for async endpoints."""
+    output_path = os.path.join(FRAMES_DIR, frame_name)
+    if os.path.exists(output_path):
+        return output_path
+    cmd = _thumbnail_command(frame_name, output_path)
+    if cmd is None:
+        return None
+    await run_ffmpeg_async(cmd)
+    return output_path if os.path.exists(output_path) else None